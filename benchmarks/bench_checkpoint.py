@@ -0,0 +1,161 @@
+"""Checkpoint size, write time and warm-restart restore time for large state.
+
+Builds the state TrafficMonitor checkpoints (protocol counters, a 30-day
+time series, a summary ring of ``--summaries`` records and ``--switches``
+MAC tables of ``--macs`` entries each), then measures:
+
+* capture: copying the state on the event loop (the only part that blocks
+  packet-in handling; encoding and writing run in a thread);
+* a full snapshot and an increment after ``--delta-packets`` more packets;
+* restore: loading the snapshot plus ``--deltas`` increments and applying
+  them to fresh objects, as the controller does at startup.
+
+The restored state is compared with the original at the end.
+
+Usage:
+    python benchmarks/bench_checkpoint.py [--summaries 2000000] [--switches 100]
+                                          [--macs 10000] [--deltas 29]
+                                          [--dir /tmp/tm_checkpoint]
+"""
+import argparse
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.frames import synthetic_frames  # noqa: E402
+from traffic_audit.checkpoint import (CheckpointWriter, ControllerState,  # noqa: E402
+                                       load_checkpoint)
+from traffic_audit.classifier import OTHER, ProtocolClassifier  # noqa: E402
+from traffic_audit.decode import decode_frame  # noqa: E402
+from traffic_audit.intake import UNCLASSIFIED  # noqa: E402
+from traffic_audit.l2 import MacTable  # noqa: E402
+from traffic_audit.ringbuffer import SummaryRing  # noqa: E402
+from traffic_audit.timeseries import ProtocolTimeSeries  # noqa: E402
+
+
+class State(object):
+    """The parts of TrafficMonitor that are checkpointed, built as it builds them"""
+
+    def __init__(self, classifier, capacity, mac_size):
+        self.labels = classifier.protocols[:-1] + (UNCLASSIFIED, OTHER)
+        self.protocol_stats = dict((proto, {'packets': 0, 'bytes': 0})
+                                   for proto in self.labels)
+        self.history = ProtocolTimeSeries(self.labels)
+        self.ring = SummaryRing(capacity, classifier.protocols)
+        self.mac_tables = {}
+        # 与控制器使用同一套保存和恢复逻辑
+        self.checkpoint = ControllerState(self.protocol_stats, self.history, self.ring,
+                                          self.mac_tables, lambda: MacTable(mac_size, 300.0))
+
+
+def traffic(state, decoded, packets, now, step, switches, macs):
+    for n in range(packets):
+        headers, protocol = decoded[n & 4095]
+        now += step
+        entry = state.protocol_stats[protocol]
+        entry['packets'] += 1
+        entry['bytes'] += headers.length
+        state.history.add(protocol, 1, headers.length, now)
+        dpid = n % switches + 1
+        state.ring.append(now, dpid, n & 3, headers, protocol)
+        state.mac_tables[dpid].learn(struct.pack('!HI', 0x0200, n % macs), n & 3, now)
+    return now
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--summaries', type=int, default=2000000,
+                        help='summary ring capacity, filled completely')
+    parser.add_argument('--switches', type=int, default=100)
+    parser.add_argument('--macs', type=int, default=10000, help='MAC entries per switch')
+    parser.add_argument('--deltas', type=int, default=29,
+                        help='increments after the full snapshot (default: 5 min at 10 s)')
+    parser.add_argument('--delta-packets', type=int, default=20000,
+                        help='packets between two increments')
+    parser.add_argument('--dir', help='empty checkpoint directory to keep the files in '
+                        '(default: a temporary one, removed afterwards)')
+    args = parser.parse_args()
+
+    classifier = ProtocolClassifier()
+    decoded = []
+    for data in synthetic_frames(4096):
+        headers = decode_frame(data)
+        decoded.append((headers, classifier.classify(headers)))
+    state = State(classifier, args.summaries, args.macs)
+
+    now = time.time()
+    started = time.perf_counter()
+    # 30 天的历史数据，每 10 秒一个点
+    for n in range(30 * 86400 // 10):
+        state.history.add(decoded[n & 4095][1], 1, 100, now - 30 * 86400 + n * 10)
+    for dpid in range(1, args.switches + 1):
+        table = state.mac_tables[dpid] = MacTable(args.macs, 300.0)
+        base = dpid << 24
+        for n in range(args.macs):
+            table.learn(struct.pack('!HI', 0x0200, base + n), n % 48 + 1, now)
+    now = traffic(state, decoded, args.summaries, now, 1e-4, args.switches, args.macs)
+    print('state: %d summaries, %d MAC entries on %d switches, %d history tiers '
+          '(built in %.1f s)' % (state.ring.total, args.switches * args.macs, args.switches,
+                                 len(state.history.tiers), time.perf_counter() - started))
+
+    directory = args.dir or tempfile.mkdtemp(prefix='tm_checkpoint_')
+    writer = CheckpointWriter(directory)
+    try:
+        snapshot, capture = timed(state.checkpoint.capture, True, now)
+        size, write = timed(writer.write_full, snapshot)
+        del snapshot
+        print('full:      %8.1f MB  capture %7.1f ms  encode+write+fsync %7.1f ms' % (
+            size / 1048576.0, capture * 1000, write * 1000))
+        captures = writes = 0.0
+        for _ in range(args.deltas):
+            now = traffic(state, decoded, args.delta_packets, now, 5e-4,
+                          args.switches, args.macs)
+            delta, capture = timed(state.checkpoint.capture, False, now)
+            size, write = timed(writer.append_delta, delta)
+            captures += capture
+            writes += write
+        if args.deltas:
+            print('increment: %8.1f MB  capture %7.1f ms  encode+write+fsync %7.1f ms  '
+                  '(average of %d, %d packets each)' % (
+                      writer.delta_bytes / args.deltas / 1048576.0,
+                      captures / args.deltas * 1000, writes / args.deltas * 1000,
+                      args.deltas, args.delta_packets))
+        writer.close()
+
+        (full, deltas), load = timed(load_checkpoint, directory)
+        restored = State(classifier, args.summaries, args.macs)
+        errors, apply = timed(restored.checkpoint.restore, full, deltas)
+        print('restore:   load %.2f s + apply %.2f s = %.2f s (%d increments)' % (
+            load, apply, load + apply, len(deltas)))
+    finally:
+        if not args.dir:
+            shutil.rmtree(directory)
+
+    checks = [
+        ('all parts applied', not errors),
+        ('protocol counters', restored.protocol_stats == state.protocol_stats),
+        ('history', restored.history.to_state() == state.history.to_state()),
+        ('summaries', restored.ring.total == state.ring.total and
+         restored.ring.to_state() == state.ring.to_state()),
+        ('MAC tables', sorted(restored.mac_tables) == sorted(state.mac_tables) and
+         all(len(restored.mac_tables[dpid]) == len(table)
+             for dpid, table in state.mac_tables.items())),
+    ]
+    for name, ok in checks:
+        print('  %-18s %s' % (name, 'ok' if ok else 'MISMATCH'))
+    sys.exit(0 if all(ok for _, ok in checks) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,102 @@
+"""Packets/sec of the packet-in decode path, before and after single-pass decoding.
+
+Usage:
+    python benchmarks/bench_decode.py [--pcap capture.pcap] [--count N]
+
+"before" repeats what _packet_in_handler used to do per frame (ryu's
+packet.Packet, two _identify_protocol calls and the get_protocol lookups of
+the summary); it is skipped when ryu is not installed.  "after" is
+decode_frame plus one classification.
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.frames import read_pcap, synthetic_frames  # noqa: E402
+from traffic_audit.classifier import ProtocolClassifier  # noqa: E402
+from traffic_audit.decode import decode_frame  # noqa: E402
+
+try:
+    from ryu.lib.packet import packet, ethernet, ipv4, tcp, udp, icmp
+except ImportError:
+    packet = None
+
+
+def _legacy_identify(pkt):
+    ip_pkt = pkt.get_protocol(ipv4.ipv4)
+    tcp_pkt = pkt.get_protocol(tcp.tcp)
+    udp_pkt = pkt.get_protocol(udp.udp)
+    icmp_pkt = pkt.get_protocol(icmp.icmp)
+    if not ip_pkt:
+        return 'other'
+    if tcp_pkt:
+        for port, name in ((80, 'http'), (443, 'https'), (21, 'ftp'),
+                           (25, 'smtp'), (110, 'pop3'), (143, 'imap'),
+                           (22, 'ssh')):
+            if tcp_pkt.dst_port == port or tcp_pkt.src_port == port:
+                return name
+    if udp_pkt:
+        if udp_pkt.dst_port == 53 or udp_pkt.src_port == 53:
+            return 'dns'
+        if udp_pkt.dst_port in (67, 68) or udp_pkt.src_port in (67, 68):
+            return 'dhcp'
+    if icmp_pkt:
+        return 'icmp'
+    return 'other'
+
+
+def before(frames):
+    for data in frames:
+        pkt = packet.Packet(data)
+        eth_pkt = pkt.get_protocol(ethernet.ethernet)
+        _legacy_identify(pkt)
+        _legacy_identify(pkt)
+        eth_pkt = pkt.get_protocol(ethernet.ethernet)
+        ip_pkt = pkt.get_protocol(ipv4.ipv4)
+        if ip_pkt:
+            pkt.get_protocol(tcp.tcp)
+            pkt.get_protocol(udp.udp)
+        del eth_pkt
+
+
+def after(frames):
+    classify = ProtocolClassifier().classify
+    for data in frames:
+        classify(decode_frame(data))
+
+
+def measure(fn, frames, rounds):
+    best = None
+    for _ in range(rounds):
+        start = time.perf_counter()
+        fn(frames)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return len(frames) / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pcap', help='replay frames from a capture file')
+    parser.add_argument('--count', type=int, default=100000)
+    parser.add_argument('--rounds', type=int, default=3)
+    args = parser.parse_args()
+
+    if args.pcap:
+        frames = [data for _, data in read_pcap(args.pcap)][:args.count]
+    else:
+        frames = synthetic_frames(args.count)
+
+    print('frames: %d' % len(frames))
+    if packet is not None:
+        print('before: %12.0f pkt/s' % measure(before, frames, args.rounds))
+    else:
+        print('before: skipped (ryu is not installed)')
+    print('after:  %12.0f pkt/s' % measure(after, frames, args.rounds))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,124 @@
+"""Throughput and memory of the MAC learning table with many hosts.
+
+Replays a stream of (source MAC, destination MAC, port) over ``--macs``
+hosts, learning the source and looking up the destination of every
+packet as the packet-in handler does.  It compares MacTable with the old
+unbounded dict of formatted addresses plus a log line per packet, and
+shows eviction when the table is smaller than the host population.
+
+Usage:
+    python benchmarks/bench_mac.py [--macs 100000] [--packets 1000000]
+                                   [--size 8192] [--moves 0.001]
+"""
+import argparse
+import logging
+import os
+import random
+import struct
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from traffic_audit.decode import mac_str  # noqa: E402
+from traffic_audit.l2 import MOVED, REFRESHED, LogLimiter, MacTable  # noqa: E402
+
+
+def packet_stream(count, macs, ports, moves, seed):
+    """Return [(src, dst, port)]: every host once, then random pairs with some moves"""
+    rnd = random.Random(seed)
+    addrs = [struct.pack('!HI', 0x0200, i + 1) for i in range(macs)]
+    home = [rnd.randrange(1, ports + 1) for _ in range(macs)]
+    stream = [(addrs[i], addrs[rnd.randrange(macs)], home[i]) for i in range(macs)]
+    for _ in range(max(count - macs, 0)):
+        a = rnd.randrange(macs)
+        if rnd.random() < moves:
+            home[a] = rnd.randrange(1, ports + 1)
+        stream.append((addrs[a], addrs[rnd.randrange(macs)], home[a]))
+    return stream
+
+
+def run_old(stream, logger):
+    # 原来的实现：格式化地址、无上限的字典、每个包一条日志
+    mac_to_port = {}
+    for src, dst, port in stream:
+        src_mac = mac_str(src)
+        dst_mac = mac_str(dst)
+        mac_to_port.setdefault(1, {})[src_mac] = port
+        logger.info("学习到交换机 %s 的 MAC: %s -> 端口: %s", 1, src_mac, port)
+        if dst_mac in mac_to_port.get(1, {}):
+            mac_to_port[1][dst_mac]
+    return mac_to_port
+
+
+def run_table(stream, size, logger, step):
+    table = MacTable(size, aging=300.0)
+    limiter = LogLimiter(10.0)
+    now = 0.0
+    for src, dst, port in stream:
+        now += step
+        result, old = table.learn(src, port, now)
+        if result == REFRESHED:
+            pass
+        elif limiter.allow(('move' if result == MOVED else 'learn', 1), now) is not None:
+            logger.info("学习到交换机 %s 的 MAC: %s -> 端口: %s", 1, mac_str(src), port)
+        table.lookup(dst, now)
+    return table
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--macs', type=int, default=100000)
+    parser.add_argument('--packets', type=int, default=1000000)
+    parser.add_argument('--ports', type=int, default=48)
+    parser.add_argument('--size', type=int, default=8192,
+                        help='table size for the eviction run')
+    parser.add_argument('--moves', type=float, default=0.001,
+                        help='fraction of packets whose source moved to another port')
+    args = parser.parse_args()
+
+    stream = packet_stream(args.packets, args.macs, args.ports, args.moves, 1)
+    # 日志写到 /dev/null，只计格式化和处理器的开销
+    devnull = open(os.devnull, 'w')
+    logger = logging.getLogger('bench_mac')
+    logger.addHandler(logging.StreamHandler(devnull))
+    logger.setLevel(logging.INFO)
+    logger.propagate = False
+    # 整个流对应 60 秒的流量
+    step = 60.0 / len(stream)
+
+    runs = (
+        ('old dict + log', lambda: run_old(stream, logger)),
+        ('MacTable', lambda: run_table(stream, args.macs, logger, step)),
+        ('MacTable %d' % args.size, lambda: run_table(stream, args.size, logger, step)),
+    )
+    print('packets: %d, hosts: %d' % (len(stream), args.macs))
+    for name, run in runs:
+        start = time.perf_counter()
+        result = run()
+        elapsed = time.perf_counter() - start
+        # 内存单独测量，tracemalloc 会显著拖慢插入
+        del result
+        tracemalloc.start()
+        kept = run()
+        memory = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+        extra = ''
+        if isinstance(kept, MacTable):
+            stats = kept.stats()
+            extra = '  size %d, moves %d, evicted %d' % (
+                stats['size'], stats['moves'], stats['evicted'])
+        del kept
+        print('%-16s %10.0f packets/s  %6.1f MB%s' % (
+            name, len(stream) / elapsed, memory / 1048576.0, extra))
+
+    table = run_table(stream, args.macs, logger, step)
+    start = time.perf_counter()
+    table.expire(60.0 + 300.0)
+    print('full aging sweep of %d entries: %.1f ms' % (
+        args.macs, (time.perf_counter() - start) * 1000))
+
+
+if __name__ == '__main__':
+    main()
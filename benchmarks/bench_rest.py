@@ -0,0 +1,166 @@
+"""Requests/sec of the summary/protocol endpoints under concurrent pollers.
+
+Offline (default): replays the encode path of /stats/packet_summaries
+without ryu.  Packets keep arriving while ``--pollers`` dashboards each
+poll once per ``--interval``; it compares encoding every request with
+the shared snapshot cache, plus the effect of ETag revalidation.
+
+Live: with --url, runs ``--pollers`` threads polling a running controller
+over HTTP, optionally revalidating with If-None-Match and asking for gzip.
+
+Usage:
+    python benchmarks/bench_rest.py [--pollers 10] [--summaries 1000]
+    python benchmarks/bench_rest.py --url http://localhost:8080/stats/packet_summaries \\
+                                    --pollers 10 --duration 10 [--etag] [--gzip]
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+import urllib.error
+import urllib.request
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.frames import synthetic_frames  # noqa: E402
+from traffic_audit.classifier import ProtocolClassifier  # noqa: E402
+from traffic_audit.decode import decode_frame  # noqa: E402
+from traffic_audit.restcache import SnapshotCache, etag_matches  # noqa: E402
+from traffic_audit.ringbuffer import SummaryRing  # noqa: E402
+
+
+def offline(args):
+    classifier = ProtocolClassifier()
+    decoded = []
+    for data in synthetic_frames(4096):
+        headers = decode_frame(data)
+        decoded.append((headers, classifier.classify(headers)))
+    ring = SummaryRing(100000, classifier.protocols)
+    state = {'epoch': 0}
+
+    def traffic(n):
+        # 每个轮询间隔之间到达 --pps * --interval 个数据包
+        for i in range(n):
+            headers, protocol = decoded[(ring.total + i) & 4095]
+            ring.append(time.time(), 1, 1, headers, protocol)
+        state['epoch'] += n
+
+    def build():
+        return json.dumps({'success': True,
+                           'packet_summaries': ring.latest(args.summaries),
+                           'cursor': ring.total}).encode('utf-8')
+
+    traffic(ring.capacity)
+    per_interval = int(args.pps * args.interval)
+    rounds = args.rounds
+
+    def run(mode):
+        cache = SnapshotCache(max_age=args.interval)
+        etags = [None] * args.pollers
+        sent = not_modified = 0
+        clock = 0.0
+        busy = 0.0
+        for _ in range(rounds):
+            traffic(per_interval)
+            clock += args.interval
+            started = time.perf_counter()
+            for p in range(args.pollers):
+                if mode == 'direct':
+                    body = build()
+                else:
+                    snapshot = cache.get(('packet_summaries',), state['epoch'], build, clock)
+                    if mode == 'etag' and etag_matches(etags[p], (snapshot.etag,)):
+                        not_modified += 1
+                        continue
+                    etags[p] = snapshot.etag
+                    body = snapshot.body
+                sent += len(body)
+            busy += time.perf_counter() - started
+        requests = rounds * args.pollers
+        return requests / busy, sent / float(requests), not_modified
+
+    print('pollers: %d, summaries per response: %d, %d packets between polls' % (
+        args.pollers, args.summaries, per_interval))
+    for mode in ('direct', 'cached', 'etag'):
+        rps, avg_bytes, not_modified = run(mode)
+        print('%-7s %10.0f req/s  %9.0f bytes/response  %d not modified' % (
+            mode, rps, avg_bytes, not_modified))
+
+
+def live(args):
+    stop = time.time() + args.duration
+    results = []
+    lock = threading.Lock()
+
+    def poller():
+        etag = None
+        done = not_modified = errors = received = 0
+        latencies = []
+        while time.time() < stop:
+            req = urllib.request.Request(args.url)
+            if args.gzip:
+                req.add_header('Accept-Encoding', 'gzip')
+            if args.etag and etag:
+                req.add_header('If-None-Match', etag)
+            started = time.perf_counter()
+            try:
+                with urllib.request.urlopen(req, timeout=10) as resp:
+                    received += len(resp.read())
+                    etag = resp.headers.get('ETag')
+            except urllib.error.HTTPError as e:
+                if e.code == 304:
+                    not_modified += 1
+                else:
+                    errors += 1
+            except OSError:
+                errors += 1
+            latencies.append(time.perf_counter() - started)
+            done += 1
+            if args.interval:
+                time.sleep(args.interval)
+        with lock:
+            results.append((done, not_modified, errors, received, latencies))
+
+    threads = [threading.Thread(target=poller) for _ in range(args.pollers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    done = sum(r[0] for r in results)
+    latencies = sorted(l for r in results for l in r[4])
+    print('requests:      %d (%.0f/s)' % (done, done / float(args.duration)))
+    print('not modified:  %d' % sum(r[1] for r in results))
+    print('errors:        %d' % sum(r[2] for r in results))
+    print('bytes/request: %.0f' % (sum(r[3] for r in results) / float(max(done, 1))))
+    if latencies:
+        print('p50 / p99:     %.1f / %.1f ms' % (
+            latencies[len(latencies) // 2] * 1000,
+            latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--pollers', type=int, default=10)
+    parser.add_argument('--summaries', type=int, default=1000,
+                        help='summaries per response (offline)')
+    parser.add_argument('--pps', type=float, default=2000,
+                        help='packets per second arriving between polls (offline)')
+    parser.add_argument('--rounds', type=int, default=50, help='poll rounds (offline)')
+    parser.add_argument('--interval', type=float, default=1.0,
+                        help='seconds between polls of one poller')
+    parser.add_argument('--url', help='poll a running controller instead')
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--etag', action='store_true', help='send If-None-Match')
+    parser.add_argument('--gzip', action='store_true', help='accept gzip')
+    args = parser.parse_args()
+    if args.url:
+        live(args)
+    else:
+        offline(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Insert rate and memory of the packet summary ring buffer.
+
+Usage:
+    python benchmarks/bench_ring.py [--capacity 1000000] [--inserts 3000000]
+"""
+import argparse
+import os
+import resource
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.frames import synthetic_frames  # noqa: E402
+from traffic_audit.classifier import ProtocolClassifier  # noqa: E402
+from traffic_audit.decode import decode_frame  # noqa: E402
+from traffic_audit.ringbuffer import RECORD_SIZE, SummaryRing  # noqa: E402
+
+
+def rss_mb():
+    # Linux 上 ru_maxrss 的单位是 KB
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--capacity', type=int, default=1000000)
+    parser.add_argument('--inserts', type=int, default=3000000)
+    args = parser.parse_args()
+
+    classifier = ProtocolClassifier()
+    decoded = []
+    for data in synthetic_frames(4096):
+        headers = decode_frame(data)
+        decoded.append((headers, classifier.classify(headers)))
+
+    base = rss_mb()
+    ring = SummaryRing(args.capacity, classifier.protocols)
+    allocated = rss_mb()
+
+    append = ring.append
+    now = time.time()
+    start = time.perf_counter()
+    for n in range(args.inserts):
+        headers, protocol = decoded[n & 4095]
+        append(now, 1, 1, headers, protocol)
+    elapsed = time.perf_counter() - start
+
+    start = time.perf_counter()
+    ring.latest(1000)
+    read = time.perf_counter() - start
+
+    print('capacity:       %d (%d bytes/record)' % (args.capacity, RECORD_SIZE))
+    print('inserts:        %d' % args.inserts)
+    print('insert rate:    %.0f/s' % (args.inserts / elapsed))
+    print('latest(1000):   %.2f ms' % (read * 1000))
+    print('ring RSS:       %.1f MB' % (allocated - base))
+    print('peak RSS:       %.1f MB' % rss_mb())
+
+
+if __name__ == '__main__':
+    main()
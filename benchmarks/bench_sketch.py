@@ -0,0 +1,141 @@
+"""Accuracy, throughput and memory of the heavy-hitter sketches.
+
+Feeds a Zipf-distributed key stream mixed with a scan of unique keys into
+WindowedTopK and into an exact dict, then compares the top N of both.
+Exits nonzero when the top-N recall or the maximum relative error of the
+estimated counts misses its bound.  Unless ``--max-error`` is given, the
+error bound is the Count-Min guarantee e * N / width (N: bytes in the
+window) relative to the smallest true top-N count, so it follows
+``--packets`` and ``--width``.
+
+Usage:
+    python benchmarks/bench_sketch.py [--packets 1000000] [--keys 100000]
+                                      [--scan 0.3] [--top 20]
+                                      [--min-recall 0.95] [--max-error 0.02]
+"""
+import argparse
+import bisect
+import collections
+import math
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from traffic_audit.sketch import WindowedTopK  # noqa: E402
+
+
+def key_stream(count, keys, scan, skew, seed):
+    """Return [(key, bytes)]: Zipf(``skew``) keys plus a ``scan`` fraction of unique ones"""
+    rnd = random.Random(seed)
+    weights = [1.0 / (rank + 1) ** skew for rank in range(keys)]
+    cumulative = []
+    total = 0.0
+    for w in weights:
+        total += w
+        cumulative.append(total)
+    stream = []
+    next_scan = keys
+    for _ in range(count):
+        if rnd.random() < scan:
+            # 扫描流量：每个包一个新键
+            key = next_scan
+            next_scan += 1
+        else:
+            key = bisect.bisect_left(cumulative, rnd.random() * total)
+        stream.append((key, rnd.choice((64, 64, 576, 1500))))
+    return stream
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--packets', type=int, default=1000000)
+    parser.add_argument('--keys', type=int, default=100000)
+    parser.add_argument('--scan', type=float, default=0.3,
+                        help='fraction of packets with a never-seen-before key')
+    parser.add_argument('--skew', type=float, default=1.1)
+    parser.add_argument('--top', type=int, default=20)
+    parser.add_argument('--capacity', type=int, default=256)
+    parser.add_argument('--width', type=int, default=1024)
+    parser.add_argument('--min-recall', type=float, default=0.95,
+                        help='lowest acceptable top-N recall')
+    parser.add_argument('--max-error', type=float,
+                        help='largest acceptable relative error of an estimated count '
+                        '(default: e * N / width relative to the smallest true top-N count)')
+    args = parser.parse_args()
+
+    stream = key_stream(args.packets, args.keys, args.scan, args.skew, 1)
+    # 整个流放进一个 60 秒窗口，分成 6 个子窗口
+    step = 60.0 / len(stream)
+
+    def feed_sketch():
+        topk = WindowedTopK(window=60, slot=10, capacity=args.capacity, width=args.width)
+        for n, (key, nbytes) in enumerate(stream):
+            topk.add(key, nbytes, n * step)
+        return topk
+
+    def feed_exact():
+        exact = collections.defaultdict(int)
+        for key, nbytes in stream:
+            exact[key] += nbytes
+        return exact
+
+    start = time.perf_counter()
+    topk = feed_sketch()
+    sketch_time = time.perf_counter() - start
+    start = time.perf_counter()
+    exact = feed_exact()
+    exact_time = time.perf_counter() - start
+
+    # 内存单独测量，tracemalloc 会把插入速度拖慢一个数量级
+    tracemalloc.start()
+    kept = feed_sketch()
+    sketch_mem = tracemalloc.get_traced_memory()[0]
+    del kept
+    tracemalloc.stop()
+    tracemalloc.start()
+    kept = feed_exact()
+    exact_mem = tracemalloc.get_traced_memory()[0]
+    del kept
+    tracemalloc.stop()
+
+    now = (len(stream) - 1) * step
+    start = time.perf_counter()
+    estimated = topk.top(args.top, 60, now)
+    query_time = time.perf_counter() - start
+    truth = sorted(exact.items(), key=lambda item: item[1], reverse=True)[:args.top]
+
+    true_keys = set(key for key, _ in truth)
+    recall = len(true_keys & set(key for key, _ in estimated)) / float(len(truth))
+    errors = [abs(est - exact[key]) / float(exact[key]) for key, est in estimated]
+    max_error = args.max_error
+    if max_error is None:
+        # Count-Min 的误差上限（概率 1 - e^-depth）：每个子窗口不超过 e * 该窗口字节数 / width，
+        # 各子窗口相加即整个窗口的 e * N / width
+        max_error = (math.e * sum(exact.values()) / args.width /
+                     float(min(count for _, count in truth)))
+
+    print('packets:          %d (%d distinct keys)' % (len(stream), len(exact)))
+    print('sketch add rate:  %.0f/s' % (len(stream) / sketch_time))
+    print('exact add rate:   %.0f/s' % (len(stream) / exact_time))
+    print('top(%d) query:    %.2f ms' % (args.top, query_time * 1000))
+    print('sketch memory:    %.1f MB' % (sketch_mem / 1048576.0))
+    print('exact memory:     %.1f MB' % (exact_mem / 1048576.0))
+    print('top-%d recall:    %.2f' % (args.top, recall))
+    print('mean rel. error:  %.4f' % (sum(errors) / len(errors)))
+    print('max rel. error:   %.4f (bound %.4f)' % (max(errors), max_error))
+
+    checks = [
+        ('top-%d recall >= %.2f' % (args.top, args.min_recall), recall >= args.min_recall),
+        ('max rel. error < %.4f' % max_error, max(errors) < max_error),
+    ]
+    for name, ok in checks:
+        print('  %-24s %s' % (name, 'ok' if ok else 'FAILED'))
+    sys.exit(0 if all(ok for _, ok in checks) else 1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,98 @@
+"""Frame sources shared by the benchmark scripts.
+
+``read_pcap`` yields raw frames from a classic libpcap capture (Ethernet
+link type) and ``synthetic_frames`` builds a protocol mix without needing
+a capture at hand.
+"""
+import random
+import struct
+
+_PCAP_MAGIC = {
+    b'\xd4\xc3\xb2\xa1': '<', b'\xa1\xb2\xc3\xd4': '>',
+    b'\x4d\x3c\xb2\xa1': '<', b'\xa1\xb2\x3c\x4d': '>',
+}
+
+# (ip_proto, dst_port) pairs roughly matching the services started by topo.py
+DEFAULT_MIX = [
+    (6, 80), (6, 80), (6, 80), (6, 443), (6, 443), (6, 21), (6, 25),
+    (6, 110), (6, 143), (6, 22), (17, 53), (17, 53), (17, 67), (1, None),
+    (6, 5001), (17, 5001),
+]
+
+
+def read_pcap(path):
+    """Yield (timestamp, frame) tuples from a pcap file"""
+    with open(path, 'rb') as f:
+        header = f.read(24)
+        endian = _PCAP_MAGIC.get(header[:4])
+        if endian is None:
+            raise ValueError('%s is not a pcap file' % path)
+        nano = header[:4] in (b'\x4d\x3c\xb2\xa1', b'\xa1\xb2\x3c\x4d')
+        record = struct.Struct(endian + 'IIII')
+        while True:
+            rec = f.read(record.size)
+            if len(rec) < record.size:
+                return
+            sec, frac, incl_len, _orig_len = record.unpack(rec)
+            data = f.read(incl_len)
+            if len(data) < incl_len:
+                return
+            yield sec + frac / (1e9 if nano else 1e6), data
+
+
+def _checksum(header):
+    total = sum(struct.unpack('!%dH' % (len(header) // 2), header))
+    total = (total >> 16) + (total & 0xffff)
+    total += total >> 16
+    return ~total & 0xffff
+
+
+def build_frame(eth_src, eth_dst, ip_src, ip_dst, ip_proto, src_port=None,
+                dst_port=None, payload_len=0, tcp_flags=0x18, vlan=None):
+    """Build an Ethernet/IPv4 frame; MACs are bytes, IPs are integers"""
+    payload = b'\x00' * payload_len
+    if ip_proto == 6:
+        l4 = struct.pack('!HHIIBBHHH', src_port, dst_port, 1, 1, 5 << 4,
+                         tcp_flags, 65535, 0, 0) + payload
+    elif ip_proto == 17:
+        l4 = struct.pack('!HHHH', src_port, dst_port, 8 + len(payload),
+                         0) + payload
+    else:
+        l4 = struct.pack('!BBHHH', 8, 0, 0, 1, 1) + payload
+    ip = struct.pack('!BBHHHBBHII', 0x45, 0, 20 + len(l4), 1, 0x4000, 64,
+                     ip_proto, 0, ip_src, ip_dst)
+    ip = ip[:10] + struct.pack('!H', _checksum(ip)) + ip[12:]
+    eth = eth_dst + eth_src
+    if vlan is not None:
+        eth += struct.pack('!HH', 0x8100, vlan)
+    return eth + struct.pack('!H', 0x0800) + ip + l4
+
+
+def synthetic_frames(count, hosts=64, mix=DEFAULT_MIX, seed=1,
+                     payload_len=64):
+    """Return ``count`` frames drawn from ``mix`` between ``hosts`` hosts"""
+    rnd = random.Random(seed)
+    macs = [struct.pack('!HI', 0x0200, i + 1) for i in range(hosts)]
+    ips = [0x0a000001 + i for i in range(hosts)]
+    frames = []
+    for _ in range(count):
+        a = rnd.randrange(hosts)
+        b = rnd.randrange(hosts)
+        proto, port = rnd.choice(mix)
+        sport = rnd.randrange(1024, 65535)
+        if port is not None and rnd.random() < 0.5:
+            # 一半流量是服务器方向的回包
+            a, b = b, a
+            frames.append(build_frame(macs[a], macs[b], ips[a], ips[b],
+                                      proto, port, sport, payload_len))
+        else:
+            frames.append(build_frame(macs[a], macs[b], ips[a], ips[b],
+                                      proto, sport, port, payload_len))
+    return frames
+
+
+def arp_frame(eth_src, ip_src, ip_dst):
+    """Build a broadcast ARP request"""
+    arp = struct.pack('!HHBBH6sI6sI', 1, 0x0800, 6, 4, 1, eth_src, ip_src,
+                      b'\x00' * 6, ip_dst)
+    return b'\xff' * 6 + eth_src + struct.pack('!H', 0x0806) + arp
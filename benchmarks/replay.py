@@ -0,0 +1,333 @@
+"""Offline replay harness for the TrafficMonitor hot path.
+
+Feeds synthetic frames (or a pcap capture) into _packet_in_handler, and
+synthetic multipart replies into _flow_stats_reply_handler and
+_port_stats_reply_handler, through stub datapaths that only record
+send_msg calls.  No Mininet, Open vSwitch or ryu-manager is needed, only
+the ryu package itself.
+
+Usage:
+    python benchmarks/replay.py [--scenario NAME ...] [--pcap capture.pcap]
+                                [--config-file traffic_monitor.conf]
+                                [--output results.json] [--compare old.json]
+
+For every scenario it reports calls/sec, p50/p99 handler latency, the
+memory allocated while replaying (tracemalloc, in a separate pass) and the
+peak RSS of the process.  --output saves the numbers together with the git
+commit so that runs can be compared with --compare.
+"""
+import argparse
+import collections
+import json
+import logging
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+import tracemalloc
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.join(HERE, '..')
+sys.path.insert(0, ROOT)
+
+from ryu import cfg  # noqa: E402
+from ryu.controller import ofp_event  # noqa: E402
+from ryu.ofproto import ofproto_v1_3, ofproto_v1_3_parser  # noqa: E402
+
+from benchmarks.frames import DEFAULT_MIX, read_pcap, synthetic_frames  # noqa: E402
+
+
+class StubDatapath(object):
+    """Just enough of ryu's Datapath for the handlers; counts sent messages"""
+
+    def __init__(self, dpid, serialize=False):
+        self.id = dpid
+        self.ofproto = ofproto_v1_3
+        self.ofproto_parser = ofproto_v1_3_parser
+        self.serialize = serialize
+        self.sent = collections.Counter()
+        self.xid = 0
+
+    def set_xid(self, msg):
+        self.xid += 1
+        msg.set_xid(self.xid)
+
+    def send_msg(self, msg):
+        if self.serialize:
+            if msg.xid is None:
+                self.set_xid(msg)
+            msg.serialize()
+        self.sent[type(msg).__name__] += 1
+
+    def send(self, buf):
+        # 批量发送的已序列化消息（pipeline 模式安装流表时使用）
+        self.sent['batch'] += 1
+
+
+class StubWSGI(object):
+    def register(self, controller, data=None):
+        pass
+
+
+def make_monitor():
+    # 延迟导入：配置文件必须在 traffic_monitor 读取 CONF 之前解析
+    from traffic_monitor import TrafficMonitor
+    return TrafficMonitor(wsgi=StubWSGI())
+
+
+def connect(monitor, datapaths):
+    parser = ofproto_v1_3_parser
+    for dp in datapaths:
+        features = parser.OFPSwitchFeatures(dp, datapath_id=dp.id)
+        monitor.switch_features_handler(ofp_event.EventOFPSwitchFeatures(features))
+
+
+def packet_in_events(datapaths, frames, ports=48):
+    parser = ofproto_v1_3_parser
+    ofp = ofproto_v1_3
+    events = []
+    for n, data in enumerate(frames):
+        dp = datapaths[n % len(datapaths)]
+        msg = parser.OFPPacketIn(dp, buffer_id=ofp.OFP_NO_BUFFER,
+                                 total_len=len(data), reason=ofp.OFPR_NO_MATCH,
+                                 table_id=0, cookie=0,
+                                 match=parser.OFPMatch(in_port=n % ports + 1),
+                                 data=data)
+        events.append(ofp_event.EventOFPPacketIn(msg))
+    return events
+
+
+def flow_stats_events(datapaths, flows, rounds):
+    parser = ofproto_v1_3_parser
+    events = []
+    for r in range(rounds):
+        for dp in datapaths:
+            body = []
+            for i in range(flows):
+                proto, port = DEFAULT_MIX[i % len(DEFAULT_MIX)]
+                fields = {'eth_type': 0x0800, 'ip_proto': proto,
+                          'ipv4_dst': '10.0.%d.%d' % (i // 250, i % 250 + 1)}
+                if proto == 6:
+                    fields['tcp_dst'] = port
+                elif proto == 17:
+                    fields['udp_dst'] = port
+                body.append(parser.OFPFlowStats(
+                    table_id=0, duration_sec=10 * (r + 1), duration_nsec=0,
+                    priority=10, idle_timeout=0, hard_timeout=0, flags=0,
+                    cookie=i, packet_count=100 * (r + 1) + i,
+                    byte_count=64000 * (r + 1) + i,
+                    match=parser.OFPMatch(**fields), instructions=[]))
+            msg = parser.OFPFlowStatsReply(dp, body=body, flags=0)
+            events.append(ofp_event.EventOFPFlowStatsReply(msg))
+    return events
+
+
+def port_stats_events(datapaths, ports, rounds):
+    parser = ofproto_v1_3_parser
+    events = []
+    for r in range(rounds):
+        for dp in datapaths:
+            body = [parser.OFPPortStats(
+                port_no=p + 1, rx_packets=1000 * r, tx_packets=900 * r,
+                rx_bytes=10 ** 6 * r, tx_bytes=9 * 10 ** 5 * r, rx_dropped=0,
+                tx_dropped=0, rx_errors=r, tx_errors=0, rx_frame_err=0,
+                rx_over_err=0, rx_crc_err=0, collisions=0,
+                duration_sec=10 * (r + 1), duration_nsec=0)
+                for p in range(ports)]
+            msg = parser.OFPPortStatsReply(dp, body=body, flags=0)
+            events.append(ofp_event.EventOFPPortStatsReply(msg))
+    return events
+
+
+def scenario_mixed(args):
+    dps = [StubDatapath(1, args.serialize)]
+    return 'packet_in', dps, packet_in_events(dps, synthetic_frames(args.count))
+
+
+def scenario_many_switches(args):
+    dps = [StubDatapath(i + 1, args.serialize) for i in range(args.switches)]
+    return 'packet_in', dps, packet_in_events(dps, synthetic_frames(args.count))
+
+
+def scenario_many_macs(args):
+    dps = [StubDatapath(1, args.serialize)]
+    frames = synthetic_frames(args.count, hosts=args.hosts)
+    return 'packet_in', dps, packet_in_events(dps, frames)
+
+
+def scenario_pcap(args):
+    if not args.pcap:
+        return None
+    dps = [StubDatapath(1, args.serialize)]
+    frames = [data for _, data in read_pcap(args.pcap)][:args.count]
+    return 'packet_in', dps, packet_in_events(dps, frames)
+
+
+def scenario_flow_stats(args):
+    dps = [StubDatapath(i + 1, args.serialize) for i in range(args.switches)]
+    return 'flow_stats', dps, flow_stats_events(dps, args.flows, 5)
+
+
+def scenario_port_stats(args):
+    dps = [StubDatapath(i + 1, args.serialize) for i in range(args.switches)]
+    return 'port_stats', dps, port_stats_events(dps, 48, 5)
+
+
+SCENARIOS = collections.OrderedDict([
+    ('mixed', scenario_mixed),
+    ('many_switches', scenario_many_switches),
+    ('many_macs', scenario_many_macs),
+    ('pcap', scenario_pcap),
+    ('flow_stats', scenario_flow_stats),
+    ('port_stats', scenario_port_stats),
+])
+
+
+def handler_for(monitor, kind):
+    if kind == 'packet_in' and monitor.intake is not None:
+        # 没有运行工作线程，每个事件之后同步处理队列
+        def handle(ev):
+            monitor._packet_in_handler(ev)
+            monitor._drain_intake()
+        return handle
+    return {
+        'packet_in': monitor._packet_in_handler,
+        'flow_stats': monitor._flow_stats_reply_handler,
+        'port_stats': monitor._port_stats_reply_handler,
+    }[kind]
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return 0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def run_scenario(name, build, args):
+    built = build(args)
+    if built is None:
+        return None
+    kind, dps, events = built
+
+    # 第一遍：计时
+    monitor = make_monitor()
+    connect(monitor, dps)
+    handler = handler_for(monitor, kind)
+    latencies = []
+    clock = time.perf_counter_ns
+    start = clock()
+    for ev in events:
+        t0 = clock()
+        handler(ev)
+        latencies.append(clock() - t0)
+    elapsed = (clock() - start) / 1e9
+    latencies.sort()
+
+    # 第二遍：统计内存分配（tracemalloc 会明显拖慢执行，所以单独跑）
+    monitor = make_monitor()
+    connect(monitor, dps)
+    handler = handler_for(monitor, kind)
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    for ev in events:
+        handler(ev)
+    after = tracemalloc.take_snapshot()
+    _, traced_peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    stats = after.compare_to(before, 'filename')
+    retained = sum(s.size_diff for s in stats)
+    blocks = sum(s.count_diff for s in stats)
+
+    sent = collections.Counter()
+    for dp in dps:
+        sent.update(dp.sent)
+    return collections.OrderedDict([
+        ('handler', kind),
+        ('calls', len(events)),
+        ('calls_per_sec', len(events) / elapsed),
+        ('p50_us', percentile(latencies, 0.50) / 1e3),
+        ('p99_us', percentile(latencies, 0.99) / 1e3),
+        ('retained_bytes', retained),
+        ('retained_blocks', blocks),
+        ('traced_peak_bytes', traced_peak),
+        ('peak_rss_mb', resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.0),
+        ('sent', dict(sent)),
+    ])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=ROOT,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, old_path):
+    with open(old_path) as f:
+        old = json.load(f)
+    print('\ncompared with %s (%s):' % (old_path, old.get('commit')))
+    for name, cur in results['scenarios'].items():
+        prev = old.get('scenarios', {}).get(name)
+        if not prev:
+            continue
+        for key in ('calls_per_sec', 'p50_us', 'p99_us', 'retained_bytes'):
+            if prev.get(key):
+                change = (cur[key] - prev[key]) * 100.0 / prev[key]
+                print('  %-14s %-15s %12.1f -> %12.1f (%+.1f%%)' % (
+                    name, key, prev[key], cur[key], change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scenario', action='append', choices=list(SCENARIOS),
+                        help='scenario to run (default: all)')
+    parser.add_argument('--pcap', help='capture file for the pcap scenario')
+    parser.add_argument('--count', type=int, default=50000,
+                        help='frames per packet-in scenario')
+    parser.add_argument('--switches', type=int, default=200)
+    parser.add_argument('--hosts', type=int, default=50000,
+                        help='distinct hosts in the many_macs scenario')
+    parser.add_argument('--flows', type=int, default=1000,
+                        help='flow entries per switch in flow_stats replies')
+    parser.add_argument('--serialize', action='store_true',
+                        help='serialize every sent message like a real datapath')
+    parser.add_argument('--config-file', action='append', default=[],
+                        help='ryu config file, e.g. to select forwarding_mode')
+    parser.add_argument('--output', help='write results as JSON')
+    parser.add_argument('--compare', help='previous JSON results to compare with')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=args.log_level)
+    cfg.CONF(args=[], project='ryu', default_config_files=args.config_file)
+
+    results = collections.OrderedDict([
+        ('commit', git_commit()),
+        ('timestamp', time.time()),
+        ('python', platform.python_version()),
+        ('scenarios', collections.OrderedDict()),
+    ])
+    for name in args.scenario or list(SCENARIOS):
+        result = run_scenario(name, SCENARIOS[name], args)
+        if result is None:
+            continue
+        results['scenarios'][name] = result
+        print('%-14s %-10s %8d calls %12.0f/s  p50 %8.1fus  p99 %8.1fus  '
+              'retained %8.1f KB  peak RSS %7.1f MB' % (
+                  name, result['handler'], result['calls'],
+                  result['calls_per_sec'], result['p50_us'], result['p99_us'],
+                  result['retained_bytes'] / 1024.0, result['peak_rss_mb']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == '__main__':
+    main()
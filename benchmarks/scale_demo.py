@@ -0,0 +1,165 @@
+"""Scale-out demo: worker processes publish state, a front end merges it.
+
+Starts ``--workers`` local processes, each owning ``--switches`` synthetic
+switches.  Every worker runs the controller's per-packet accounting
+(decode, classify, counters, time series, summary ring) on synthetic
+frames and publishes its state to shared memory every ``--interval``
+seconds, exactly as ``scale_role = worker`` does.  The parent process is
+the front end: it merges the segments with the same Aggregator as
+``scale_role = frontend`` and finally checks that the merged counters,
+history, switch list and summaries match what the workers processed.
+
+It runs once with a single worker and once with ``--workers`` so the
+aggregate throughput can be compared.
+
+Usage:
+    python benchmarks/scale_demo.py [--workers 4] [--switches 50]
+                                    [--packets 200000] [--interval 0.2]
+"""
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from benchmarks.frames import synthetic_frames  # noqa: E402
+from traffic_audit.classifier import OTHER, ProtocolClassifier  # noqa: E402
+from traffic_audit.decode import decode_frame  # noqa: E402
+from traffic_audit.intake import UNCLASSIFIED  # noqa: E402
+from traffic_audit.ringbuffer import SummaryRing  # noqa: E402
+from traffic_audit.shared import (Aggregator, StatePublisher, segment_name,  # noqa: E402
+                                  worker_state)
+from traffic_audit.timeseries import ProtocolTimeSeries  # noqa: E402
+
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+
+def stat_labels(classifier):
+    # 与 TrafficMonitor 相同的统计标签
+    return classifier.protocols[:-1] + (UNCLASSIFIED, OTHER)
+
+
+def worker(worker_id, args, name, results, done):
+    classifier = ProtocolClassifier()
+    stats = dict((proto, {'packets': 0, 'bytes': 0}) for proto in stat_labels(classifier))
+    history = ProtocolTimeSeries(stat_labels(classifier))
+    ring = SummaryRing(args.capacity, classifier.protocols)
+    decoded = []
+    for data in synthetic_frames(4096):
+        headers = decode_frame(data)
+        decoded.append((headers, classifier.classify(headers)))
+    dpids = [worker_id * args.switches + n + 1 for n in range(args.switches)]
+    switches = [{'dpid': dpid, 'ports': 4} for dpid in dpids]
+    publisher = StatePublisher(name, SEGMENT_SIZE)
+
+    def publish():
+        publisher.publish(worker_state(worker_id, stats, switches, history, ring,
+                                       args.publish_summaries))
+
+    started = time.perf_counter()
+    next_publish = started + args.interval
+    for n in range(args.packets):
+        headers, protocol = decoded[n & 4095]
+        now = time.time()
+        entry = stats[protocol]
+        entry['packets'] += 1
+        entry['bytes'] += headers.length
+        history.add(protocol, 1, headers.length, now)
+        ring.append(now, dpids[n % len(dpids)], n & 3, headers, protocol)
+        if n & 1023 == 0 and time.perf_counter() >= next_publish:
+            publish()
+            next_publish += args.interval
+    elapsed = time.perf_counter() - started
+    publish()
+    results.put((worker_id, elapsed, stats, ring.total, publisher.published))
+    # 等前端读完最后一次发布再删除共享内存段
+    done.wait()
+    publisher.close()
+
+
+def run(workers, args):
+    prefix = '%s-%d' % (args.name, os.getpid())
+    names = [segment_name(prefix, i) for i in range(workers)]
+    classifier = ProtocolClassifier()
+    stats = dict((proto, {'packets': 0, 'bytes': 0}) for proto in stat_labels(classifier))
+    history = ProtocolTimeSeries(stat_labels(classifier))
+    summaries = SummaryRing(args.capacity, classifier.protocols)
+    aggregator = Aggregator(names, stats, history, summaries,
+                            stale_after=max(args.interval * 5, 5.0))
+
+    results = multiprocessing.Queue()
+    done = multiprocessing.Event()
+    procs = [multiprocessing.Process(target=worker, args=(i, args, names[i], results, done))
+             for i in range(workers)]
+    started = time.perf_counter()
+    for proc in procs:
+        proc.start()
+    finished = []
+    refreshes = 0
+    merge_time = 0.0
+    while len(finished) < workers:
+        time.sleep(args.interval)
+        t = time.perf_counter()
+        if aggregator.refresh():
+            refreshes += 1
+            merge_time += time.perf_counter() - t
+        while not results.empty():
+            finished.append(results.get())
+    wall = time.perf_counter() - started
+    aggregator.refresh()
+    done.set()
+    for proc in procs:
+        proc.join()
+    aggregator.close()
+
+    expected = dict((proto, [0, 0]) for proto in stats)
+    for _, _, worker_stats, _, _ in finished:
+        for proto, entry in worker_stats.items():
+            expected[proto][0] += entry['packets']
+            expected[proto][1] += entry['bytes']
+    total = sum(entry[0] for entry in expected.values())
+    now = time.time()
+    query = history.query(now - 3600, now, 3600, now)['protocols']
+    checks = [
+        ('protocol counters', all(stats[p]['packets'] == expected[p][0] and
+                                  stats[p]['bytes'] == expected[p][1] for p in stats)),
+        ('history totals', sum(sum(q['packets']) for q in query.values()) == total),
+        ('switches', len(aggregator.switches) == workers * args.switches),
+        ('summaries seen', summaries.total + aggregator.skipped ==
+         sum(r[3] for r in finished)),
+    ]
+    busy = max(r[1] for r in finished)
+    print('%d worker(s): %d packets in %.2f s, %.0f packets/s aggregate '
+          '(%.0f per worker), wall %.2f s' % (
+              workers, total, busy, total / busy, total / busy / workers, wall))
+    print('  front end: %d merges, %.1f ms each, %d summaries merged, %d skipped' % (
+        refreshes, merge_time / max(refreshes, 1) * 1000, summaries.total,
+        aggregator.skipped))
+    for name, ok in checks:
+        print('  %-18s %s' % (name, 'ok' if ok else 'MISMATCH'))
+    return all(ok for _, ok in checks)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--switches', type=int, default=50, help='switches per worker')
+    parser.add_argument('--packets', type=int, default=200000, help='packets per worker')
+    parser.add_argument('--interval', type=float, default=0.2,
+                        help='seconds between publications / merges')
+    parser.add_argument('--capacity', type=int, default=100000,
+                        help='summary ring capacity of every process')
+    parser.add_argument('--publish-summaries', type=int, default=10000)
+    parser.add_argument('--name', default='tm_demo', help='shared memory name prefix')
+    args = parser.parse_args()
+
+    ok = True
+    for workers in sorted(set((1, args.workers))):
+        ok = run(workers, args) and ok
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
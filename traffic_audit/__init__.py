@@ -0,0 +1 @@
+"""Helpers used by traffic_monitor.py that do not depend on ryu."""
@@ -0,0 +1,203 @@
+"""Per-source sliding-window detection of scans, SYN floods and DNS amplification.
+
+State is kept for two half windows: the current one and the previous one.
+At every half-window boundary the previous half is dropped and the current
+one becomes previous, so a query always covers between ``window / 2`` and
+``window`` seconds of traffic.  Dropping whole halves also bounds memory to
+the sources active in the last window, with a hard cap on top.
+
+Per source IP, each half holds:
+
+* a 256-bit bitmap of hashed destination ports, whose union over both
+  halves gives a linear-counting estimate of distinct ports probed.  Only
+  TCP SYNs and UDP packets to ports below 1024 are counted, so servers
+  replying to many ephemeral client ports do not look like scanners;
+* the number of TCP SYNs (without ACK) and of ACKs sent.  The SYN flood
+  check compares the two, so it needs to see a source's ACKs; it can be
+  turned off (``syn_flood=False``) where only the first packet of each
+  connection is observed.
+
+Per destination IP it holds the DNS response bytes received and the DNS
+query bytes sent; responses far exceeding queries mean someone else asked
+on the victim's behalf.
+
+Every update is a constant number of dict and integer operations.
+"""
+import math
+
+from traffic_audit.decode import IPPROTO_TCP, IPPROTO_UDP, TCP_ACK, TCP_SYN, ipv4_str
+
+PORT_SCAN = 'port_scan'
+SYN_FLOOD = 'syn_flood'
+DNS_AMPLIFICATION = 'dns_amplification'
+
+_BITMAP_BITS = 256
+
+# 源地址状态：[端口位图, SYN 数, ACK 数]
+_BITMAP, _SYNS, _ACKS = range(3)
+# 目的地址的 DNS 状态：[收到的响应字节数, 发出的查询字节数]
+_RESPONSES, _QUERIES = range(2)
+
+
+def _port_bit(port):
+    # 整数混合散列：连续扫描的端口也像随机值一样落在位图中，线性计数才无偏
+    x = (port * 0x45d9f3b) & 0xffffffff
+    x = ((x ^ (x >> 16)) * 0x45d9f3b) & 0xffffffff
+    return 1 << (x >> 24)
+
+
+def distinct_estimate(bitmap):
+    """Linear-counting estimate of distinct values hashed into ``bitmap``"""
+    zeros = _BITMAP_BITS - bin(bitmap).count('1')
+    if zeros == 0:
+        zeros = 0.5
+    return _BITMAP_BITS * math.log(float(_BITMAP_BITS) / zeros)
+
+
+def drop_match(kind, ip):
+    """OFPMatch fields of the drop rule for an alert of ``kind`` about ``ip``"""
+    if kind == DNS_AMPLIFICATION:
+        # 只丢弃发给受害者的 DNS 响应
+        return {'eth_type': 0x0800, 'ip_proto': IPPROTO_UDP,
+                'ipv4_dst': ipv4_str(ip), 'udp_src': 53}
+    return {'eth_type': 0x0800, 'ipv4_src': ipv4_str(ip)}
+
+
+class AnomalyDetector(object):
+
+    def __init__(self, window=10.0, scan_ports=100, syn_threshold=200,
+                 syn_ratio=10.0, dns_bytes=1000000, dns_ratio=20.0,
+                 hold=60.0, max_sources=100000, syn_flood=True):
+        self.half = window / 2.0
+        self.scan_ports = scan_ports
+        self.syn_threshold = syn_threshold
+        self.syn_ratio = syn_ratio
+        self.syn_flood = syn_flood
+        self.dns_bytes = dns_bytes
+        self.dns_ratio = dns_ratio
+        # 同一告警在这段时间内不重复触发（通常等于阻断时长）
+        self.hold = hold
+        self.max_sources = max_sources
+        self.untracked = 0
+        self._sources = {}
+        self._prev_sources = {}
+        self._victims = {}
+        self._prev_victims = {}
+        self._rotate_at = None
+        self._raised = {}
+
+    def _rotate(self, now):
+        if self._rotate_at is not None and now < self._rotate_at + self.half:
+            self._prev_sources, self._prev_victims = self._sources, self._victims
+        else:
+            # 超过一整个窗口没有流量，两个半窗口都已过期
+            self._prev_sources, self._prev_victims = {}, {}
+        self._sources, self._victims = {}, {}
+        self._rotate_at = (now // self.half + 1) * self.half
+        for key in [k for k, until in self._raised.items() if until <= now]:
+            del self._raised[key]
+
+    def _state(self, table, key, size):
+        state = table.get(key)
+        if state is None:
+            if len(table) >= self.max_sources:
+                self.untracked += 1
+                return None
+            state = table[key] = [0] * size
+        return state
+
+    def observe(self, headers, now):
+        """Update state with one packet; return (kind, ip, value, threshold) or None"""
+        proto = headers.ip_proto
+        if proto is None or headers.dst_port is None:
+            return None
+        if self._rotate_at is None or now >= self._rotate_at:
+            self._rotate(now)
+        if proto == IPPROTO_TCP:
+            return self._observe_tcp(headers, now)
+        if proto == IPPROTO_UDP:
+            return self._observe_udp(headers, now)
+        return None
+
+    def _observe_tcp(self, headers, now):
+        flags = headers.tcp_flags or 0
+        syn = flags & TCP_SYN and not flags & TCP_ACK
+        if not syn and not flags & TCP_ACK:
+            return None
+        src = headers.ip_src
+        state = self._state(self._sources, src, 3)
+        if state is None:
+            return None
+        if not syn:
+            state[_ACKS] += 1
+            return None
+        state[_SYNS] += 1
+        prev = self._prev_sources.get(src)
+        alert = self._check_scan(src, state, prev, headers.dst_port, now)
+        if alert is not None:
+            return alert
+        if not self.syn_flood:
+            return None
+        syns = state[_SYNS] + (prev[_SYNS] if prev else 0)
+        if syns >= self.syn_threshold:
+            acks = state[_ACKS] + (prev[_ACKS] if prev else 0)
+            if syns > self.syn_ratio * (acks + 1):
+                return self._raise(SYN_FLOOD, src, syns, self.syn_threshold, now)
+        return None
+
+    def _observe_udp(self, headers, now):
+        src_port = headers.src_port
+        dst_port = headers.dst_port
+        if src_port == 53:
+            victim = headers.ip_dst
+            state = self._state(self._victims, victim, 2)
+            if state is None:
+                return None
+            state[_RESPONSES] += headers.length
+            prev = self._prev_victims.get(victim)
+            responses = state[_RESPONSES] + (prev[_RESPONSES] if prev else 0)
+            if responses >= self.dns_bytes:
+                queries = state[_QUERIES] + (prev[_QUERIES] if prev else 0)
+                if responses > self.dns_ratio * (queries + 1):
+                    return self._raise(DNS_AMPLIFICATION, victim, responses,
+                                       self.dns_bytes, now)
+            return None
+        if dst_port == 53:
+            state = self._state(self._victims, headers.ip_src, 2)
+            if state is not None:
+                state[_QUERIES] += headers.length
+        if dst_port < 1024 <= src_port:
+            src = headers.ip_src
+            state = self._state(self._sources, src, 3)
+            if state is not None:
+                return self._check_scan(src, state, self._prev_sources.get(src),
+                                        dst_port, now)
+        return None
+
+    def _check_scan(self, src, state, prev, port, now):
+        bitmap = state[_BITMAP]
+        updated = bitmap | _port_bit(port)
+        if updated == bitmap:
+            # 位图没有变化，估计值不会增加
+            return None
+        state[_BITMAP] = updated
+        if prev:
+            updated |= prev[_BITMAP]
+        ports = distinct_estimate(updated)
+        if ports >= self.scan_ports:
+            return self._raise(PORT_SCAN, src, int(ports), self.scan_ports, now)
+        return None
+
+    def _raise(self, kind, ip, value, threshold, now):
+        key = (kind, ip)
+        until = self._raised.get(key)
+        if until is not None and until > now:
+            return None
+        self._raised[key] = now + self.hold
+        return kind, ip, value, threshold
+
+    def clear(self):
+        self._sources, self._prev_sources = {}, {}
+        self._victims, self._prev_victims = {}, {}
+        self._raised = {}
+        self._rotate_at = None
@@ -0,0 +1,517 @@
+"""Append-only, segmented on-disk log of packet summaries.
+
+Records use the same fields as the in-memory ring (see ``ringbuffer.FIELDS``)
+packed into fixed-size little-endian structs, so the n-th record of a
+segment lives at ``data_offset + n * RECORD.size`` and can be read straight
+out of an mmap.  A segment is rolled over once it is older than
+``segment_seconds`` or larger than ``segment_bytes``; at that point its
+index is written next to it:
+
+* the segment's time range, used to skip whole segments, and
+* posting lists (record numbers) for every ip_src / ip_dst / ip_proto /
+  src_port / dst_port value seen in it, behind a directory sorted by
+  (field, value) that is binary-searched to answer 5-tuple queries.
+
+Records are appended in arrival order, so inside a segment a time range is
+found by binary search on the timestamp column.  Segments left without an
+index by a crash are re-indexed when the log is reopened.
+
+Sealing a segment (fsync, index build) goes through the ``run`` callable,
+so a caller on an event loop can hand it to a thread pool; queries keep
+using the in-memory postings until the index file is in place.  Segments
+rolled over by write() are sealed only after all its input was consumed,
+and a segment whose index could not be written is retried on the next
+write.  With
+``retention_seconds`` or ``retention_bytes`` set, the oldest closed
+segments are deleted at every rollover.
+"""
+import json
+import mmap
+import os
+import struct
+import time
+from array import array
+from collections import OrderedDict
+
+from traffic_audit.ringbuffer import HAS_IP, HAS_PORTS, summary_from_values
+
+RECORD = struct.Struct('<dQIQQHIIBHHIBB')
+_TIMESTAMP = struct.Struct('<d')
+
+SEGMENT_MAGIC = b'TAUDSEG1'
+INDEX_MAGIC = b'TAUDIDX1'
+_HEADER_LEN = struct.Struct('<I')
+_INDEX_HEADER = struct.Struct('<8sddII')
+_DIRECTORY_ENTRY = struct.Struct('<BQQI')
+
+# 可建立索引的字段及其在记录中的位置
+INDEX_FIELDS = (
+    ('ip_src', 6),
+    ('ip_dst', 7),
+    ('ip_proto', 8),
+    ('src_port', 9),
+    ('dst_port', 10),
+)
+_FIELD_IDS = dict((name, i) for i, (name, _) in enumerate(INDEX_FIELDS))
+
+_CACHED_SEGMENTS = 8
+
+
+class _Segment(object):
+    __slots__ = ('path', 'index_path', 'data_offset', 'labels', 'created',
+                 'min_ts', 'max_ts', 'count')
+
+    def __init__(self, path, data_offset, labels, created):
+        self.path = path
+        self.index_path = path[:-len('.seg')] + '.idx'
+        self.data_offset = data_offset
+        self.labels = labels
+        self.created = created
+        self.min_ts = None
+        self.max_ts = None
+        self.count = 0
+
+    def overlaps(self, start, end):
+        if self.count == 0:
+            return False
+        return ((start is None or self.max_ts >= start) and
+                (end is None or self.min_ts < end))
+
+
+def _read_segment_header(f, path):
+    magic = f.read(len(SEGMENT_MAGIC))
+    if magic != SEGMENT_MAGIC:
+        raise ValueError('%s is not an audit log segment' % path)
+    length = _HEADER_LEN.unpack(f.read(_HEADER_LEN.size))[0]
+    header = json.loads(f.read(length).decode('utf-8'))
+    offset = len(SEGMENT_MAGIC) + _HEADER_LEN.size + length
+    return _Segment(path, offset, tuple(header['labels']), header['created'])
+
+
+def _add_postings(postings, recno, values):
+    flags = values[-1]
+    if not flags & HAS_IP:
+        return
+    last = len(INDEX_FIELDS) if flags & HAS_PORTS else 3
+    for field_id in range(last):
+        key = (field_id, values[INDEX_FIELDS[field_id][1]])
+        recnos = postings.get(key)
+        if recnos is None:
+            recnos = postings[key] = array('I')
+        recnos.append(recno)
+
+
+class AuditLog(object):
+    """Segmented binary log with time-range and 5-tuple indexes"""
+
+    def __init__(self, directory, labels, segment_seconds=3600,
+                 segment_bytes=64 * 1024 * 1024, retention_seconds=0,
+                 retention_bytes=0, run=None):
+        self.directory = directory
+        self.labels = tuple(labels)
+        self.segment_seconds = segment_seconds
+        self.segment_bytes = segment_bytes
+        self.retention_seconds = retention_seconds
+        self.retention_bytes = retention_bytes
+        self._run = run or (lambda func, *args: func(*args))
+        self.segments = []
+        self.removed = 0
+        self._active = None
+        self._file = None
+        self._postings = {}
+        # 还没有索引文件的段：路径 -> 内存中的倒排表
+        self._sealing = {}
+        # 等待封存的段：[(段, 文件)]
+        self._unsealed = []
+        self.seal_failures = 0
+        self.seal_error = None
+        self._cache = OrderedDict()
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        self._load_segments()
+        self.enforce_retention()
+
+    # ---- 写入 ----
+
+    def write(self, records):
+        """Append raw summary value tuples (ringbuffer.FIELDS order)"""
+        buf = bytearray()
+        pack = RECORD.pack
+        written = 0
+        rolled = None
+        for values in records:
+            ts = values[0]
+            seg = self._active
+            if seg is None or self._needs_rollover(seg, ts):
+                if buf:
+                    self._file.write(buf)
+                    buf = bytearray()
+                self._roll(ts)
+                rolled = ts
+                seg = self._active
+            recno = seg.count
+            seg.count += 1
+            if seg.min_ts is None or ts < seg.min_ts:
+                seg.min_ts = ts
+            if seg.max_ts is None or ts > seg.max_ts:
+                seg.max_ts = ts
+            _add_postings(self._postings, recno, values)
+            buf += pack(*values)
+            written += 1
+        if buf:
+            self._file.write(buf)
+        if self._file is not None:
+            self._file.flush()
+        # 封存可能让出给其他协程（见 run），所以等输入全部读完之后再进行，
+        # 调用者传入的生成器不会在读到一半时被打断
+        self._seal_pending()
+        if rolled is not None:
+            self.enforce_retention(rolled)
+        return written
+
+    def _needs_rollover(self, seg, ts):
+        size = seg.data_offset + seg.count * RECORD.size
+        return (size + RECORD.size > self.segment_bytes or
+                ts - seg.created >= self.segment_seconds)
+
+    def _roll(self, now):
+        self._detach_active()
+        name = 'segment-%015d' % int(now * 1000)
+        path = os.path.join(self.directory, name + '.seg')
+        suffix = 0
+        while os.path.exists(path):
+            suffix += 1
+            path = os.path.join(self.directory, '%s-%d.seg' % (name, suffix))
+        header = json.dumps({'labels': self.labels, 'created': now}).encode('utf-8')
+        self._file = open(path, 'wb')
+        self._file.write(SEGMENT_MAGIC + _HEADER_LEN.pack(len(header)) + header)
+        seg = _Segment(path, len(SEGMENT_MAGIC) + _HEADER_LEN.size + len(header),
+                       self.labels, now)
+        self._active = seg
+        self._postings = {}
+        self.segments.append(seg)
+
+    def _detach_active(self):
+        """Stop appending to the active segment; _seal_pending() seals it"""
+        if self._active is None:
+            return
+        seg, f, postings = self._active, self._file, self._postings
+        self._active = None
+        self._file = None
+        self._postings = {}
+        if not seg.count:
+            f.close()
+            self.segments.remove(seg)
+            os.remove(seg.path)
+            return
+        self._sealing[seg.path] = postings
+        self._unsealed.append((seg, f))
+
+    def _seal_pending(self):
+        for seg, f in list(self._unsealed):
+            if seg not in self.segments:
+                # 已按保留策略删除
+                self._unsealed.remove((seg, f))
+                self._sealing.pop(seg.path, None)
+                continue
+            try:
+                self._run(self._seal, seg, f, self._sealing[seg.path])
+            except (OSError, ValueError) as e:
+                # 例如磁盘已满：保留内存中的倒排表供查询使用，下次写入时重试
+                self.seal_failures += 1
+                self.seal_error = e
+                continue
+            self._unsealed.remove((seg, f))
+            del self._sealing[seg.path]
+
+    def _seal(self, seg, f, postings):
+        if f is not None and not f.closed:
+            f.flush()
+            os.fsync(f.fileno())
+            f.close()
+        self._write_index(seg, postings)
+
+    def _write_index(self, seg, postings):
+        keys = sorted(postings)
+        tmp = seg.index_path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(_INDEX_HEADER.pack(INDEX_MAGIC, seg.min_ts, seg.max_ts,
+                                       seg.count, len(keys)))
+            offset = _INDEX_HEADER.size + len(keys) * _DIRECTORY_ENTRY.size
+            for key in keys:
+                n = len(postings[key])
+                f.write(_DIRECTORY_ENTRY.pack(key[0], key[1], offset, n))
+                offset += n * 4
+            for key in keys:
+                f.write(postings[key].tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        # 先写临时文件再改名，崩溃时不会留下半个索引
+        os.rename(tmp, seg.index_path)
+
+    def enforce_retention(self, now=None):
+        """Delete the oldest closed segments beyond the age and size limits"""
+        if not self.retention_seconds and not self.retention_bytes:
+            return 0
+        closed = [seg for seg in self.segments
+                  if seg is not self._active and seg.path not in self._sealing]
+        expired = []
+        if self.retention_seconds:
+            cutoff = (time.time() if now is None else now) - self.retention_seconds
+            expired = [seg for seg in closed if seg.max_ts < cutoff]
+        if self.retention_bytes:
+            sizes = [(seg, self._disk_size(seg)) for seg in self.segments]
+            total = sum(size for _, size in sizes)
+            for seg, size in sizes:
+                if total <= self.retention_bytes or seg not in closed:
+                    break
+                if seg not in expired:
+                    expired.append(seg)
+                total -= size
+        for seg in expired:
+            self._remove(seg)
+        return len(expired)
+
+    def _disk_size(self, seg):
+        if seg is self._active:
+            return seg.data_offset + seg.count * RECORD.size
+        size = 0
+        for path in (seg.path, seg.index_path):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        return size
+
+    def _remove(self, seg):
+        self.segments.remove(seg)
+        mm = self._cache.pop(seg.path, None)
+        if mm is not None:
+            mm.close()
+        # 正在导出的读者持有自己的映射，删除文件不影响它们
+        for path in (seg.index_path, seg.path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        self.removed += 1
+
+    def close(self):
+        self._detach_active()
+        self._seal_pending()
+        for mm in self._cache.values():
+            mm.close()
+        self._cache.clear()
+
+    # ---- 启动时加载 ----
+
+    def _load_segments(self):
+        for name in sorted(os.listdir(self.directory)):
+            if not name.endswith('.seg'):
+                continue
+            path = os.path.join(self.directory, name)
+            with open(path, 'rb') as f:
+                try:
+                    seg = _read_segment_header(f, path)
+                except (ValueError, KeyError, struct.error):
+                    continue
+            if os.path.exists(seg.index_path):
+                with open(seg.index_path, 'rb') as f:
+                    _, seg.min_ts, seg.max_ts, seg.count, _ = _INDEX_HEADER.unpack(
+                        f.read(_INDEX_HEADER.size))
+            else:
+                self._recover(seg)
+            if seg.count:
+                self.segments.append(seg)
+
+    def _recover(self, seg):
+        """Rebuild the index of a segment that was not closed cleanly"""
+        size = os.path.getsize(seg.path)
+        count = (size - seg.data_offset) // RECORD.size
+        # 截掉崩溃时写了一半的记录
+        if seg.data_offset + count * RECORD.size != size:
+            with open(seg.path, 'r+b') as f:
+                f.truncate(seg.data_offset + count * RECORD.size)
+        if count == 0:
+            return
+        seg.count = count
+        postings = self._scan(seg)
+        try:
+            self._write_index(seg, postings)
+        except OSError as e:
+            self._keep_unsealed(seg, postings, e)
+
+    def _scan(self, seg):
+        """Build the postings of a segment from its records, updating its time range"""
+        postings = {}
+        with open(seg.path, 'rb') as f:
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                for recno, values in enumerate(RECORD.iter_unpack(
+                        mm[seg.data_offset:seg.data_offset + seg.count * RECORD.size])):
+                    ts = values[0]
+                    if seg.min_ts is None or ts < seg.min_ts:
+                        seg.min_ts = ts
+                    if seg.max_ts is None or ts > seg.max_ts:
+                        seg.max_ts = ts
+                    _add_postings(postings, recno, values)
+            finally:
+                mm.close()
+        return postings
+
+    def _keep_unsealed(self, seg, postings, error):
+        # 索引写不出来：查询使用内存中的倒排表，下次写入时重试
+        self.seal_failures += 1
+        self.seal_error = error
+        self._sealing[seg.path] = postings
+        self._unsealed.append((seg, None))
+
+    # ---- 查询 ----
+
+    def _map(self, seg):
+        if seg is self._active:
+            # 活动段仍在增长，每次查询重新映射
+            with open(seg.path, 'rb') as f:
+                return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        mm = self._cache.pop(seg.path, None)
+        if mm is None:
+            with open(seg.path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            while len(self._cache) >= _CACHED_SEGMENTS:
+                self._cache.popitem(last=False)[1].close()
+        self._cache[seg.path] = mm
+        return mm
+
+    def _load_postings(self, seg, wanted):
+        """Return {key: array of recnos} for the (field_id, value) keys in ``wanted``"""
+        if seg is self._active or seg.path in self._sealing:
+            postings = self._postings if seg is self._active else self._sealing[seg.path]
+            return dict((key, postings.get(key, array('I'))) for key in wanted)
+        found = {}
+        try:
+            with open(seg.index_path, 'rb') as f:
+                mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except FileNotFoundError as e:
+            # 索引文件丢失：扫描段文件，并安排重新写索引
+            postings = self._scan(seg)
+            self._keep_unsealed(seg, postings, e)
+            return dict((key, postings.get(key, array('I'))) for key in wanted)
+        try:
+            entries = _INDEX_HEADER.unpack_from(mm, 0)[4]
+            for key in wanted:
+                recnos = array('I')
+                lo, hi = 0, entries
+                while lo < hi:
+                    mid = (lo + hi) // 2
+                    pos = _INDEX_HEADER.size + mid * _DIRECTORY_ENTRY.size
+                    field_id, value, offset, n = _DIRECTORY_ENTRY.unpack_from(mm, pos)
+                    if (field_id, value) < key:
+                        lo = mid + 1
+                    elif (field_id, value) > key:
+                        hi = mid
+                    else:
+                        recnos.frombytes(mm[offset:offset + n * 4])
+                        break
+                found[key] = recnos
+        finally:
+            mm.close()
+        return found
+
+    def _lower_bound(self, mm, seg, ts, count):
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if _TIMESTAMP.unpack_from(mm, seg.data_offset + mid * RECORD.size)[0] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def _candidates(self, seg, mm, count, start, end, filters):
+        if filters:
+            postings = self._load_postings(seg, filters)
+            lists = sorted(postings.values(), key=len)
+            if not lists[0]:
+                return []
+            if len(lists) == 1:
+                return lists[0]
+            return sorted(set(lists[0]).intersection(*lists[1:]))
+        lo = 0 if start is None else self._lower_bound(mm, seg, start, count)
+        hi = count if end is None else self._lower_bound(mm, seg, end, count)
+        return range(lo, hi)
+
+    def search(self, start=None, end=None, limit=1000, **fields):
+        """Return (summaries, truncated) for records in [start, end) matching ``fields``
+
+        ``fields`` may contain ip_src / ip_dst (integers), ip_proto,
+        src_port and dst_port.  Results are in time order.
+        """
+        filters = []
+        for name, value in fields.items():
+            if value is None:
+                continue
+            if name not in _FIELD_IDS:
+                raise ValueError('cannot search on %r' % name)
+            filters.append((_FIELD_IDS[name], value))
+
+        results = []
+        for seg in list(self.segments):
+            if not seg.overlaps(start, end):
+                continue
+            count = seg.count
+            mm = self._map(seg)
+            try:
+                for recno in self._candidates(seg, mm, count, start, end, filters):
+                    if recno >= count:
+                        break
+                    values = RECORD.unpack_from(mm, seg.data_offset + recno * RECORD.size)
+                    ts = values[0]
+                    if (start is not None and ts < start) or (end is not None and ts >= end):
+                        continue
+                    if len(results) >= limit:
+                        return results, True
+                    results.append(summary_from_values(values, seg.labels))
+            finally:
+                if seg is self._active:
+                    mm.close()
+        return results, False
+
+    def iter_range(self, start=None, end=None, batch=4096):
+        """Yield raw value tuples of every record in [start, end), in time order
+
+        Reads ``batch`` records at a time from a private mapping of each
+        segment, so memory use does not depend on the size of the range.
+        Protocol indexes of segments written with another protocol map are
+        translated to this log's labels.
+        """
+        other = len(self.labels) - 1
+        for seg in list(self.segments):
+            if not seg.overlaps(start, end):
+                continue
+            remap = None
+            if seg.labels != self.labels:
+                index = dict((name, i) for i, name in enumerate(self.labels))
+                remap = [index.get(name, other) for name in seg.labels]
+            # 只读到开始时的记录数，之后写入活动段的记录不导出
+            count = seg.count
+            try:
+                with open(seg.path, 'rb') as f:
+                    mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except FileNotFoundError:
+                # 迭代期间按保留策略删除的段
+                continue
+            try:
+                lo = 0 if start is None else self._lower_bound(mm, seg, start, count)
+                hi = count if end is None else self._lower_bound(mm, seg, end, count)
+                for first in range(lo, hi, batch):
+                    last = min(first + batch, hi)
+                    data = mm[seg.data_offset + first * RECORD.size:
+                              seg.data_offset + last * RECORD.size]
+                    for values in RECORD.iter_unpack(data):
+                        if remap is not None:
+                            protocol = values[12]
+                            values = values[:12] + (
+                                remap[protocol] if protocol < len(remap) else other,) + values[13:]
+                        yield values
+            finally:
+                mm.close()
@@ -0,0 +1,249 @@
+"""Crash-safe snapshots of controller state for warm restarts.
+
+A checkpoint directory holds one full snapshot and the delta log that
+continues it:
+
+* ``full-<seq>.ckpt``: one frame with the complete state.  It is written
+  to a temporary file, fsynced and renamed into place, so a crash leaves
+  either the old snapshot or the new one, never a partial file.
+* ``delta-<seq>.log``: frames appended (and fsynced) after the snapshot
+  with the same ``seq``, each holding only what changed since the
+  previous frame.
+
+Every frame is a header of (magic, kind, seq, length, crc32) followed by
+the state encoded with encode_state().  Loading stops at the first frame
+that is truncated or fails its checksum, so a crash while appending only
+loses that last increment.  Once a new full snapshot is in place the older
+snapshot and its delta log are removed.
+
+ControllerState captures the controller's counters, time series, summary
+ring and MAC tables as such states and applies loaded ones back.
+"""
+import gc
+import os
+import struct
+import zlib
+
+from traffic_audit.shared import decode_state, encode_state
+
+_FRAME = struct.Struct('<4sBQQI')
+_MAGIC = b'TAC1'
+
+FULL, DELTA = 1, 2
+
+
+def _full_path(directory, seq):
+    return os.path.join(directory, 'full-%012d.ckpt' % seq)
+
+
+def _delta_path(directory, seq):
+    return os.path.join(directory, 'delta-%012d.log' % seq)
+
+
+def _listing(directory):
+    """Return {seq: file names} of the checkpoint files in ``directory``"""
+    found = {}
+    for name in os.listdir(directory):
+        prefix, _, rest = name.partition('-')
+        seq, dot, ext = rest.partition('.')
+        if prefix in ('full', 'delta') and dot and seq.isdigit():
+            found.setdefault(int(seq), []).append(name)
+    return found
+
+
+def _fsync_dir(directory):
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        # 有些文件系统不支持对目录 fsync
+        pass
+    finally:
+        os.close(fd)
+
+
+def _frame(kind, seq, state):
+    payload = encode_state(state)
+    return _FRAME.pack(_MAGIC, kind, seq, len(payload), zlib.crc32(payload)), payload
+
+
+def _read_frames(f, kind, seq):
+    """Yield the decoded states of valid frames until the first bad one"""
+    while True:
+        header = f.read(_FRAME.size)
+        if len(header) < _FRAME.size:
+            return
+        magic, frame_kind, frame_seq, length, crc = _FRAME.unpack(header)
+        if magic != _MAGIC or frame_kind != kind or frame_seq != seq:
+            return
+        payload = f.read(length)
+        if len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        yield decode_state(payload)
+
+
+def load_checkpoint(directory):
+    """Return (full state, [delta states]) of the newest valid snapshot
+
+    Returns (None, []) when the directory has no usable snapshot.
+    """
+    if not os.path.isdir(directory):
+        return None, []
+    listing = _listing(directory)
+    for seq in sorted(listing, reverse=True):
+        try:
+            with open(_full_path(directory, seq), 'rb') as f:
+                full = next(_read_frames(f, FULL, seq), None)
+        except FileNotFoundError:
+            continue
+        if full is None:
+            # 快照损坏，退回到更早的一个
+            continue
+        deltas = []
+        try:
+            with open(_delta_path(directory, seq), 'rb') as f:
+                deltas = list(_read_frames(f, DELTA, seq))
+        except FileNotFoundError:
+            pass
+        return full, deltas
+    return None, []
+
+
+class CheckpointWriter(object):
+    """Writes full snapshots and the delta log of one checkpoint directory"""
+
+    def __init__(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        listing = _listing(directory)
+        self.seq = max(listing) if listing else 0
+        for name in os.listdir(directory):
+            if name.endswith('.tmp'):
+                # 上次写快照时崩溃留下的临时文件
+                os.unlink(os.path.join(directory, name))
+        self._delta = None
+        self.full_bytes = 0
+        self.delta_bytes = 0
+        self.written = 0
+
+    @property
+    def has_full(self):
+        """Whether a snapshot was written since start, so deltas can follow it"""
+        return self._delta is not None
+
+    def write_full(self, state):
+        """Atomically replace the snapshot; return its size in bytes"""
+        seq = self.seq + 1
+        header, payload = _frame(FULL, seq, state)
+        path = _full_path(self.directory, seq)
+        tmp = path + '.tmp'
+        with open(tmp, 'wb') as f:
+            f.write(header)
+            f.write(payload)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, path)
+        _fsync_dir(self.directory)
+        if self._delta is not None:
+            self._delta.close()
+        self._delta = open(_delta_path(self.directory, seq), 'wb')
+        self.seq = seq
+        # 新快照已经落盘，更早的快照和增量日志不再需要
+        for old, names in _listing(self.directory).items():
+            if old < seq:
+                for name in names:
+                    os.unlink(os.path.join(self.directory, name))
+        self.full_bytes = len(header) + len(payload)
+        self.delta_bytes = 0
+        self.written += 1
+        return self.full_bytes
+
+    def append_delta(self, state):
+        """Append an increment to the current snapshot; return its size in bytes"""
+        if self._delta is None:
+            raise ValueError('no full checkpoint written yet')
+        header, payload = _frame(DELTA, self.seq, state)
+        self._delta.write(header)
+        self._delta.write(payload)
+        self._delta.flush()
+        os.fsync(self._delta.fileno())
+        self.delta_bytes += len(header) + len(payload)
+        self.written += 1
+        return len(header) + len(payload)
+
+    def close(self):
+        if self._delta is not None:
+            self._delta.close()
+            self._delta = None
+
+
+class ControllerState(object):
+    """Capture and restore of the state TrafficMonitor checkpoints
+
+    The objects are the live ones and are updated in place by restore().
+    ``mac_table`` creates the table of a switch seen only in a checkpoint.
+    """
+
+    def __init__(self, protocol_stats, history, summaries, mac_tables, mac_table):
+        self.protocol_stats = protocol_stats
+        self.history = history
+        self.summaries = summaries
+        self.mac_tables = mac_tables
+        self.mac_table = mac_table
+        self._since = None
+        self._cursor = 0
+
+    def capture(self, full, now, pause=None):
+        """Copy the state, or with ``full`` False what changed since the last capture
+
+        ``pause`` is called after each MAC table, so a caller on an event
+        loop can yield between switches.
+        """
+        since = None if full else self._since
+        ring = self.summaries
+        state = {
+            'time': now,
+            'protocol_stats': dict((proto, dict(stats))
+                                   for proto, stats in self.protocol_stats.items()),
+            'history': self.history.to_state(since),
+            'summaries': ring.to_state(ring.oldest_seq() if full else self._cursor),
+            'mac_tables': {},
+        }
+        self._since = now
+        self._cursor = ring.total
+        for dpid, table in list(self.mac_tables.items()):
+            state['mac_tables'][str(dpid)] = table.to_state(since)
+            if pause is not None:
+                pause()
+        return state
+
+    def restore(self, full, deltas):
+        """Apply a full state and its deltas; return the messages of skipped parts"""
+        errors = set()
+        # 一次创建数百万个 MAC 条目，期间暂停循环垃圾回收
+        collect = gc.isenabled()
+        gc.disable()
+        try:
+            for state in [full] + deltas:
+                for proto, stats in state['protocol_stats'].items():
+                    if proto in self.protocol_stats:
+                        self.protocol_stats[proto].update(stats)
+                for target, saved in ((self.history, state['history']),
+                                      (self.summaries, state['summaries'])):
+                    try:
+                        target.apply_state(saved)
+                    except ValueError as e:
+                        # 协议映射或历史分级改变后，保存的数据无法对应
+                        errors.add(str(e))
+                for dpid, saved in state['mac_tables'].items():
+                    table = self.mac_tables.get(int(dpid))
+                    if table is None:
+                        table = self.mac_tables[int(dpid)] = self.mac_table()
+                    table.apply_state(saved)
+        finally:
+            if collect:
+                gc.enable()
+        return sorted(errors)
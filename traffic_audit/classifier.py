@@ -0,0 +1,157 @@
+"""Table-driven protocol classification.
+
+Every configured protocol is a list of specs such as ``tcp/80``,
+``udp/67-68`` or ``icmp``.  They are expanded once into a dict keyed by
+``(ip_proto << 16) | port`` so classifying a packet costs at most two dict
+lookups.  The destination port is looked up first, then the source port.
+"""
+import json
+
+from traffic_audit.decode import ETH_TYPE_IP, IPPROTO_ICMP, IPPROTO_TCP, IPPROTO_UDP
+
+OTHER = 'other'
+
+IP_PROTOCOLS = {
+    'icmp': IPPROTO_ICMP,
+    'tcp': IPPROTO_TCP,
+    'udp': IPPROTO_UDP,
+    'sctp': 132,
+}
+
+DEFAULT_PROTOCOLS = [
+    ('http', ['tcp/80']),
+    ('https', ['tcp/443']),
+    ('ftp', ['tcp/21']),
+    ('smtp', ['tcp/25']),
+    ('pop3', ['tcp/110']),
+    ('imap', ['tcp/143']),
+    ('ssh', ['tcp/22']),
+    ('dns', ['udp/53']),
+    ('dhcp', ['udp/67', 'udp/68']),
+    ('icmp', ['icmp']),
+]
+
+# OFPMatch 字段名：(源端口, 目的端口)
+_MATCH_PORT_FIELDS = {
+    IPPROTO_TCP: ('tcp_src', 'tcp_dst'),
+    IPPROTO_UDP: ('udp_src', 'udp_dst'),
+    132: ('sctp_src', 'sctp_dst'),
+}
+
+
+def parse_spec(spec):
+    """Parse 'tcp/80', 'udp/67-68', 'icmp' or '132/2905' into (proto, ports)"""
+    name, _, ports = spec.strip().lower().partition('/')
+    if name in IP_PROTOCOLS:
+        proto = IP_PROTOCOLS[name]
+    elif name.isdigit() and int(name) < 256:
+        proto = int(name)
+    else:
+        raise ValueError('unknown IP protocol in %r' % spec)
+    if not ports:
+        return proto, None
+    low, _, high = ports.partition('-')
+    try:
+        low = int(low)
+        high = int(high) if high else low
+    except ValueError:
+        raise ValueError('bad port range in %r' % spec)
+    if not 0 <= low <= high <= 0xffff:
+        raise ValueError('bad port range in %r' % spec)
+    return proto, range(low, high + 1)
+
+
+def load_protocol_map(path):
+    """Load [(name, [spec, ...]), ...] from a JSON object {name: [spec, ...]}"""
+    with open(path) as f:
+        data = json.load(f)
+    if not isinstance(data, dict):
+        raise ValueError('%s: expected a JSON object' % path)
+    return [(name, [specs] if isinstance(specs, str) else list(specs))
+            for name, specs in data.items()]
+
+
+class ProtocolClassifier(object):
+    """Map (ip_proto, port) pairs to protocol names"""
+
+    def __init__(self, protocols=None):
+        if protocols is None:
+            protocols = DEFAULT_PROTOCOLS
+        self._ports = {}
+        self._protos = {}
+        names = []
+        for name, specs in protocols:
+            if name == OTHER:
+                raise ValueError("'%s' is reserved" % OTHER)
+            if name not in names:
+                names.append(name)
+            for spec in specs:
+                proto, ports = parse_spec(spec)
+                if ports is None:
+                    self._protos.setdefault(proto, name)
+                    continue
+                base = proto << 16
+                for port in ports:
+                    # 先配置的协议优先
+                    self._ports.setdefault(base | port, name)
+        names.append(OTHER)
+        self.protocols = tuple(names)
+
+    @classmethod
+    def from_file(cls, path):
+        return cls(load_protocol_map(path))
+
+    def classify(self, headers):
+        """Identify protocol type from decoded headers"""
+        proto = headers.ip_proto
+        if proto is None:
+            return OTHER
+        dst_port = headers.dst_port
+        if dst_port is not None:
+            base = proto << 16
+            name = self._ports.get(base | dst_port)
+            if name is None:
+                name = self._ports.get(base | headers.src_port)
+            if name is not None:
+                return name
+        return self._protos.get(proto, OTHER)
+
+    def classify_match(self, match):
+        """Identify protocol type from the fields of an OFPMatch"""
+        proto = match.get('ip_proto')
+        if proto is None or isinstance(proto, tuple):
+            return OTHER
+        fields = _MATCH_PORT_FIELDS.get(proto)
+        if fields is not None:
+            base = proto << 16
+            for field in (fields[1], fields[0]):
+                port = match.get(field)
+                # 带掩码的端口匹配无法确定单一协议
+                if port is None or isinstance(port, tuple):
+                    continue
+                name = self._ports.get(base | port)
+                if name is not None:
+                    return name
+        return self._protos.get(proto, OTHER)
+
+    def match_rules(self):
+        """Return [(tier, protocol, match fields)] for classifying in a switch table
+
+        Tier 2 rules match the destination port, tier 1 the source port and
+        tier 0 the IP protocol alone; installing them with priorities in
+        tier order reproduces the lookup order of classify().  Ports of IP
+        protocols that OpenFlow cannot match on are skipped.
+        """
+        rules = []
+        for key, name in sorted(self._ports.items()):
+            proto, port = key >> 16, key & 0xffff
+            fields = _MATCH_PORT_FIELDS.get(proto)
+            if fields is None:
+                continue
+            rules.append((2, name, {'eth_type': ETH_TYPE_IP, 'ip_proto': proto,
+                                    fields[1]: port}))
+            rules.append((1, name, {'eth_type': ETH_TYPE_IP, 'ip_proto': proto,
+                                    fields[0]: port}))
+        for proto, name in sorted(self._protos.items()):
+            rules.append((0, name, {'eth_type': ETH_TYPE_IP, 'ip_proto': proto}))
+        return rules
@@ -0,0 +1,145 @@
+"""NetFlow-style conversation table keyed by (dpid, 5-tuple).
+
+Every IPv4 packet seen by the controller (and, in proactive mode, every
+flow-counter delta) is folded into one entry per direction of a
+conversation holding first/last-seen timestamps, packet and byte counters
+and the OR of the TCP flags.  The table is an ``OrderedDict`` kept in
+last-seen order, so idle entries are found at the front without scanning
+and the least recently seen entry is the one evicted when the table is
+full.  Expired entries are queued for export in batches and the most
+recent ones are kept for the REST API.
+"""
+import heapq
+import json
+from collections import OrderedDict, deque
+
+from traffic_audit.decode import ipv4_str
+
+# 条目内容：[首次出现, 最后出现, 包数, 字节数, 协议, TCP 标志]
+_FIRST, _LAST, _PACKETS, _BYTES, _PROTOCOL, _FLAGS = range(6)
+
+SORT_FIELDS = ('bytes', 'packets', 'last_seen', 'duration')
+
+
+def _sort_value(sort, entry):
+    if sort == 'duration':
+        return entry[_LAST] - entry[_FIRST]
+    return entry[{'bytes': _BYTES, 'packets': _PACKETS, 'last_seen': _LAST}[sort]]
+
+
+def conversation_key(dpid, headers):
+    """Return the table key of a decoded packet, or None if it is not IPv4"""
+    if headers.ip_proto is None:
+        return None
+    return (dpid, headers.ip_src, headers.ip_dst, headers.ip_proto,
+            headers.src_port or 0, headers.dst_port or 0)
+
+
+def _record(key, entry, state, reason=None):
+    dpid, ip_src, ip_dst, ip_proto, src_port, dst_port = key
+    rec = {
+        'dpid': dpid,
+        'ip_src': ipv4_str(ip_src),
+        'ip_dst': ipv4_str(ip_dst),
+        'ip_proto': ip_proto,
+        'src_port': src_port,
+        'dst_port': dst_port,
+        'protocol': entry[_PROTOCOL],
+        'first_seen': entry[_FIRST],
+        'last_seen': entry[_LAST],
+        'packets': entry[_PACKETS],
+        'bytes': entry[_BYTES],
+        'tcp_flags': entry[_FLAGS],
+        'state': state,
+    }
+    if reason is not None:
+        rec['end_reason'] = reason
+    return rec
+
+
+class ConversationTable(object):
+    """Bounded conversation table with idle timeout and LRU eviction"""
+
+    def __init__(self, max_entries=100000, idle_timeout=60.0, recent=1000):
+        self.max_entries = max_entries
+        self.idle_timeout = idle_timeout
+        self._entries = OrderedDict()
+        # 最近结束的会话，供 REST 接口查询
+        self.recent = deque(maxlen=recent)
+        # 等待导出的结束会话
+        self._pending = []
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key, packets, nbytes, now, protocol, tcp_flags=0):
+        entry = self._entries.get(key)
+        if entry is None:
+            if len(self._entries) >= self.max_entries:
+                # 表满：淘汰最久未出现的会话
+                old_key, old_entry = self._entries.popitem(last=False)
+                self._finish(old_key, old_entry, 'evicted')
+                self.evicted += 1
+            self._entries[key] = [now, now, packets, nbytes, protocol, tcp_flags or 0]
+            return
+        entry[_LAST] = now
+        entry[_PACKETS] += packets
+        entry[_BYTES] += nbytes
+        if tcp_flags:
+            entry[_FLAGS] |= tcp_flags
+        self._entries.move_to_end(key)
+
+    def _finish(self, key, entry, reason):
+        rec = _record(key, entry, 'expired', reason)
+        self.recent.append(rec)
+        self._pending.append(rec)
+
+    def expire(self, now):
+        """End conversations idle for longer than ``idle_timeout``; returns how many"""
+        entries = self._entries
+        deadline = now - self.idle_timeout
+        expired = 0
+        # 条目按最后出现时间排列，只需检查表头
+        while entries:
+            key, entry = next(iter(entries.items()))
+            if entry[_LAST] > deadline:
+                break
+            del entries[key]
+            self._finish(key, entry, 'idle')
+            expired += 1
+        return expired
+
+    def drain(self):
+        """Return and forget the conversations that ended since the last call"""
+        pending, self._pending = self._pending, []
+        return pending
+
+    def clear(self):
+        self._entries.clear()
+        self.recent.clear()
+        self._pending = []
+
+    def active(self, sort='bytes', limit=100, dpid=None):
+        """Top ``limit`` active conversations by ``sort``"""
+        items = (item for item in self._entries.items()
+                 if dpid is None or item[0][0] == dpid)
+        # 先在原始条目上选出前 N 个，只为返回的条目生成字典
+        top = heapq.nlargest(limit, items, key=lambda item: _sort_value(sort, item[1]))
+        return [_record(key, entry, 'active') for key, entry in top]
+
+    def expired(self, sort='bytes', limit=100, dpid=None):
+        """Top ``limit`` recently ended conversations by ``sort``"""
+        records = (rec for rec in self.recent if dpid is None or rec['dpid'] == dpid)
+        if sort == 'duration':
+            return heapq.nlargest(limit, records,
+                                  key=lambda rec: rec['last_seen'] - rec['first_seen'])
+        return heapq.nlargest(limit, records, key=lambda rec: rec[sort])
+
+
+def write_ndjson(path, records):
+    """Append ``records`` to ``path``, one JSON object per line"""
+    if not records:
+        return
+    with open(path, 'a') as f:
+        f.write(''.join(json.dumps(rec) + '\n' for rec in records))
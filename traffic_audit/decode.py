@@ -0,0 +1,122 @@
+"""Single-pass header extraction for packet-in payloads.
+
+``decode_frame`` reads Ethernet / 802.1Q / IPv4 / TCP / UDP / ICMP headers
+straight out of the raw bytes with precompiled ``struct`` formats.  It
+returns ``None`` for frames it cannot decode on its own (truncated headers,
+bad IPv4 version or IHL) so that the caller can fall back to ryu's parser.
+"""
+import socket
+import struct
+
+ETH_TYPE_IP = 0x0800
+ETH_TYPE_ARP = 0x0806
+ETH_TYPE_IPV6 = 0x86dd
+ETH_TYPE_8021Q = 0x8100
+ETH_TYPE_8021AD = 0x88a8
+
+IPPROTO_ICMP = 1
+IPPROTO_TCP = 6
+IPPROTO_UDP = 17
+
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+TCP_ACK = 0x10
+
+_ETH = struct.Struct('!6s6sH')
+_VLAN = struct.Struct('!HH')
+_IPV4 = struct.Struct('!BxxxxxHxBxxII')
+_PORTS = struct.Struct('!HH')
+
+_ETH_LEN = _ETH.size
+_IPV4_MIN_LEN = 20
+
+
+class FrameHeaders(object):
+    """Header fields of one frame.
+
+    MAC addresses are kept as 6-byte strings and IPv4 addresses as unsigned
+    integers; use ``mac_str``/``ipv4_str`` to render them.  Fields that are
+    not present in the frame are ``None``.
+    """
+    __slots__ = ('eth_src', 'eth_dst', 'eth_type', 'ip_src', 'ip_dst',
+                 'ip_proto', 'src_port', 'dst_port', 'tcp_flags', 'length')
+
+    def __init__(self, eth_src=None, eth_dst=None, eth_type=None, length=0):
+        self.eth_src = eth_src
+        self.eth_dst = eth_dst
+        self.eth_type = eth_type
+        self.ip_src = None
+        self.ip_dst = None
+        self.ip_proto = None
+        self.src_port = None
+        self.dst_port = None
+        self.tcp_flags = None
+        self.length = length
+
+
+def decode_frame(data):
+    """Decode ``data`` into a FrameHeaders, or return None if it is malformed"""
+    n = len(data)
+    if n < _ETH_LEN:
+        return None
+    eth_dst, eth_src, eth_type = _ETH.unpack_from(data, 0)
+    off = _ETH_LEN
+    # 跳过 VLAN 标签，取内层以太网类型
+    while eth_type == ETH_TYPE_8021Q or eth_type == ETH_TYPE_8021AD:
+        if n < off + 4:
+            return None
+        eth_type = _VLAN.unpack_from(data, off)[1]
+        off += 4
+
+    headers = FrameHeaders(eth_src, eth_dst, eth_type, n)
+    if eth_type != ETH_TYPE_IP:
+        return headers
+
+    if n < off + _IPV4_MIN_LEN:
+        return None
+    ver_ihl, frag, proto, ip_src, ip_dst = _IPV4.unpack_from(data, off)
+    ihl = (ver_ihl & 0x0f) << 2
+    if ver_ihl >> 4 != 4 or ihl < _IPV4_MIN_LEN:
+        return None
+    headers.ip_src = ip_src
+    headers.ip_dst = ip_dst
+    headers.ip_proto = proto
+    if frag & 0x1fff:
+        # 非首个分片不携带传输层头部
+        return headers
+
+    off += ihl
+    if proto == IPPROTO_TCP:
+        if n < off + 14:
+            return None
+        headers.src_port, headers.dst_port = _PORTS.unpack_from(data, off)
+        headers.tcp_flags = data[off + 13]
+    elif proto == IPPROTO_UDP:
+        if n < off + 8:
+            return None
+        headers.src_port, headers.dst_port = _PORTS.unpack_from(data, off)
+    elif proto == IPPROTO_ICMP:
+        if n < off + 4:
+            return None
+    return headers
+
+
+def mac_str(raw):
+    """Render a 6-byte MAC address as aa:bb:cc:dd:ee:ff"""
+    return raw.hex(':')
+
+
+def mac_bin(text):
+    """Inverse of mac_str"""
+    return bytes.fromhex(text.replace(':', ''))
+
+
+def ipv4_str(value):
+    """Render an integer IPv4 address in dotted-quad form"""
+    return socket.inet_ntoa(struct.pack('!I', value))
+
+
+def ipv4_int(text):
+    """Inverse of ipv4_str"""
+    return struct.unpack('!I', socket.inet_aton(text))[0]
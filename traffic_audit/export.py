@@ -0,0 +1,195 @@
+"""Streaming encoders for bulk exports of summaries, flows and history.
+
+Rows are produced by generators and encoded ``chunk_rows`` at a time, so
+an export holds one chunk in memory no matter how many rows it has.  The
+caller decides what to do between chunks (the REST handler yields to
+other green threads there).
+
+Formats:
+
+* ``csv``: a header line, then one line per row; missing values are empty.
+* ``ndjson``: one JSON object per line.
+* ``arrow``: an Arrow IPC stream, one record batch per chunk.
+* ``parquet``: a Parquet file, one row group per chunk.
+
+The last two need pyarrow and are only offered when it is installed.
+"""
+import csv
+import io
+import json
+
+from traffic_audit.decode import mac_str, ipv4_str
+from traffic_audit.ringbuffer import HAS_ETH, HAS_IP, HAS_PORTS
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+CHUNK_ROWS = 1000
+
+CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+    'arrow': 'application/vnd.apache.arrow.stream',
+    'parquet': 'application/vnd.apache.parquet',
+}
+EXTENSIONS = {'csv': 'csv', 'ndjson': 'ndjson', 'arrow': 'arrows', 'parquet': 'parquet'}
+
+# 各数据集的列：(列名, 类型)
+SUMMARY_COLUMNS = (
+    ('timestamp', 'float'), ('dpid', 'int'), ('in_port', 'int'),
+    ('eth_src', 'str'), ('eth_dst', 'str'), ('eth_type', 'int'),
+    ('ip_src', 'str'), ('ip_dst', 'str'), ('ip_proto', 'int'),
+    ('src_port', 'int'), ('dst_port', 'int'), ('packet_len', 'int'),
+    ('protocol', 'str'),
+)
+FLOW_COLUMNS = (
+    ('dpid', 'int'), ('table_id', 'int'), ('match', 'str'), ('duration', 'int'),
+    ('packets', 'int'), ('bytes', 'int'), ('protocol', 'str'),
+    ('bps', 'float'), ('pps', 'float'),
+)
+HISTORY_COLUMNS = (
+    ('timestamp', 'float'), ('protocol', 'str'), ('packets', 'int'), ('bytes', 'int'),
+)
+
+
+def available_formats():
+    if pyarrow is None:
+        return ('csv', 'ndjson')
+    return ('csv', 'ndjson', 'arrow', 'parquet')
+
+
+def summary_rows(records, labels):
+    """Rows of SUMMARY_COLUMNS from raw summary value tuples"""
+    other = 'other'
+    count = len(labels)
+    for (timestamp, dpid, in_port, eth_src, eth_dst, eth_type, ip_src, ip_dst,
+         ip_proto, src_port, dst_port, packet_len, protocol, flags) in records:
+        row = [timestamp, dpid, in_port, None, None, None, None, None, None,
+               None, None, packet_len, labels[protocol] if protocol < count else other]
+        if flags & HAS_ETH:
+            row[3] = mac_str(eth_src.to_bytes(6, 'big'))
+            row[4] = mac_str(eth_dst.to_bytes(6, 'big'))
+            row[5] = eth_type
+        if flags & HAS_IP:
+            row[6] = ipv4_str(ip_src)
+            row[7] = ipv4_str(ip_dst)
+            row[8] = ip_proto
+            if flags & HAS_PORTS:
+                row[9] = src_port
+                row[10] = dst_port
+        yield row
+
+
+def flow_rows(flow_stats):
+    """Rows of FLOW_COLUMNS from {dpid: [flow_info, ...]}"""
+    for dpid, flows in list(flow_stats.items()):
+        for flow in list(flows):
+            rates = flow.get('rates') or {}
+            yield [dpid, flow['table_id'], flow['match'], flow['duration'],
+                   flow['packets'], flow['bytes'], flow['protocol'],
+                   rates.get('bps'), rates.get('pps')]
+
+
+def history_rows(history):
+    """Rows of HISTORY_COLUMNS from a ProtocolTimeSeries.query() result"""
+    protocols = list(history['protocols'].items())
+    for n, timestamp in enumerate(history['timestamps']):
+        for name, series in protocols:
+            yield [timestamp, name, series['packets'][n], series['bytes'][n]]
+
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def _csv(rows, columns, chunk_rows):
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator='\n')
+    writer.writerow([name for name, _ in columns])
+    for chunk in _chunks(rows, chunk_rows):
+        writer.writerows(chunk)
+        yield buf.getvalue().encode('utf-8')
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        # 没有数据行时只输出表头
+        yield buf.getvalue().encode('utf-8')
+
+
+def _ndjson(rows, columns, chunk_rows):
+    names = [name for name, _ in columns]
+    dumps = json.JSONEncoder(separators=(',', ':')).encode
+    for chunk in _chunks(rows, chunk_rows):
+        yield ''.join([dumps(dict(zip(names, row))) + '\n' for row in chunk]).encode('utf-8')
+
+
+class _Drain(object):
+    """Write-only file object whose content is taken out after each chunk"""
+
+    closed = False
+
+    def __init__(self):
+        self._parts = []
+        self._position = 0
+
+    def write(self, data):
+        data = bytes(data)
+        self._parts.append(data)
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def take(self):
+        data = b''.join(self._parts)
+        self._parts = []
+        return data
+
+
+def _arrow(rows, columns, chunk_rows, parquet):
+    types = {'float': pyarrow.float64(), 'int': pyarrow.int64(), 'str': pyarrow.string()}
+    schema = pyarrow.schema([(name, types[kind]) for name, kind in columns])
+    sink = _Drain()
+    if parquet:
+        writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    else:
+        writer = pyarrow.ipc.new_stream(sink, schema)
+    for chunk in _chunks(rows, chunk_rows):
+        arrays = [pyarrow.array(values, type=field.type)
+                  for values, field in zip(zip(*chunk), schema)]
+        if parquet:
+            writer.write_table(pyarrow.Table.from_arrays(arrays, schema=schema))
+        else:
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(arrays, schema=schema))
+        yield sink.take()
+    writer.close()
+    yield sink.take()
+
+
+def encode(rows, columns, fmt, chunk_rows=CHUNK_ROWS):
+    """Yield ``rows`` encoded as ``fmt`` in chunks of ``chunk_rows`` rows"""
+    if fmt not in available_formats():
+        raise ValueError('"format" must be one of %s' % ', '.join(available_formats()))
+    if fmt == 'csv':
+        return _csv(rows, columns, chunk_rows)
+    if fmt == 'ndjson':
+        return _ndjson(rows, columns, chunk_rows)
+    return _arrow(rows, columns, chunk_rows, fmt == 'parquet')
@@ -0,0 +1,77 @@
+"""Bounded, prioritized intake queue for packet-ins.
+
+Packet-ins are decoded as they arrive and queued in one of two classes:
+control traffic the network needs to keep working (ARP, DHCP, DNS) and
+everything else.  The worker always drains the control class first.  When
+the queue is full the lowest class is shed first: a new bulk packet is
+dropped, while a new control packet displaces the oldest queued bulk one
+and is only dropped itself when the queue holds nothing but control
+traffic.
+"""
+from collections import deque
+
+from traffic_audit.decode import ETH_TYPE_ARP, IPPROTO_UDP
+
+CONTROL, BULK = 0, 1
+CLASS_NAMES = ('control', 'bulk')
+
+# 被丢弃的数据包在协议统计中记为这一类
+UNCLASSIFIED = 'unclassified'
+
+_CONTROL_UDP_PORTS = frozenset((53, 67, 68))
+
+
+def priority_class(headers):
+    """CONTROL for ARP, DHCP and DNS, BULK for everything else"""
+    if headers.eth_type == ETH_TYPE_ARP:
+        return CONTROL
+    if headers.ip_proto == IPPROTO_UDP and (headers.dst_port in _CONTROL_UDP_PORTS or
+                                            headers.src_port in _CONTROL_UDP_PORTS):
+        return CONTROL
+    return BULK
+
+
+class IntakeQueue(object):
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self._queues = (deque(), deque())
+        self.enqueued = [0, 0]
+        self.shed = [0, 0]
+        self.high_water = 0
+
+    def __len__(self):
+        return len(self._queues[CONTROL]) + len(self._queues[BULK])
+
+    def put(self, item, cls):
+        """Queue ``item`` in class ``cls``; return the (item, cls) shed to make room, or None"""
+        shed = None
+        if len(self) >= self.capacity:
+            bulk = self._queues[BULK]
+            if cls == BULK or not bulk:
+                self.shed[cls] += 1
+                return item, cls
+            shed = (bulk.popleft(), BULK)
+            self.shed[BULK] += 1
+        self._queues[cls].append(item)
+        self.enqueued[cls] += 1
+        size = len(self)
+        if size > self.high_water:
+            self.high_water = size
+        return shed
+
+    def get(self):
+        """Return the next item, control class first, or None if empty"""
+        for queue in self._queues:
+            if queue:
+                return queue.popleft()
+        return None
+
+    def stats(self):
+        return {
+            'length': len(self),
+            'capacity': self.capacity,
+            'high_water': self.high_water,
+            'enqueued': dict(zip(CLASS_NAMES, self.enqueued)),
+            'shed': dict(zip(CLASS_NAMES, self.shed)),
+        }
@@ -0,0 +1,183 @@
+"""Per-switch MAC learning table with aging, a size limit and move detection.
+
+Entries are keyed by the raw 6-byte address from the decoder, so learning
+a MAC on the packet-in path costs no string formatting.  The table is an
+OrderedDict in queue order; refreshing an entry only updates its
+timestamp, and an entry found at the head of the queue that was seen
+since it was queued gets a second chance (moved to the tail) instead of
+being aged out or evicted.  Each packet does at most a bounded amount of
+sweeping, so there is no periodic full scan.
+"""
+from array import array
+from collections import OrderedDict
+
+from traffic_audit.decode import mac_str
+
+LEARNED, REFRESHED, MOVED = 0, 1, 2
+
+# 每次学习时最多检查队首的条目数，老化的开销分摊到各个数据包上
+_SWEEP = 2
+
+# 条目：[端口, 最后出现时间, 入队时间]
+_PORT, _SEEN, _QUEUED = range(3)
+
+
+class MacTable(object):
+
+    def __init__(self, max_size=8192, aging=300.0):
+        self.max_size = max_size
+        self.aging = aging
+        self._entries = OrderedDict()
+        self.learned = 0
+        self.moves = 0
+        self.aged = 0
+        self.evicted = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def learn(self, mac, port, now):
+        """Record ``mac`` behind ``port``; return (LEARNED | REFRESHED | MOVED, old port)"""
+        entry = self._entries.get(mac)
+        if entry is not None and now - entry[_SEEN] < self.aging:
+            entry[_SEEN] = now
+            if entry[_PORT] == port:
+                return REFRESHED, port
+            old = entry[_PORT]
+            entry[_PORT] = port
+            self.moves += 1
+            return MOVED, old
+        if entry is not None:
+            # 已老化但还没被清理的条目，按新学习处理
+            del self._entries[mac]
+            self.aged += 1
+        self._sweep(now, _SWEEP)
+        while len(self._entries) >= self.max_size:
+            self._evict_oldest(now)
+        self._entries[mac] = [port, now, now]
+        self.learned += 1
+        return LEARNED, None
+
+    def lookup(self, mac, now):
+        """Port behind ``mac``, or None if unknown or aged out"""
+        entry = self._entries.get(mac)
+        if entry is None or now - entry[_SEEN] >= self.aging:
+            return None
+        return entry[_PORT]
+
+    def _sweep(self, now, limit):
+        entries = self._entries
+        while entries and limit:
+            limit -= 1
+            mac, entry = next(iter(entries.items()))
+            if now - entry[_SEEN] >= self.aging:
+                del entries[mac]
+                self.aged += 1
+            elif entry[_SEEN] > entry[_QUEUED]:
+                # 入队之后又出现过：放回队尾
+                entry[_QUEUED] = entry[_SEEN]
+                entries.move_to_end(mac)
+            else:
+                return
+
+    def _evict_oldest(self, now):
+        entries = self._entries
+        while True:
+            mac, entry = next(iter(entries.items()))
+            if entry[_SEEN] > entry[_QUEUED] and now - entry[_SEEN] < self.aging:
+                entry[_QUEUED] = entry[_SEEN]
+                entries.move_to_end(mac)
+                continue
+            del entries[mac]
+            if now - entry[_SEEN] >= self.aging:
+                self.aged += 1
+            else:
+                self.evicted += 1
+            return
+
+    def expire(self, now):
+        """Remove every aged-out entry; return how many were removed"""
+        aged = [mac for mac, entry in self._entries.items()
+                if now - entry[_SEEN] >= self.aging]
+        for mac in aged:
+            del self._entries[mac]
+        self.aged += len(aged)
+        return len(aged)
+
+    def entries(self, now, port=None):
+        """Live entries as dicts, most recently seen first"""
+        result = [
+            {'mac': mac_str(mac), 'port': entry[_PORT], 'age': now - entry[_SEEN]}
+            for mac, entry in self._entries.items()
+            if now - entry[_SEEN] < self.aging and (port is None or entry[_PORT] == port)
+        ]
+        result.sort(key=lambda e: e['age'])
+        return result
+
+    def to_state(self, since=None):
+        """Return the entries in queue order as raw columns
+
+        With ``since``, only entries seen at ``since`` or later.
+        """
+        macs = []
+        ports = array('I')
+        seen = array('d')
+        add_mac, add_port, add_seen = macs.append, ports.append, seen.append
+        for mac, entry in self._entries.items():
+            if since is None or entry[_SEEN] >= since:
+                add_mac(mac)
+                add_port(entry[_PORT])
+                add_seen(entry[_SEEN])
+        return {'macs': b''.join(macs), 'ports': ports.tobytes(), 'seen': seen.tobytes()}
+
+    def apply_state(self, state):
+        """Insert or update the entries of a ``to_state()`` dict at the tail"""
+        macs = state['macs']
+        ports = array('I')
+        ports.frombytes(state['ports'])
+        seen = array('d')
+        seen.frombytes(state['seen'])
+        keys = [macs[i:i + 6] for i in range(0, len(macs), 6)]
+        entries = self._entries
+        if entries:
+            for mac in keys:
+                entries.pop(mac, None)
+        entries.update(zip(keys, [[port, t, t] for port, t in zip(ports, seen)]))
+        # 恢复的条目保留原来的时间，过期的照常老化；超出上限时丢弃最旧的
+        while len(entries) > self.max_size:
+            entries.popitem(last=False)
+            self.evicted += 1
+
+    def stats(self):
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'aging': self.aging,
+            'learned': self.learned,
+            'moves': self.moves,
+            'aged': self.aged,
+            'evicted': self.evicted,
+        }
+
+
+class LogLimiter(object):
+    """Let through at most one message per key every ``interval`` seconds"""
+
+    def __init__(self, interval=10.0):
+        self.interval = interval
+        self._last = {}
+        self._suppressed = {}
+
+    def allow(self, key, now):
+        """Return the number of messages suppressed since the last one, or None to drop"""
+        last = self._last.get(key)
+        if last is not None and now - last < self.interval:
+            self._suppressed[key] = self._suppressed.get(key, 0) + 1
+            return None
+        self._last[key] = now
+        return self._suppressed.pop(key, 0)
+
+    def forget(self, predicate):
+        for key in [k for k in self._last if predicate(k)]:
+            del self._last[key]
+            self._suppressed.pop(key, None)
@@ -0,0 +1,179 @@
+"""Minimal Prometheus-style metrics with the text exposition format.
+
+Hot-path metrics are plain objects updated in place: a counter is an
+attribute increment and a histogram observation is a bisect into a
+preallocated bucket array, with no per-sample allocation of containers.
+Ryu runs every handler and REST request on green threads of a single OS
+thread, so no locking is needed.  Callers look a labelled child up once
+(``family.labels(...)``) and keep the reference.
+
+Values that already live elsewhere (protocol and port counters, buffer
+sizes) are not copied on every update; they are read by callbacks when the
+registry is rendered.
+"""
+import math
+from array import array
+from bisect import bisect_left
+
+LATENCY_BUCKETS = (5e-6, 1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 1e-3,
+                   2.5e-3, 5e-3, 1e-2, 2.5e-2, 0.1)
+RTT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+               1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+class Counter(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+
+class Gauge(object):
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram(object):
+    __slots__ = ('bounds', 'counts', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # 最后一个桶对应 +Inf
+        self.counts = array('Q', bytes(8 * (len(bounds) + 1)))
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        if value.is_integer() and abs(value) < 1e15:
+            return str(int(value))
+        return repr(value)
+    return str(value)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _label_str(names, values, extra=None):
+    pairs = ['%s="%s"' % (name, _escape(value)) for name, value in zip(names, values)]
+    if extra is not None:
+        pairs.append('%s="%s"' % extra)
+    return '{%s}' % ','.join(pairs) if pairs else ''
+
+
+class MetricFamily(object):
+    """A named metric with zero or more label dimensions"""
+
+    def __init__(self, name, help, kind, labelnames=(), buckets=None):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(buckets) if buckets is not None else None
+        self._children = {}
+
+    def labels(self, *values):
+        values = tuple(str(v) for v in values)
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError('%s expects labels %s' % (self.name, self.labelnames))
+            if self.kind == 'counter':
+                child = Counter()
+            elif self.kind == 'gauge':
+                child = Gauge()
+            else:
+                child = Histogram(self.buckets)
+            self._children[values] = child
+        return child
+
+    def remove(self, *values):
+        self._children.pop(tuple(str(v) for v in values), None)
+
+    def remove_matching(self, label, value):
+        """Drop every child whose ``label`` equals ``value``"""
+        i = self.labelnames.index(label)
+        value = str(value)
+        for values in [v for v in self._children if v[i] == value]:
+            del self._children[values]
+
+    def samples(self):
+        for values, child in sorted(self._children.items()):
+            if self.kind != 'histogram':
+                yield self.name, _label_str(self.labelnames, values), child.value
+                continue
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), child.counts):
+                cumulative += count
+                yield (self.name + '_bucket',
+                       _label_str(self.labelnames, values, ('le', _format_value(float(bound)))),
+                       cumulative)
+            yield self.name + '_sum', _label_str(self.labelnames, values), child.sum
+            yield self.name + '_count', _label_str(self.labelnames, values), cumulative
+
+
+class CallbackFamily(object):
+    """A metric whose samples are produced by ``collect()`` at render time
+
+    ``collect`` returns an iterable of (label values, value) pairs.
+    """
+
+    def __init__(self, name, help, kind, labelnames, collect):
+        self.name = name
+        self.help = help
+        self.kind = kind
+        self.labelnames = tuple(labelnames)
+        self.collect = collect
+
+    def samples(self):
+        for values, value in self.collect():
+            yield self.name, _label_str(self.labelnames, values), value
+
+
+class Registry(object):
+    def __init__(self):
+        self._families = []
+
+    def _add(self, family):
+        self._families.append(family)
+        return family
+
+    def counter(self, name, help, labelnames=()):
+        return self._add(MetricFamily(name, help, 'counter', labelnames))
+
+    def gauge(self, name, help, labelnames=()):
+        return self._add(MetricFamily(name, help, 'gauge', labelnames))
+
+    def histogram(self, name, help, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self._add(MetricFamily(name, help, 'histogram', labelnames, buckets))
+
+    def callback(self, name, help, kind, collect, labelnames=()):
+        return self._add(CallbackFamily(name, help, kind, labelnames, collect))
+
+    def render(self):
+        """Return all metrics in the Prometheus text exposition format"""
+        lines = []
+        for family in self._families:
+            lines.append('# HELP %s %s' % (family.name, family.help))
+            lines.append('# TYPE %s %s' % (family.name, family.kind))
+            for name, labels, value in family.samples():
+                lines.append('%s%s %s' % (name, labels, _format_value(value)))
+        lines.append('')
+        return '\n'.join(lines)
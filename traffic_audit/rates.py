@@ -0,0 +1,66 @@
+"""Per-second rates from cumulative OpenFlow counters.
+
+OpenFlow port and flow counters only ever grow, except when the port is
+reset or the flow entry is re-created.  ``RateTracker`` keeps the previous
+sample of every (dpid, key) and turns the next one into rates, using the
+``duration_sec/nsec`` reported by the switch as the time base so that a
+missed poll only widens the interval instead of skewing the result.
+"""
+
+
+def duration_of(stat):
+    """Seconds since a port or flow was created, from duration_sec/nsec"""
+    return stat.duration_sec + stat.duration_nsec * 1e-9
+
+
+class RateTracker(object):
+    """Previous-sample store for one kind of counter set"""
+
+    def __init__(self, fields, scale=None):
+        self.fields = tuple(fields)
+        # 字节计数换算为比特率时乘以 8
+        self.scale = tuple((scale or {}).get(name, 1) for name in self.fields)
+        self._prev = {}
+
+    def update(self, dpid, key, counters, duration, now):
+        """Record a sample and return {field: per-second rate}, or None for the first one
+
+        ``counters`` is a tuple in ``fields`` order.  If the switch did not
+        report a usable duration, wall-clock time ``now`` is used instead.
+        """
+        samples = self._prev.get(dpid)
+        if samples is None:
+            samples = self._prev[dpid] = {}
+        prev = samples.get(key)
+        samples[key] = (counters, duration, now)
+        if prev is None:
+            return None
+        prev_counters, prev_duration, prev_now = prev
+
+        if duration and prev_duration:
+            elapsed = duration - prev_duration
+        else:
+            elapsed = now - prev_now
+        reset = elapsed <= 0 or any(c < p for c, p in zip(counters, prev_counters))
+        if reset:
+            # 计数器被重置（端口重启或流表项重建）：从重置时刻开始计算
+            if not duration:
+                return None
+            elapsed = duration
+            prev_counters = (0,) * len(counters)
+
+        return dict(
+            (name, (c - p) * k / elapsed)
+            for name, c, p, k in zip(self.fields, counters, prev_counters, self.scale)
+        )
+
+    def retain(self, dpid, keys):
+        """Forget samples of ``dpid`` whose key is not in ``keys``"""
+        samples = self._prev.get(dpid)
+        if samples is None:
+            return
+        for key in [key for key in samples if key not in keys]:
+            del samples[key]
+
+    def forget(self, dpid):
+        self._prev.pop(dpid, None)
@@ -0,0 +1,92 @@
+"""Serialize-once cache of REST response bodies.
+
+The app bumps an epoch on every state change.  A cached body is reused
+while its epoch is current, and, since the epoch moves with every packet
+under load, also while it is younger than ``max_age`` seconds, so polling
+dashboards share one encoding per interval instead of one per request.
+Each snapshot carries a strong ETag derived from its content and a gzip
+copy (with its own ETag) built on first use.
+"""
+import gzip
+import hashlib
+from collections import OrderedDict
+
+# 小于这个大小的响应不压缩
+GZIP_MIN_SIZE = 1024
+
+
+class Snapshot(object):
+    __slots__ = ('epoch', 'built', 'body', 'etag', 'gzip_etag', '_gzipped')
+
+    def __init__(self, epoch, built, body):
+        self.epoch = epoch
+        self.built = built
+        self.body = body
+        digest = hashlib.blake2b(body, digest_size=12).hexdigest()
+        self.etag = '"%s"' % digest
+        self.gzip_etag = '"%s-gzip"' % digest
+        self._gzipped = None
+
+    @property
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=5)
+        return self._gzipped
+
+
+class SnapshotCache(object):
+    """LRU map of request key -> Snapshot"""
+
+    def __init__(self, max_age=1.0, max_entries=64):
+        self.max_age = max_age
+        self.max_entries = max_entries
+        self._snapshots = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, epoch, build, now):
+        """Return the snapshot of ``key``, calling ``build()`` for the body if stale"""
+        snapshot = self._snapshots.get(key)
+        if snapshot is not None and (snapshot.epoch == epoch or
+                                     now - snapshot.built < self.max_age):
+            self._snapshots.move_to_end(key)
+            self.hits += 1
+            return snapshot
+        self.misses += 1
+        snapshot = Snapshot(epoch, now, build())
+        self._snapshots[key] = snapshot
+        self._snapshots.move_to_end(key)
+        while len(self._snapshots) > self.max_entries:
+            self._snapshots.popitem(last=False)
+        return snapshot
+
+    def clear(self):
+        self._snapshots.clear()
+
+
+def etag_matches(header, etags):
+    """Whether an If-None-Match header value matches one of ``etags``"""
+    if not header:
+        return False
+    for candidate in header.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate in etags or candidate == '*':
+            return True
+    return False
+
+
+def accepts_gzip(header):
+    """Whether an Accept-Encoding header value allows gzip"""
+    for item in (header or '').split(','):
+        parts = item.strip().split(';')
+        if parts[0].strip().lower() not in ('gzip', '*'):
+            continue
+        q = [p.strip()[2:] for p in parts[1:] if p.strip().startswith('q=')]
+        try:
+            if not q or float(q[0]) > 0:
+                return True
+        except ValueError:
+            return True
+    return False
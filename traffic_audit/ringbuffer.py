@@ -0,0 +1,246 @@
+"""Fixed-capacity ring buffer of packet summaries.
+
+Each field lives in its own preallocated ``array`` (MAC and IPv4 addresses
+as packed integers), so appending is a handful of slot writes and memory
+stays at ``capacity * RECORD_SIZE`` bytes no matter how long the controller
+runs.  Dicts are only built when summaries are read.
+"""
+from array import array
+
+from traffic_audit.decode import mac_str, ipv4_str
+
+FIELDS = (
+    ('timestamp', 'd'),
+    ('dpid', 'Q'),
+    ('in_port', 'I'),
+    ('eth_src', 'Q'),
+    ('eth_dst', 'Q'),
+    ('eth_type', 'H'),
+    ('ip_src', 'I'),
+    ('ip_dst', 'I'),
+    ('ip_proto', 'B'),
+    ('src_port', 'H'),
+    ('dst_port', 'H'),
+    ('packet_len', 'I'),
+    ('protocol', 'B'),
+    ('flags', 'B'),
+)
+RECORD_SIZE = sum(array(code).itemsize for _, code in FIELDS)
+
+# flags 字段的各个位，标记哪些头部存在
+HAS_ETH = 0x01
+HAS_IP = 0x02
+HAS_PORTS = 0x04
+
+
+def summary_from_values(values, labels):
+    """Build the REST dict of a summary from its raw field values"""
+    (timestamp, dpid, in_port, eth_src, eth_dst, eth_type, ip_src, ip_dst,
+     ip_proto, src_port, dst_port, packet_len, protocol, flags) = values
+    summary = {
+        'timestamp': timestamp,
+        'dpid': dpid,
+        'in_port': in_port,
+        'eth_src': None,
+        'eth_dst': None,
+        'eth_type': None,
+        'ip_src': None,
+        'ip_dst': None,
+        'ip_proto': None,
+        'src_port': None,
+        'dst_port': None,
+        'packet_len': packet_len,
+        'protocol_identified': labels[protocol] if protocol < len(labels) else 'other',
+    }
+    if flags & HAS_ETH:
+        summary['eth_src'] = mac_str(eth_src.to_bytes(6, 'big'))
+        summary['eth_dst'] = mac_str(eth_dst.to_bytes(6, 'big'))
+        summary['eth_type'] = hex(eth_type)
+    if flags & HAS_IP:
+        summary['ip_src'] = ipv4_str(ip_src)
+        summary['ip_dst'] = ipv4_str(ip_dst)
+        summary['ip_proto'] = ip_proto
+    if flags & HAS_PORTS:
+        summary['src_port'] = src_port
+        summary['dst_port'] = dst_port
+    return summary
+
+
+class SummaryRing(object):
+    """Columnar ring buffer
+
+    Every appended summary gets a sequence number; ``total`` is the next one.
+    Sequence numbers keep growing across ``clear()`` so they can be used as
+    cursors by readers that drain the ring incrementally.
+    """
+
+    def __init__(self, capacity, labels):
+        if capacity <= 0:
+            raise ValueError('capacity must be positive')
+        self.capacity = capacity
+        self.labels = tuple(labels)
+        self._label_index = dict((name, i) for i, name in enumerate(self.labels))
+        self._other = len(self.labels) - 1
+        self.total = 0
+        self._start = 0
+        self._columns = []
+        for name, code in FIELDS:
+            column = array(code)
+            column.frombytes(bytes(column.itemsize * capacity))
+            setattr(self, '_' + name, column)
+            self._columns.append(column)
+
+    def __len__(self):
+        return self.total - self.oldest_seq()
+
+    def clear(self):
+        """Hide everything appended so far from latest()"""
+        self._start = self.total
+
+    def append(self, timestamp, dpid, in_port, headers, protocol):
+        i = self.total % self.capacity
+        self.total += 1
+        self._timestamp[i] = timestamp
+        self._dpid[i] = dpid
+        self._in_port[i] = in_port
+        self._packet_len[i] = headers.length
+        self._protocol[i] = self._label_index.get(protocol, self._other)
+        flags = 0
+        if headers.eth_src is not None:
+            flags = HAS_ETH
+            self._eth_src[i] = int.from_bytes(headers.eth_src, 'big')
+            self._eth_dst[i] = int.from_bytes(headers.eth_dst, 'big')
+            self._eth_type[i] = headers.eth_type
+        if headers.ip_proto is not None:
+            flags |= HAS_IP
+            self._ip_src[i] = headers.ip_src
+            self._ip_dst[i] = headers.ip_dst
+            self._ip_proto[i] = headers.ip_proto
+            if headers.dst_port is not None:
+                flags |= HAS_PORTS
+                self._src_port[i] = headers.src_port
+                self._dst_port[i] = headers.dst_port
+        self._flags[i] = flags
+
+    def extend(self, columns):
+        """Append summaries given as one array per field, in FIELDS order"""
+        count = len(columns[0])
+        skip = max(count - self.capacity, 0)
+        first = self.total + skip
+        begin = first % self.capacity
+        split = min(count - skip, self.capacity - begin)
+        for column, values in zip(self._columns, columns):
+            column[begin:begin + split] = values[skip:skip + split]
+            column[:count - skip - split] = values[skip + split:]
+        self.total += count
+
+    def values(self, seq):
+        """Return the raw field values of summary ``seq`` in FIELDS order"""
+        i = seq % self.capacity
+        return tuple([column[i] for column in self._columns])
+
+    def record(self, seq):
+        """Materialize the summary with sequence number ``seq`` as a dict"""
+        return summary_from_values(self.values(seq), self.labels)
+
+    def oldest_seq(self):
+        """Oldest sequence number still visible to readers"""
+        return max(self._start, self.total - self.capacity)
+
+    def retained_seq(self):
+        """Oldest sequence number whose slot has not been overwritten yet"""
+        return max(0, self.total - self.capacity)
+
+    def iter_range(self, start=None, end=None):
+        """Yield raw values of visible summaries in [start, end), oldest first
+
+        Only summaries present when iteration starts are yielded; ones
+        overwritten while the generator is suspended are skipped.
+        """
+        seq = self.oldest_seq()
+        stop = self.total
+        while seq < stop:
+            seq = max(seq, self.retained_seq())
+            if seq >= stop:
+                return
+            values = self.values(seq)
+            seq += 1
+            timestamp = values[0]
+            if (start is None or timestamp >= start) and (end is None or timestamp < end):
+                yield values
+
+    def latest(self, limit):
+        """Return up to ``limit`` newest summaries, oldest first"""
+        if limit <= 0:
+            return []
+        start = max(self.oldest_seq(), self.total - limit)
+        return [self.record(seq) for seq in range(start, self.total)]
+
+    def since(self, cursor, limit):
+        """Return (summaries appended at or after ``cursor``, number skipped)
+
+        At most the ``limit`` newest are returned, oldest first; older ones,
+        and ones already overwritten, are counted as skipped.
+        """
+        cursor = min(max(cursor, 0), self.total)
+        start = max(cursor, self.oldest_seq(), self.total - max(limit, 0))
+        return [self.record(seq) for seq in range(start, self.total)], start - cursor
+
+    def to_state(self, first=0):
+        """Return the summaries from sequence ``first`` on as a plain dict
+
+        Columns are raw array bytes, oldest first.
+        """
+        first = min(max(first, self.retained_seq()), self.total)
+        count = self.total - first
+        begin = first % self.capacity
+        end = begin + count
+        columns = []
+        for column in self._columns:
+            if end <= self.capacity:
+                columns.append(column[begin:end].tobytes())
+            else:
+                columns.append(column[begin:].tobytes() +
+                               column[:end - self.capacity].tobytes())
+        return {
+            'capacity': self.capacity,
+            'labels': list(self.labels),
+            'total': self.total,
+            'start': self._start,
+            'first': first,
+            'columns': columns,
+        }
+
+    @classmethod
+    def from_state(cls, state, capacity=None):
+        """Rebuild a ring from ``to_state()``, keeping sequence numbers
+
+        With a smaller ``capacity`` only the newest summaries are kept.
+        """
+        ring = cls(capacity or state['capacity'], state['labels'])
+        ring.apply_state(state)
+        return ring
+
+    def apply_state(self, state):
+        """Append the summaries of a ``to_state()`` dict newer than ours
+
+        Restores a saved ring followed by incremental saves of it: sequence
+        numbers continue from the saved ones, and a gap between ``total``
+        and the saved ``first`` is skipped.
+        """
+        if list(state['labels']) != list(self.labels):
+            raise ValueError('summaries with different labels')
+        first = state['first']
+        if first > self.total:
+            # 没有随状态保存的更早摘要对读者不可见
+            self.total = first
+            self._start = max(self._start, first)
+        skip = self.total - first
+        if state['total'] > self.total:
+            columns = []
+            for (_, code), data in zip(FIELDS, state['columns']):
+                values = array(code)
+                values.frombytes(data)
+                columns.append(values[skip:])
+            self.extend(columns)
+        self._start = max(self._start, state['start'])
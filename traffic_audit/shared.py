@@ -0,0 +1,287 @@
+"""Share worker state through shared memory and merge it in a front end.
+
+When the controller is scaled out, each worker process owns a subset of
+the switches and periodically publishes a snapshot of its counters, time
+series and newest packet summaries into its own shared memory segment.  A
+front end process reads every worker's segment and merges them into its
+own protocol counters, time series and summary ring, so the existing REST
+endpoints serve the global view unchanged.
+
+A segment is a seqlock: a header of (sequence, length, crc32) followed by
+the encoded snapshot.  The writer makes the sequence odd, writes the
+payload and makes it even again; a reader copies the payload and retries
+if the sequence changed, was odd, or the checksum does not match.  Writers
+never wait for readers.
+
+Snapshots are encoded as a JSON document in which ``bytes`` values (raw
+array columns) are replaced by references into a binary tail, so large
+arrays are not converted to text.
+"""
+import json
+import os
+import struct
+import time
+import zlib
+from array import array
+from multiprocessing import resource_tracker, shared_memory
+
+from traffic_audit.ringbuffer import FIELDS
+from traffic_audit.timeseries import ProtocolTimeSeries
+
+_HEADER = struct.Struct('=QQI4x')
+_MAGIC = b'TAS1'
+_PREFIX = struct.Struct('=4sI')
+
+STANDALONE, WORKER, FRONTEND = 'standalone', 'worker', 'frontend'
+
+
+def segment_name(prefix, worker_id):
+    return '%s-%d' % (prefix, worker_id)
+
+
+def encode_state(state):
+    """Encode a dict whose leaves may be ``bytes`` into one buffer"""
+    blobs = []
+    offset = [0]
+
+    def default(value):
+        if isinstance(value, (bytes, bytearray, memoryview)):
+            blobs.append(value)
+            ref = {'$blob': [offset[0], len(value)]}
+            offset[0] += len(value)
+            return ref
+        raise TypeError('cannot encode %r' % type(value))
+
+    document = json.dumps(state, default=default, separators=(',', ':')).encode('utf-8')
+    return b''.join([_PREFIX.pack(_MAGIC, len(document)), document] + blobs)
+
+
+def decode_state(data):
+    """Inverse of encode_state()"""
+    magic, length = _PREFIX.unpack_from(data, 0)
+    if magic != _MAGIC:
+        raise ValueError('not an encoded state')
+    tail = _PREFIX.size + length
+    data = memoryview(data)
+
+    def hook(obj):
+        ref = obj.get('$blob')
+        if ref is not None and len(obj) == 1:
+            start = tail + ref[0]
+            return bytes(data[start:start + ref[1]])
+        return obj
+
+    return json.loads(bytes(data[_PREFIX.size:tail]).decode('utf-8'), object_hook=hook)
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        pass
+    # Python 3.13 之前，读者进程退出时 resource_tracker 会删除它登记过的段，
+    # 即使段属于别的进程，所以映射时跳过登记
+    register = resource_tracker.register
+    resource_tracker.register = lambda name, rtype: None
+    try:
+        return shared_memory.SharedMemory(name=name)
+    finally:
+        resource_tracker.register = register
+
+
+class StatePublisher(object):
+    """Single writer of one worker's segment"""
+
+    def __init__(self, name, size):
+        try:
+            self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                                   size=_HEADER.size + size)
+        except FileExistsError:
+            # 上次异常退出留下的段
+            stale = shared_memory.SharedMemory(name=name)
+            stale.close()
+            stale.unlink()
+            self._shm = shared_memory.SharedMemory(name=name, create=True,
+                                                   size=_HEADER.size + size)
+        self.name = name
+        self.capacity = self._shm.size - _HEADER.size
+        self._seq = 0
+        self.published = 0
+
+    def publish(self, state):
+        """Encode ``state`` and write it; return the encoded size"""
+        data = encode_state(state)
+        if len(data) > self.capacity:
+            raise ValueError('state of %d bytes does not fit the %d byte segment'
+                             % (len(data), self.capacity))
+        buf = self._shm.buf
+        self._seq += 1
+        _HEADER.pack_into(buf, 0, self._seq, 0, 0)
+        buf[_HEADER.size:_HEADER.size + len(data)] = data
+        self._seq += 1
+        _HEADER.pack_into(buf, 0, self._seq, len(data), zlib.crc32(data))
+        self.published += 1
+        return len(data)
+
+    def close(self):
+        self._shm.close()
+        self._shm.unlink()
+
+
+class StateReader(object):
+    """Reader of one worker's segment; attaches lazily and survives restarts"""
+
+    def __init__(self, name):
+        self.name = name
+        self._shm = None
+        self.retries = 0
+
+    def read(self, attempts=100):
+        """Return the latest decoded state, or None if there is none yet"""
+        if self._shm is None:
+            try:
+                self._shm = _attach(self.name)
+            except FileNotFoundError:
+                return None
+        buf = self._shm.buf
+        for _ in range(attempts):
+            seq, length, crc = _HEADER.unpack_from(buf, 0)
+            if seq == 0:
+                return None
+            if seq & 1 == 0 and length <= len(buf) - _HEADER.size:
+                data = bytes(buf[_HEADER.size:_HEADER.size + length])
+                if _HEADER.unpack_from(buf, 0)[0] == seq and zlib.crc32(data) == crc:
+                    return decode_state(data)
+            # 写者正在更新，稍后重试
+            self.retries += 1
+            time.sleep(0)
+        return None
+
+    def reset(self):
+        """Drop the mapping so the next read() attaches to a recreated segment"""
+        if self._shm is not None:
+            self._shm.close()
+            self._shm = None
+
+    def close(self):
+        self.reset()
+
+
+def worker_state(worker_id, protocol_stats, switches, history, summaries,
+                 summary_limit, now=None):
+    """Snapshot of one worker as published to its segment"""
+    return {
+        'worker': worker_id,
+        'pid': os.getpid(),
+        'time': time.time() if now is None else now,
+        'protocol_stats': protocol_stats,
+        'switches': switches,
+        'history': history.to_state(),
+        'summaries': summaries.to_state(summaries.total - summary_limit),
+    }
+
+
+class Aggregator(object):
+    """Merge worker snapshots into a front end's own state objects
+
+    ``protocol_stats``, ``history`` and ``summaries`` are updated in place,
+    so whatever already serves them (REST handlers, metrics) sees the
+    global view.  Counters and history are rebuilt from the workers'
+    cumulative snapshots on every refresh; summaries are appended
+    incrementally, column by column, in timestamp order.
+    """
+
+    def __init__(self, names, protocol_stats, history, summaries, stale_after=5.0):
+        self.readers = [StateReader(name) for name in names]
+        self.protocol_stats = protocol_stats
+        self.history = history
+        self.summaries = summaries
+        self.stale_after = stale_after
+        self._states = [None] * len(names)
+        self._cursors = [0] * len(names)
+        self.switches = []
+        self.skipped = 0
+
+    def refresh(self, now=None):
+        """Read every worker and merge; return whether anything changed"""
+        now = time.time() if now is None else now
+        changed = False
+        for i, reader in enumerate(self.readers):
+            state = reader.read()
+            if state is not None and now - state['time'] > self.stale_after:
+                # 可能是重启后重新创建的段，下次重新映射
+                reader.reset()
+            if state is None or (self._states[i] is not None and
+                                 state['time'] == self._states[i]['time']):
+                continue
+            self._states[i] = state
+            changed = True
+        # 快照过期的 worker 的交换机不再列出，但它的累计计数保留
+        self.switches = [
+            dict(switch, worker=state['worker'])
+            for state in self._states
+            if state is not None and now - state['time'] <= self.stale_after
+            for switch in state['switches']
+        ]
+        if not changed:
+            return False
+
+        for stats in self.protocol_stats.values():
+            stats['packets'] = stats['bytes'] = 0
+        other = list(self.protocol_stats)[-1]
+        self.history.clear()
+        new = []
+        for i, state in enumerate(self._states):
+            if state is None:
+                continue
+            for proto, stats in state['protocol_stats'].items():
+                target = self.protocol_stats.get(proto, self.protocol_stats[other])
+                target['packets'] += stats['packets']
+                target['bytes'] += stats['bytes']
+            self.history.merge(ProtocolTimeSeries.from_state(state['history']))
+            new.append(self._new_summaries(i, state['summaries']))
+        new = [columns for columns in new if len(columns[0])]
+        if len(new) == 1:
+            self.summaries.extend(new[0])
+        elif new:
+            # 各个 worker 的新摘要按时间顺序交错写入
+            columns = new[0]
+            for more in new[1:]:
+                for column, values in zip(columns, more):
+                    column.extend(values)
+            timestamps = columns[0]
+            order = sorted(range(len(timestamps)), key=timestamps.__getitem__)
+            self.summaries.extend([array(column.typecode, map(column.__getitem__, order))
+                                   for column in columns])
+        return True
+
+    def _new_summaries(self, i, saved):
+        """Columns of the summaries of worker ``i`` not merged yet"""
+        cursor = self._cursors[i]
+        if saved['total'] < cursor:
+            # worker 重启，序号从头开始
+            cursor = 0
+        start = max(cursor, saved['first'], saved['start'])
+        self.skipped += start - cursor
+        self._cursors[i] = saved['total']
+        skip = start - saved['first']
+        columns = []
+        for (_, code), data in zip(FIELDS, saved['columns']):
+            column = array(code)
+            column.frombytes(data)
+            columns.append(column[skip:])
+        return columns
+
+    def workers(self, now=None):
+        """Status of every worker: pid, age of its snapshot and switch count"""
+        now = time.time() if now is None else now
+        return [
+            {'name': reader.name, 'pid': state['pid'], 'age': now - state['time'],
+             'switches': len(state['switches']), 'summaries': state['summaries']['total']}
+            if state is not None else {'name': reader.name, 'pid': None}
+            for reader, state in zip(self.readers, self._states)
+        ]
+
+    def close(self):
+        for reader in self.readers:
+            reader.close()
@@ -0,0 +1,228 @@
+"""Fixed-memory heavy-hitter tracking over sliding windows.
+
+Each window key (source IP, destination IP, source port, destination port)
+gets a ring of sub-windows ("slots"), and every slot holds
+
+* a Count-Min sketch, which over-estimates any key's byte count by a
+  bounded amount, and
+* a Space-Saving summary of ``capacity`` counters, which keeps the keys
+  that may be heavy hitters.
+
+A query for the last ``window`` seconds takes the union of the Space-Saving
+candidates of the slots it covers and estimates each candidate as the sum
+over those slots of the smaller of its two upper bounds.  Memory depends
+only on the slot count, sketch width and capacity, not on how many distinct
+keys (e.g. during a port scan) are seen.
+
+Updates are first summed in a small exact dict and folded into the current
+slot's sketch and summary when it fills up or the slot changes, so a key
+that repeats within a batch costs one dict update instead of one sketch
+update per packet.
+"""
+import heapq
+import math
+import random
+from array import array
+
+from traffic_audit.decode import ipv4_str
+
+_PRIME = (1 << 61) - 1
+
+
+class CountMinSketch(object):
+    """Count-Min sketch of ``depth`` rows by ``width`` counters"""
+
+    def __init__(self, width=1024, depth=4, seed=1):
+        rnd = random.Random(seed)
+        self.width = width
+        self.depth = depth
+        self._hashes = tuple((rnd.randrange(1, _PRIME), rnd.randrange(_PRIME))
+                             for _ in range(depth))
+        self.clear()
+
+    def clear(self):
+        self._counts = array('Q', bytes(8 * self.width * self.depth))
+
+    def _cells(self, key):
+        h = hash(key)
+        width = self.width
+        return [row * width + (a * h + b) % _PRIME % width
+                for row, (a, b) in enumerate(self._hashes)]
+
+    def add(self, key, weight=1):
+        counts = self._counts
+        for cell in self._cells(key):
+            counts[cell] += weight
+
+    def estimate(self, key):
+        counts = self._counts
+        return min(counts[cell] for cell in self._cells(key))
+
+
+class SpaceSaving(object):
+    """Space-Saving summary keeping at most ``capacity`` counters
+
+    The minimum counter is found through a heap with exactly one entry per
+    key; entries go stale as counts grow and are only fixed up when they
+    reach the top, so an update of a tracked key is a dict lookup.
+    """
+
+    def __init__(self, capacity=256):
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        # 键 -> [计数, 误差上限]
+        self.counts = {}
+        self._heap = []
+
+    def _min_entry(self):
+        heap = self._heap
+        counts = self.counts
+        while True:
+            count, key = heap[0]
+            current = counts[key][0]
+            if current == count:
+                return count, key
+            heapq.heapreplace(heap, (current, key))
+
+    def add(self, key, weight=1):
+        entry = self.counts.get(key)
+        if entry is not None:
+            entry[0] += weight
+            return
+        if len(self.counts) < self.capacity:
+            self.counts[key] = [weight, 0]
+            heapq.heappush(self._heap, (weight, key))
+            return
+        # 替换计数最小的键，新键继承它的计数作为误差
+        count, victim = self._min_entry()
+        del self.counts[victim]
+        self.counts[key] = [count + weight, count]
+        heapq.heapreplace(self._heap, (count + weight, key))
+
+    def min_count(self):
+        if len(self.counts) < self.capacity:
+            return 0
+        return self._min_entry()[0]
+
+    def upper_bound(self, key):
+        """Upper bound of ``key``'s count, tracked or not"""
+        entry = self.counts.get(key)
+        return entry[0] if entry is not None else self.min_count()
+
+
+class WindowedTopK(object):
+    """Heavy hitters over the last ``window`` seconds, in ``slot``-second steps"""
+
+    def __init__(self, window=300, slot=10, capacity=256, width=1024, depth=4,
+                 batch=1024):
+        self.slot = slot
+        self.slots = int(math.ceil(window / float(slot)))
+        self.batch = batch
+        self._ids = [None] * self.slots
+        self._sketches = [CountMinSketch(width, depth, seed=i) for i in range(self.slots)]
+        self._summaries = [SpaceSaving(capacity) for _ in range(self.slots)]
+        # 尚未写入子窗口的累加值，以及它们所属的子窗口
+        self._pending = {}
+        self._pending_slot = None
+
+    @property
+    def window(self):
+        return self.slots * self.slot
+
+    def add(self, key, weight, now):
+        slot_id = int(now // self.slot)
+        if self._pending_slot is not None and slot_id < self._pending_slot:
+            # 时间回退（时钟调整）时计入当前子窗口，避免清掉较新的槽位
+            slot_id = self._pending_slot
+        if slot_id != self._pending_slot:
+            self.flush()
+            self._pending_slot = slot_id
+        pending = self._pending
+        pending[key] = pending.get(key, 0) + weight
+        if len(pending) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        """Fold the pending batch into its slot"""
+        if not self._pending:
+            return
+        slot_id = self._pending_slot
+        i = slot_id % self.slots
+        if self._ids[i] != slot_id:
+            # 子窗口轮转：复用最旧的槽位
+            self._ids[i] = slot_id
+            self._sketches[i].clear()
+            self._summaries[i].clear()
+        sketch = self._sketches[i]
+        summary = self._summaries[i]
+        for key, weight in self._pending.items():
+            sketch.add(key, weight)
+            summary.add(key, weight)
+        self._pending = {}
+
+    def top(self, n, window, now):
+        """Return [(key, estimated weight)] for the ``n`` heaviest keys"""
+        self.flush()
+        current = int(now // self.slot)
+        count = min(self.slots, max(1, int(math.ceil(window / float(self.slot)))))
+        covered = [i for i in (sid % self.slots for sid in range(current - count + 1, current + 1))
+                   if self._ids[i] is not None and self._ids[i] > current - count]
+        candidates = set()
+        for i in covered:
+            candidates.update(self._summaries[i].counts)
+        estimates = []
+        for key in candidates:
+            total = 0
+            for i in covered:
+                total += min(self._sketches[i].estimate(key),
+                             self._summaries[i].upper_bound(key))
+            estimates.append((key, total))
+        return heapq.nlargest(n, estimates, key=lambda item: item[1])
+
+    def clear(self):
+        self._pending = {}
+        self._pending_slot = None
+        self._ids = [None] * self.slots
+        for sketch in self._sketches:
+            sketch.clear()
+        for summary in self._summaries:
+            summary.clear()
+
+
+# 支持的统计维度及其在 REST 接口中的显示方式
+TOP_KEYS = {
+    'ip_src': ipv4_str,
+    'ip_dst': ipv4_str,
+    'src_port': int,
+    'dst_port': int,
+}
+
+
+class TopTalkers(object):
+    """Byte-weighted heavy hitters per source/destination address and port"""
+
+    def __init__(self, window=300, slot=10, capacity=256, width=1024, depth=4):
+        self.windows = dict((key, WindowedTopK(window, slot, capacity, width, depth))
+                            for key in TOP_KEYS)
+
+    def add(self, headers, now):
+        if headers.ip_proto is None:
+            return
+        nbytes = headers.length
+        windows = self.windows
+        windows['ip_src'].add(headers.ip_src, nbytes, now)
+        windows['ip_dst'].add(headers.ip_dst, nbytes, now)
+        if headers.dst_port is not None:
+            windows['src_port'].add(headers.src_port, nbytes, now)
+            windows['dst_port'].add(headers.dst_port, nbytes, now)
+
+    def top(self, key, n, window, now):
+        fmt = TOP_KEYS[key]
+        return [{'key': fmt(value), 'bytes': nbytes}
+                for value, nbytes in self.windows[key].top(n, window, now)]
+
+    def clear(self):
+        for topk in self.windows.values():
+            topk.clear()
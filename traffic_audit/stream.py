@@ -0,0 +1,77 @@
+"""Incremental update frames for live dashboards.
+
+A ``StreamSession`` remembers what one client has already seen (a summary
+cursor and the last protocol counters sent) and builds the next frame
+from current state on demand.  Nothing is queued per client: a consumer
+that reads slowly simply gets fewer, larger frames, and when more than
+``max_batch`` summaries arrived between two frames only the newest are sent
+and the rest are reported in ``dropped``.
+"""
+
+
+class StreamSession(object):
+
+    def __init__(self, ring, protocol_stats, cursor=None, max_batch=200):
+        self.ring = ring
+        self.protocol_stats = protocol_stats
+        self.cursor = ring.total if cursor is None else cursor
+        self.max_batch = max_batch
+        self._sent = {}
+
+    def next_frame(self):
+        """Return a dict with everything that changed since the last frame, or None"""
+        frame = {}
+
+        ring = self.ring
+        total = ring.total
+        if self.cursor > total:
+            # 客户端传入了无效的游标，从当前位置开始
+            self.cursor = total
+        if self.cursor < total:
+            start = max(self.cursor, ring.oldest_seq(), total - self.max_batch)
+            frame['summaries'] = [ring.record(seq) for seq in range(start, total)]
+            frame['dropped'] = start - self.cursor
+            self.cursor = total
+        frame['cursor'] = self.cursor
+
+        changed = {}
+        for name, counters in self.protocol_stats.items():
+            current = (counters['packets'], counters['bytes'])
+            if self._sent.get(name) != current:
+                self._sent[name] = current
+                changed[name] = {'packets': current[0], 'bytes': current[1]}
+        if changed:
+            frame['protocols'] = changed
+
+        if 'summaries' not in frame and not changed:
+            return None
+        return frame
+
+
+class StreamBody(object):
+    """WSGI ``app_iter`` of one stream client
+
+    ``release`` is called once, when ``events`` ends or the server closes the
+    body, also if the response was never iterated (e.g. the client went away
+    before the first write).
+    """
+
+    def __init__(self, events, release):
+        self._events = events
+        self._release = release
+
+    def __iter__(self):
+        try:
+            for chunk in self._events:
+                yield chunk
+        finally:
+            self.close()
+
+    def close(self):
+        if self._release is None:
+            return
+        release, self._release = self._release, None
+        try:
+            self._events.close()
+        finally:
+            release()
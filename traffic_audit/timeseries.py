@@ -0,0 +1,206 @@
+"""Fixed-interval per-protocol counters with downsampling tiers.
+
+Every tier is a ring of ``slots`` buckets of ``step`` seconds, stored as
+flat preallocated arrays indexed by ``slot * len(labels) + label``.  A
+bucket holds the packet/byte deltas seen during its interval; slots are
+reused once they fall out of the tier's retention window.
+"""
+from array import array
+
+# (步长秒数, 桶数)：10 秒保留 1 小时，1 分钟保留 1 天，1 小时保留 30 天
+DEFAULT_TIERS = ((10, 360), (60, 1440), (3600, 720))
+
+MAX_POINTS = 10000
+
+
+class _Tier(object):
+    __slots__ = ('step', 'slots', 'buckets', 'packets', 'bytes')
+
+    def __init__(self, step, slots, width):
+        self.step = step
+        self.slots = slots
+        self.buckets = array('q', [-1]) * slots
+        self.packets = array('Q', [0]) * (slots * width)
+        self.bytes = array('Q', [0]) * (slots * width)
+
+    def retention(self):
+        return self.step * self.slots
+
+
+class ProtocolTimeSeries(object):
+    """Per-protocol packet/byte deltas bucketed by time"""
+
+    def __init__(self, labels, tiers=DEFAULT_TIERS):
+        self.labels = tuple(labels)
+        self._index = dict((name, i) for i, name in enumerate(self.labels))
+        self._other = len(self.labels) - 1
+        self._width = len(self.labels)
+        self._tiers = [_Tier(step, slots, self._width)
+                       for step, slots in sorted(tiers)]
+
+    @property
+    def tiers(self):
+        return [(tier.step, tier.slots) for tier in self._tiers]
+
+    def clear(self):
+        for tier in self._tiers:
+            tier.buckets = array('q', [-1]) * tier.slots
+
+    def to_state(self, since=None):
+        """Return labels, tiers and raw bucket arrays as a plain dict
+
+        With ``since``, every tier only holds the slots of buckets covering
+        ``since`` or later, listed in ``changed``; apply_state() writes them
+        over an earlier full state.
+        """
+        width = self._width
+        tiers = []
+        for tier in self._tiers:
+            saved = {'step': tier.step, 'slots': tier.slots}
+            if since is None:
+                saved.update(buckets=tier.buckets.tobytes(),
+                             packets=tier.packets.tobytes(),
+                             bytes=tier.bytes.tobytes())
+            else:
+                first = int(since // tier.step)
+                changed = array('I', [slot for slot in range(tier.slots)
+                                      if tier.buckets[slot] >= first])
+                packets = array('Q')
+                nbytes = array('Q')
+                for slot in changed:
+                    packets.extend(tier.packets[slot * width:(slot + 1) * width])
+                    nbytes.extend(tier.bytes[slot * width:(slot + 1) * width])
+                saved.update(changed=changed.tobytes(),
+                             buckets=array('q', [tier.buckets[slot]
+                                                 for slot in changed]).tobytes(),
+                             packets=packets.tobytes(),
+                             bytes=nbytes.tobytes())
+            tiers.append(saved)
+        return {'labels': list(self.labels), 'tiers': tiers}
+
+    @classmethod
+    def from_state(cls, state):
+        series = cls(state['labels'],
+                     [(tier['step'], tier['slots']) for tier in state['tiers']])
+        series.apply_state(state)
+        return series
+
+    def apply_state(self, state):
+        """Load a full ``to_state()`` dict, or overwrite the slots of a partial one"""
+        if (tuple(state['labels']) != self.labels or
+                [(tier['step'], tier['slots']) for tier in state['tiers']] != self.tiers):
+            raise ValueError('time series with different labels or tiers')
+        width = self._width
+        for tier, saved in zip(self._tiers, state['tiers']):
+            loaded = {}
+            for name in ('buckets', 'packets', 'bytes'):
+                values = array(getattr(tier, name).typecode)
+                values.frombytes(saved[name])
+                loaded[name] = values
+            if 'changed' not in saved:
+                for name, values in loaded.items():
+                    setattr(tier, name, values)
+                continue
+            changed = array('I')
+            changed.frombytes(saved['changed'])
+            for n, slot in enumerate(changed):
+                base = slot * width
+                tier.buckets[slot] = loaded['buckets'][n]
+                tier.packets[base:base + width] = loaded['packets'][n * width:(n + 1) * width]
+                tier.bytes[base:base + width] = loaded['bytes'][n * width:(n + 1) * width]
+
+    def merge(self, other):
+        """Add the buckets of ``other`` (same labels and tiers) into this series
+
+        A slot holding an older bucket than ``other`` is replaced, the same
+        bucket is summed and a newer one is kept.
+        """
+        if other.labels != self.labels or other.tiers != self.tiers:
+            raise ValueError('time series with different labels or tiers')
+        width = self._width
+        for tier, theirs in zip(self._tiers, other._tiers):
+            for slot in range(tier.slots):
+                bucket = theirs.buckets[slot]
+                if bucket < 0 or bucket < tier.buckets[slot]:
+                    continue
+                base = slot * width
+                if bucket == tier.buckets[slot]:
+                    for i in range(base, base + width):
+                        tier.packets[i] += theirs.packets[i]
+                        tier.bytes[i] += theirs.bytes[i]
+                else:
+                    tier.buckets[slot] = bucket
+                    tier.packets[base:base + width] = theirs.packets[base:base + width]
+                    tier.bytes[base:base + width] = theirs.bytes[base:base + width]
+
+    def add(self, label, packets, nbytes, now):
+        """Add ``packets``/``nbytes`` for ``label`` to the bucket covering ``now``"""
+        index = self._index.get(label, self._other)
+        width = self._width
+        for tier in self._tiers:
+            bucket = int(now // tier.step)
+            slot = bucket % tier.slots
+            base = slot * width
+            if tier.buckets[slot] != bucket:
+                # 桶已过期，清零后复用
+                tier.buckets[slot] = bucket
+                for i in range(base, base + width):
+                    tier.packets[i] = 0
+                    tier.bytes[i] = 0
+            tier.packets[base + index] += packets
+            tier.bytes[base + index] += nbytes
+
+    def _pick_tier(self, start, step, now):
+        chosen = None
+        for tier in self._tiers:
+            covers = now - tier.retention() <= start
+            if tier.step <= step and covers:
+                chosen = tier
+            elif chosen is None and covers:
+                return tier
+        return chosen or self._tiers[-1]
+
+    def query(self, start, end, step, now):
+        """Return deltas for [start, end) aggregated into ``step``-second points
+
+        The finest tier whose retention still covers ``start`` is used; the
+        step is rounded up to a multiple of that tier's resolution and may
+        not exceed the retention of the coarsest tier.
+        """
+        if end < start:
+            raise ValueError('"to" must not be earlier than "from"')
+        longest = self._tiers[-1].retention()
+        if step > longest:
+            raise ValueError('"step" must not exceed %d seconds' % longest)
+        tier = self._pick_tier(start, step, now)
+        ratio = max(1, -(-int(step) // tier.step))
+        out_step = ratio * tier.step
+        first = int(start // out_step) * out_step
+        points = int((end - first) // out_step) + 1
+        if points > MAX_POINTS:
+            raise ValueError('too many points (%d), increase "step"' % points)
+
+        width = self._width
+        packets = [[0] * points for _ in range(width)]
+        nbytes = [[0] * points for _ in range(width)]
+        first_bucket = first // tier.step
+        last_bucket = first_bucket + points * ratio
+        # 只遍历该级的桶，开销与请求的范围和步长无关
+        for slot in range(tier.slots):
+            bucket = tier.buckets[slot]
+            if bucket < first_bucket or bucket >= last_bucket:
+                continue
+            point = (bucket - first_bucket) // ratio
+            base = slot * width
+            for i in range(width):
+                packets[i][point] += tier.packets[base + i]
+                nbytes[i][point] += tier.bytes[base + i]
+
+        return {
+            'step': out_step,
+            'timestamps': [first + n * out_step for n in range(points)],
+            'protocols': dict(
+                (name, {'packets': packets[i], 'bytes': nbytes[i]})
+                for i, name in enumerate(self.labels)
+            ),
+        }
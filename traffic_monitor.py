@@ -1,15 +1,223 @@
+from ryu import cfg
 from ryu.base import app_manager
 from ryu.controller import ofp_event
 from ryu.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER, set_ev_cls
 from ryu.ofproto import ofproto_v1_3
+from ryu.lib import addrconv
+from ryu.lib import hub
 from ryu.lib.packet import packet
 from ryu.lib.packet import ethernet, ether_types
-from ryu.lib.packet import ipv4, tcp, udp, icmp
+from ryu.lib.packet import ipv4, tcp, udp
 from ryu.app.wsgi import ControllerBase, WSGIApplication, route
 from webob import Response
+from eventlet import tpool
+from collections import deque
 import json
+import math
+import random
+import struct
 import time
 
+from traffic_audit.anomaly import AnomalyDetector, drop_match
+from traffic_audit.auditlog import AuditLog
+from traffic_audit.checkpoint import CheckpointWriter, ControllerState, load_checkpoint
+from traffic_audit.classifier import OTHER, ProtocolClassifier
+from traffic_audit.conversations import (ConversationTable, SORT_FIELDS,
+                                         conversation_key, write_ndjson)
+from traffic_audit.export import (CONTENT_TYPES as EXPORT_CONTENT_TYPES, EXTENSIONS,
+                                  FLOW_COLUMNS, HISTORY_COLUMNS, SUMMARY_COLUMNS,
+                                  encode, flow_rows, history_rows, summary_rows)
+from traffic_audit.rates import RateTracker, duration_of
+from traffic_audit.restcache import GZIP_MIN_SIZE, SnapshotCache, accepts_gzip, etag_matches
+from traffic_audit.shared import (FRONTEND, STANDALONE, WORKER, Aggregator,
+                                  StatePublisher, segment_name, worker_state)
+from traffic_audit.sketch import TOP_KEYS, TopTalkers
+from traffic_audit.stream import StreamBody, StreamSession
+from traffic_audit.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE, RTT_BUCKETS, Registry
+from traffic_audit.intake import UNCLASSIFIED, IntakeQueue, priority_class
+from traffic_audit.l2 import MOVED, REFRESHED, LogLimiter, MacTable
+from traffic_audit.decode import FrameHeaders, decode_frame, mac_str, ipv4_str, ipv4_int
+from traffic_audit.ringbuffer import RECORD_SIZE, SummaryRing
+from traffic_audit.timeseries import ProtocolTimeSeries
+
+CONF = cfg.CONF
+CONF.register_opts([
+    cfg.StrOpt('protocol_map', default=None,
+               help='JSON file mapping protocol names to port specs, '
+                    'e.g. {"http": ["tcp/80", "tcp/8080"], "icmp": ["icmp"]}'),
+    cfg.StrOpt('forwarding_mode', default='reactive',
+               choices=['reactive', 'proactive', 'pipeline'],
+               help='reactive: every packet goes through the controller; '
+                    'proactive: install per-flow entries and account from '
+                    'flow counters; pipeline: count per protocol in a switch '
+                    'classification table and forward with NORMAL, without '
+                    'packet-ins'),
+    cfg.IntOpt('flow_idle_timeout', default=30,
+               help='idle timeout of proactively installed flows (seconds)'),
+    cfg.IntOpt('flow_hard_timeout', default=300,
+               help='hard timeout of proactively installed flows (seconds)'),
+    cfg.IntOpt('summary_capacity', default=100000,
+               help='number of packet summaries kept in memory '
+                    '(%d bytes each)' % RECORD_SIZE),
+    cfg.FloatOpt('stats_interval', default=10.0,
+                 help='seconds between flow/port stats requests to a switch'),
+    cfg.FloatOpt('stats_jitter', default=0.1,
+                 help='random jitter added to each request, as a fraction '
+                      'of stats_interval'),
+    cfg.FloatOpt('stats_reply_timeout', default=30.0,
+                 help='a request without a reply after this many seconds '
+                      'is considered lost'),
+    cfg.StrOpt('audit_log_dir', default=None,
+               help='directory of the persistent packet summary log '
+                    '(disabled when unset)'),
+    cfg.IntOpt('audit_segment_seconds', default=3600,
+               help='start a new audit log segment after this many seconds'),
+    cfg.IntOpt('audit_segment_mb', default=64,
+               help='start a new audit log segment after this many MB'),
+    cfg.FloatOpt('audit_flush_interval', default=1.0,
+                 help='seconds between audit log writes'),
+    cfg.FloatOpt('audit_retention_hours', default=0.0,
+                 help='delete audit log segments older than this (0 keeps them)'),
+    cfg.IntOpt('audit_retention_mb', default=0,
+               help='delete the oldest audit log segments when the log exceeds '
+                    'this many MB (0 for no limit)'),
+    cfg.FloatOpt('stream_fps', default=2.0,
+                 help='maximum frames per second sent to each /stats/stream client'),
+    cfg.IntOpt('stream_max_batch', default=200,
+               help='maximum packet summaries per stream frame; older ones '
+                    'are dropped for slow clients'),
+    cfg.IntOpt('stream_max_clients', default=32,
+               help='maximum concurrent /stats/stream clients'),
+    cfg.IntOpt('sample_rate', default=0,
+               help='in proactive and pipeline modes, copy roughly 1 in N '
+                    'flows to the controller for packet summaries (0 disables)'),
+    cfg.IntOpt('conversation_table_size', default=100000,
+               help='maximum active conversations (5-tuple per switch); the '
+                    'least recently seen one is evicted when full'),
+    cfg.FloatOpt('conversation_idle_timeout', default=60.0,
+                 help='a conversation ends after this many idle seconds'),
+    cfg.IntOpt('conversation_recent', default=1000,
+               help='number of ended conversations kept for the REST API'),
+    cfg.StrOpt('conversation_export_path', default=None,
+               help='append ended conversations to this file as NDJSON'),
+    cfg.FloatOpt('conversation_export_interval', default=5.0,
+                 help='seconds between idle checks / conversation exports'),
+    cfg.IntOpt('top_window', default=300,
+               help='longest window (seconds) answerable by /stats/top'),
+    cfg.IntOpt('top_slot_seconds', default=10,
+               help='granularity of the /stats/top sliding windows'),
+    cfg.IntOpt('top_capacity', default=256,
+               help='heavy-hitter candidates tracked per key and slot'),
+    cfg.IntOpt('top_sketch_width', default=1024,
+               help='Count-Min sketch width per key and slot'),
+    cfg.FloatOpt('rest_cache_max_age', default=1.0,
+                 help='seconds an encoded /stats/protocol or /stats/packet_summaries '
+                      'response may be reused while traffic keeps changing it'),
+    cfg.IntOpt('packet_in_rate_limit', default=0,
+               help='packets per second each switch may send to the controller '
+                    'through an OpenFlow meter; excess is dropped by the switch '
+                    '(0 disables)'),
+    cfg.IntOpt('intake_queue_size', default=4096,
+               help='packet-ins waiting to be processed; when full, bulk traffic '
+                    'is shed before ARP/DHCP/DNS (0 processes packet-ins inline)'),
+    cfg.BoolOpt('anomaly_detection', default=True,
+                help='detect port scans, SYN floods and DNS amplification '
+                     'in packet-ins'),
+    cfg.FloatOpt('anomaly_window', default=10.0,
+                 help='sliding window of the anomaly detector (seconds)'),
+    cfg.IntOpt('scan_ports', default=100,
+               help='distinct destination ports probed by one source within '
+                    'the window that count as a port scan'),
+    cfg.IntOpt('syn_flood_threshold', default=200,
+               help='SYNs sent by one source within the window before it is '
+                    'checked for a SYN flood'),
+    cfg.FloatOpt('syn_ack_ratio', default=10.0,
+                 help='a source is flooding when its SYNs exceed this many '
+                      'times its ACKs'),
+    cfg.IntOpt('dns_amplification_bytes', default=1000000,
+               help='DNS response bytes to one host within the window before '
+                    'it is checked for DNS amplification'),
+    cfg.FloatOpt('dns_amplification_ratio', default=20.0,
+                 help='a host is an amplification victim when the DNS response '
+                      'bytes it receives exceed this many times its query bytes'),
+    cfg.IntOpt('anomaly_block_seconds', default=0,
+               help='hard timeout of the drop flow installed on every switch '
+                    'for an alert (0 only records the alert)'),
+    cfg.IntOpt('alert_capacity', default=1000,
+               help='number of alerts kept for /stats/alerts'),
+    cfg.IntOpt('mac_table_size', default=8192,
+               help='learned MAC addresses kept per switch; the least recently '
+                    'seen one is evicted when full'),
+    cfg.FloatOpt('mac_aging_time', default=300.0,
+                 help='seconds a learned MAC address stays valid without traffic'),
+    cfg.FloatOpt('log_interval', default=10.0,
+                 help='per-switch MAC learning/move messages are logged at most '
+                      'once per this many seconds'),
+    cfg.StrOpt('scale_role', default=STANDALONE,
+               choices=[STANDALONE, WORKER, FRONTEND],
+               help='worker: handle the switches connected to this process and '
+                    'publish its state to shared memory; frontend: serve the '
+                    'REST API from the merged state of scale_workers workers'),
+    cfg.StrOpt('scale_name', default='traffic_monitor',
+               help='prefix of the shared memory segments of the workers'),
+    cfg.IntOpt('worker_id', default=0,
+               help='index of this worker (0 .. scale_workers - 1)'),
+    cfg.IntOpt('scale_workers', default=1,
+               help='number of workers the front end reads'),
+    cfg.FloatOpt('publish_interval', default=1.0,
+                 help='seconds between state publications of a worker, and '
+                      'between reads of the front end'),
+    cfg.IntOpt('publish_summaries', default=10000,
+               help='newest packet summaries included in each publication; '
+                    'summaries older than one interval of traffic beyond this '
+                    'are not seen by the front end'),
+    cfg.IntOpt('scale_segment_mb', default=16,
+               help='size of the shared memory segment of each worker (MB)'),
+    cfg.StrOpt('checkpoint_dir', default=None,
+               help='directory of periodic state checkpoints; the state is '
+                    'restored from it at startup (not used by the front end)'),
+    cfg.FloatOpt('checkpoint_interval', default=10.0,
+                 help='seconds between incremental checkpoints'),
+    cfg.FloatOpt('checkpoint_full_interval', default=300.0,
+                 help='seconds between full checkpoints; bounds the number of '
+                      'increments replayed at startup'),
+], group='traffic_monitor')
+
+# 主动下发的流表项使用的 cookie 前缀，低 56 位是序号
+FLOW_COOKIE_TAG = 0x01 << 56
+FLOW_COOKIE_MASK = 0xff << 56
+FLOW_PRIORITY = 20
+STATS_KINDS = ('flow', 'port')
+PORT_RATE_FIELDS = ('rx_bps', 'tx_bps', 'rx_pps', 'tx_pps',
+                    'rx_errors_ps', 'tx_errors_ps', 'rx_dropped_ps', 'tx_dropped_ps')
+FLOW_RATE_FIELDS = ('bps', 'pps')
+SAMPLE_GROUP_ID = 1
+# pipeline 模式：表 0 按协议计数后转到表 1 转发
+# 分类流表项的 cookie：前缀 | 协议序号 << 32 | 规则序号
+PIPELINE_COOKIE_TAG = 0x02 << 56
+CLASSIFY_TABLE = 0
+FORWARD_TABLE = 1
+# 限制送往控制器的流量的 meter
+CONTROLLER_METER_ID = 1
+# 工作线程每处理这么多个 packet-in 让出一次
+INTAKE_BATCH = 64
+# 异常检测下发的丢弃流表项，优先级高于所有转发和分类规则
+ANOMALY_COOKIE_TAG = 0x03 << 56
+ANOMALY_PRIORITY = 1000
+
+
+def _float_param(params, name, default=None):
+    """Return query parameter ``name`` as a finite float, or ``default`` if absent"""
+    value = params.get(name)
+    if value is None:
+        return default
+    value = float(value)
+    # inf / nan 能被 float() 解析，但会在后面的时间计算中溢出
+    if not math.isfinite(value):
+        raise ValueError('"%s" must be a finite number' % name)
+    return value
+
+
 class TrafficMonitor(app_manager.RyuApp):
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]  # 改为1.3
     _CONTEXTS = {'wsgi': WSGIApplication}
@@ -17,88 +225,615 @@ class TrafficMonitor(app_manager.RyuApp):
     def __init__(self, *args, **kwargs):
         super(TrafficMonitor, self).__init__(*args, **kwargs)
         self.datapaths = {}
-        self.mac_to_port = {}
+        # 每台交换机一张 MAC 学习表：dpid -> MacTable
+        self.mac_tables = {}
         self.flow_stats = {}
         self.port_stats = {}
-        self.protocol_stats = {
-            'http': {'packets': 0, 'bytes': 0},
-            'https': {'packets': 0, 'bytes': 0},
-            'ftp': {'packets': 0, 'bytes': 0},
-            'smtp': {'packets': 0, 'bytes': 0},
-            'pop3': {'packets': 0, 'bytes': 0},
-            'imap': {'packets': 0, 'bytes': 0},
-            'dns': {'packets': 0, 'bytes': 0},
-            'other': {'packets': 0, 'bytes': 0}
-        }
-        self.stats_history = {
-            'protocols': [],
-            'timestamps': []
-        }
-        # 新增：用于存储数据包摘要的列表
-        self.packet_summaries = []
-        # 新增：限制存储的数据包摘要数量，防止内存爆炸
-        self.MAX_PACKET_SUMMARIES = 1000
+        # 协议端口映射表，可通过配置文件扩展
+        conf = CONF.traffic_monitor
+        if conf.protocol_map:
+            self.classifier = ProtocolClassifier.from_file(conf.protocol_map)
+        else:
+            self.classifier = ProtocolClassifier()
+        # 被过载保护丢弃的数据包记为 unclassified，'other' 保持在最后
+        stat_labels = self.classifier.protocols[:-1] + (UNCLASSIFIED, OTHER)
+        self.protocol_stats = dict(
+            (proto, {'packets': 0, 'bytes': 0})
+            for proto in stat_labels
+        )
+        self.forwarding_mode = conf.forwarding_mode
+        # 主动模式下已下发的流表项：(dpid, cookie) -> [协议, 已统计包数, 已统计字节数, 匹配键]
+        self.flow_accounts = {}
+        # 主动模式下流表项对应的会话键：(dpid, cookie) -> 会话键
+        self.flow_conversations = {}
+        # (dpid, 匹配键) -> (cookie, 过期时间)，避免重复下发相同的流表项
+        self.installed_flows = {}
+        self._next_cookie = 1
+        # pipeline 模式下分类流表项上一次的计数：(dpid, cookie) -> (包数, 字节数)
+        self.pipeline_counters = {}
+        # 等待屏障回复的批量安装：dpid -> (xid, 发送时间, 消息数)
+        self._pipeline_barriers = {}
+        # 周期性统计请求的调度状态：(dpid, 类型) -> 下次发送时间 / 未完成请求的发送时间
+        self._stats_due = {}
+        self._stats_pending = {}
+        # 多段（multipart）回复在收齐之前暂存在这里：(dpid, 类型) -> (条目列表, 键集合)
+        self._stats_parts = {}
+        # 保存上一次的计数器样本，用于计算速率
+        self.port_rates = RateTracker(PORT_RATE_FIELDS, {'rx_bps': 8, 'tx_bps': 8})
+        self.flow_rates = RateTracker(FLOW_RATE_FIELDS, {'bps': 8})
+        self.stats_requests_skipped = 0
+        self.stream_clients = 0
+        # 缓存最近一次完整回复的时间，以及等待新回复的 REST 请求（每台交换机只发一个请求）
+        self._stats_updated = {}
+        self._stats_waiters = {}
+        # 按固定时间桶记录各协议的增量，分 10 秒 / 1 分钟 / 1 小时三级降采样
+        self.stats_history = ProtocolTimeSeries(stat_labels)
+        # 数据包摘要保存在定长的列式环形缓冲区中，内存占用固定
+        self.packet_summaries = SummaryRing(conf.summary_capacity,
+                                            self.classifier.protocols)
+        # REST 接口默认返回的摘要数量
+        self.DEFAULT_SUMMARY_LIMIT = 1000
+        # 按 (dpid, 五元组) 聚合的会话表，空闲超时或表满时结束并批量导出
+        self.conversations = ConversationTable(conf.conversation_table_size,
+                                               conf.conversation_idle_timeout,
+                                               conf.conversation_recent)
+        # 按源/目的地址和端口统计字节数最多的对象，内存固定，与地址数量无关
+        self.top_talkers = TopTalkers(conf.top_window, conf.top_slot_seconds,
+                                      conf.top_capacity, conf.top_sketch_width)
+        # 持久化审计日志：后台线程按批次把环形缓冲区中的新摘要写入磁盘
+        self.audit_log = None
+        self._audit_cursor = 0
+        if conf.audit_log_dir:
+            # 段切换时的 fsync 和索引构建在操作系统线程中进行，不阻塞 packet-in 处理
+            self.audit_log = AuditLog(conf.audit_log_dir, self.classifier.protocols,
+                                      segment_seconds=conf.audit_segment_seconds,
+                                      segment_bytes=conf.audit_segment_mb * 1024 * 1024,
+                                      retention_seconds=conf.audit_retention_hours * 3600,
+                                      retention_bytes=conf.audit_retention_mb * 1024 * 1024,
+                                      run=tpool.execute)
+        # 过载保护：有界的优先级队列，由工作线程处理 packet-in
+        self.intake = None
+        if conf.intake_queue_size > 0:
+            self.intake = IntakeQueue(conf.intake_queue_size)
+        self._intake_event = hub.Event()
+        # 交换机 meter 丢弃的数据包：dpid -> (包数, 字节数)
+        self.meter_drops = {}
+        # 每次状态变化加一；REST 响应在同一个 epoch 内只编码一次
+        self.state_epoch = 0
+        self.rest_cache = SnapshotCache(conf.rest_cache_max_age)
+        # 横向扩展：worker 定期把状态发布到共享内存，frontend 合并所有 worker 的状态，
+        # 直接写入本进程的协议统计、历史数据和摘要缓冲区，REST 接口不需要区分
+        self.publisher = None
+        self.aggregator = None
+        if conf.scale_role == WORKER:
+            self.publisher = StatePublisher(segment_name(conf.scale_name, conf.worker_id),
+                                            conf.scale_segment_mb * 1024 * 1024)
+        elif conf.scale_role == FRONTEND:
+            self.aggregator = Aggregator(
+                [segment_name(conf.scale_name, i) for i in range(conf.scale_workers)],
+                self.protocol_stats, self.stats_history, self.packet_summaries,
+                stale_after=conf.publish_interval * 5)
+        # 异常检测：按源地址维护滑动窗口状态，触发后告警，可选下发限时丢弃规则。
+        # proactive 模式下控制器只看到每条流的 SYN，看不到后续的 ACK，
+        # 正常的代理或 NAT 也会被当成 SYN 洪泛，所以不做这项检测
+        self.detector = None
+        if conf.anomaly_detection:
+            self.detector = AnomalyDetector(
+                conf.anomaly_window, conf.scan_ports, conf.syn_flood_threshold,
+                conf.syn_ack_ratio, conf.dns_amplification_bytes,
+                conf.dns_amplification_ratio,
+                hold=conf.anomaly_block_seconds or conf.anomaly_window,
+                syn_flood=self.forwarding_mode != 'proactive')
+        self.alerts = deque(maxlen=conf.alert_capacity)
+        # 按交换机限制 MAC 学习日志的频率
+        self._log_limiter = LogLimiter(conf.log_interval)
+        # 热重启：启动时从检查点恢复协议统计、历史数据、摘要和 MAC 表，
+        # 之后由后台线程定期写入增量，每隔一段时间写一次全量快照
+        self.checkpoint = None
+        self.checkpoint_full_due = False
+        self.checkpoint_written = None
+        self.checkpoint_state = ControllerState(
+            self.protocol_stats, self.stats_history, self.packet_summaries, self.mac_tables,
+            lambda: MacTable(conf.mac_table_size, conf.mac_aging_time))
+        self._checkpoint_lock = hub.Semaphore()
+        if conf.checkpoint_dir and self.aggregator is None:
+            self._restore_checkpoint(conf.checkpoint_dir)
+            self.checkpoint = CheckpointWriter(conf.checkpoint_dir)
+        self._init_metrics()
         wsgi = kwargs['wsgi']
         wsgi.register(TrafficMonitorRestApi, {'traffic_monitor': self})
 
+    def _init_metrics(self):
+        """Create the /metrics registry
+
+        Hot-path metrics are looked up once here and updated in place;
+        everything the app already keeps (counters, buffer sizes) is read
+        only when /metrics is scraped.
+        """
+        metrics = self.metrics = Registry()
+        self._packet_in_total = metrics.counter(
+            'traffic_monitor_packet_in_total', 'Packet-in messages handled').labels()
+        stages = metrics.histogram(
+            'traffic_monitor_packet_in_stage_seconds',
+            'Time spent in each stage of the packet-in handler', ('stage',))
+        self._stage_parse = stages.labels('parse')
+        self._stage_queue = stages.labels('queue')
+        self._stage_learn = stages.labels('learn')
+        self._stage_classify = stages.labels('classify')
+        self._stage_detect = stages.labels('detect')
+        self._stage_summarize = stages.labels('summarize')
+        self._stage_packet_out = stages.labels('packet_out')
+        self._stats_rtt = metrics.histogram(
+            'traffic_monitor_stats_rtt_seconds',
+            'Time from a stats request to its last reply part', ('dpid', 'kind'),
+            buckets=RTT_BUCKETS)
+        self.rest_serialize = metrics.histogram(
+            'traffic_monitor_rest_serialize_seconds',
+            'Time spent encoding REST responses as JSON', ('endpoint',))
+        self._alerts_total = metrics.counter(
+            'traffic_monitor_alerts_total', 'Anomaly alerts raised', ('type',))
+
+        metrics.callback(
+            'traffic_monitor_protocol_packets_total', 'Packets per protocol', 'counter',
+            lambda: (((p,), s['packets']) for p, s in self.protocol_stats.items()),
+            ('protocol',))
+        metrics.callback(
+            'traffic_monitor_protocol_bytes_total', 'Bytes per protocol', 'counter',
+            lambda: (((p,), s['bytes']) for p, s in self.protocol_stats.items()),
+            ('protocol',))
+        for field in ('rx_packets', 'tx_packets', 'rx_bytes', 'tx_bytes',
+                      'rx_errors', 'tx_errors'):
+            metrics.callback(
+                'traffic_monitor_port_%s_total' % field,
+                'Switch port %s from the last port stats reply' % field, 'counter',
+                lambda field=field: (((dpid, port['port_no']), port[field])
+                                     for dpid, ports in list(self.port_stats.items())
+                                     for port in ports),
+                ('dpid', 'port'))
+
+        def stats_age():
+            now = time.time()
+            return (((dpid, kind), now - updated)
+                    for (dpid, kind), updated in list(self._stats_updated.items()))
+
+        metrics.callback('traffic_monitor_stats_age_seconds',
+                         'Age of the cached flow/port stats', 'gauge',
+                         stats_age, ('dpid', 'kind'))
+        gauges = (
+            ('datapaths', 'Connected switches', lambda: len(self.datapaths)),
+            ('stats_requests_pending', 'Stats requests waiting for a reply',
+             lambda: len(self._stats_pending)),
+            ('summary_ring_entries', 'Packet summaries held in memory',
+             lambda: len(self.packet_summaries)),
+            ('summary_ring_capacity', 'Capacity of the packet summary ring',
+             lambda: CONF.traffic_monitor.summary_capacity),
+            ('audit_log_lag', 'Packet summaries not yet written to the audit log',
+             lambda: (self.packet_summaries.total - self._audit_cursor
+                      if self.audit_log is not None else 0)),
+            ('conversations_active', 'Active conversations',
+             lambda: len(self.conversations)),
+            ('flow_accounts', 'Proactively installed flows being accounted',
+             lambda: len(self.flow_accounts)),
+            ('stream_clients', 'Connected /stats/stream clients',
+             lambda: self.stream_clients),
+        )
+        for name, help, read in gauges:
+            metrics.callback('traffic_monitor_' + name, help, 'gauge',
+                             lambda read=read: [((), read())])
+        metrics.callback('traffic_monitor_stats_requests_skipped_total',
+                         'Scheduled stats requests skipped because the previous '
+                         'one was outstanding', 'counter',
+                         lambda: [((), self.stats_requests_skipped)])
+        metrics.callback('traffic_monitor_intake_queue_length',
+                         'Packet-ins waiting in the intake queue', 'gauge',
+                         lambda: [((), len(self.intake) if self.intake is not None else 0)])
+        metrics.callback('traffic_monitor_intake_shed_total',
+                         'Packet-ins dropped by the intake queue', 'counter',
+                         lambda: ([((name,), n) for name, n in
+                                   self.intake.stats()['shed'].items()]
+                                  if self.intake is not None else []),
+                         ('class',))
+        metrics.callback('traffic_monitor_meter_dropped_packets_total',
+                         'Packets dropped by the controller-bound meter', 'counter',
+                         lambda: (((dpid,), drops[0])
+                                  for dpid, drops in list(self.meter_drops.items())),
+                         ('dpid',))
+        metrics.callback('traffic_monitor_rest_cache_hits_total',
+                         'REST responses served from an already encoded snapshot',
+                         'counter', lambda: [((), self.rest_cache.hits)])
+        metrics.callback('traffic_monitor_rest_cache_misses_total',
+                         'REST responses that had to be encoded', 'counter',
+                         lambda: [((), self.rest_cache.misses)])
+        metrics.callback('traffic_monitor_conversations_evicted_total',
+                         'Conversations evicted because the table was full', 'counter',
+                         lambda: [((), self.conversations.evicted)])
+        metrics.callback('traffic_monitor_mac_table_entries',
+                         'Learned MAC addresses per switch', 'gauge',
+                         lambda: (((dpid,), len(table))
+                                  for dpid, table in list(self.mac_tables.items())),
+                         ('dpid',))
+        metrics.callback('traffic_monitor_mac_moves_total',
+                         'MAC addresses seen on a different port than learned', 'counter',
+                         lambda: (((dpid,), table.moves)
+                                  for dpid, table in list(self.mac_tables.items())),
+                         ('dpid',))
+        metrics.callback('traffic_monitor_worker_state_age_seconds',
+                         'Age of the last state published by each worker', 'gauge',
+                         lambda: ([((w['name'],), w['age'])
+                                   for w in self.aggregator.workers() if w['pid'] is not None]
+                                  if self.aggregator is not None else []),
+                         ('worker',))
+        metrics.callback('traffic_monitor_checkpoint_age_seconds',
+                         'Seconds since the last checkpoint was written', 'gauge',
+                         lambda: ([((), time.time() - self.checkpoint_written)]
+                                  if self.checkpoint_written is not None else []))
+        metrics.callback('traffic_monitor_anomaly_untracked_total',
+                         'Packets not checked because the detector table was full',
+                         'counter',
+                         lambda: [((), self.detector.untracked
+                                   if self.detector is not None else 0)])
+
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev):
         datapath = ev.msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        match = parser.OFPMatch(
-            eth_type=0x0800,  # IPv4
-            ip_proto=6,       # TCP
-            tcp_dst=80        # HTTP 端口
-        )
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER)]
-        self.add_flow(datapath, priority=10, match=match, actions=actions)
+        if self.forwarding_mode == 'pipeline':
+            # 分类和转发都在交换机内完成，不再把流量送到控制器
+            self._install_pipeline(datapath)
+        else:
+            # 送往控制器的规则经过 meter 限速，风暴时由交换机丢弃超出的部分
+            meter_id = None
+            if CONF.traffic_monitor.packet_in_rate_limit > 0:
+                meter_id = self._install_controller_meter(
+                    datapath, CONF.traffic_monitor.packet_in_rate_limit)
 
+            match = parser.OFPMatch(
+                eth_type=0x0800,  # IPv4
+                ip_proto=6,       # TCP
+                tcp_dst=80        # HTTP 端口
+            )
+            actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER)]
+            self.add_flow(datapath, priority=10, match=match, actions=actions,
+                          meter_id=meter_id)
 
-        # 安装table-miss流条目
-        match = parser.OFPMatch()
-        actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
-                                        ofproto.OFPCML_NO_BUFFER)]
-        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
-                                        actions)]
-        mod = parser.OFPFlowMod(datapath=datapath, priority=0,
-                            match=match, instructions=inst)
-        datapath.send_msg(mod)
+
+            # 安装table-miss流条目
+            match = parser.OFPMatch()
+            actions = [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                            ofproto.OFPCML_NO_BUFFER)]
+            inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                            actions)]
+            if meter_id is not None:
+                inst.insert(0, parser.OFPInstructionMeter(meter_id, ofproto.OFPIT_METER))
+            mod = parser.OFPFlowMod(datapath=datapath, priority=0,
+                                match=match, instructions=inst)
+            datapath.send_msg(mod)
+
+        if self.forwarding_mode == 'proactive':
+            # 清理上次连接时下发的流表项，它们的计数已经无法对应到统计中
+            mod = parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE,
+                                    table_id=ofproto.OFPTT_ALL,
+                                    out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                    cookie=FLOW_COOKIE_TAG, cookie_mask=FLOW_COOKIE_MASK)
+            datapath.send_msg(mod)
+            if CONF.traffic_monitor.sample_rate > 1:
+                for mod in self._sample_group_mods(datapath, CONF.traffic_monitor.sample_rate):
+                    datapath.send_msg(mod)
 
         self.datapaths[datapath.id] = datapath
         self.flow_stats[datapath.id] = []
         self.port_stats[datapath.id] = []
 
-    def add_flow(self, datapath, priority, match, actions, buffer_id=None):
+    def add_flow(self, datapath, priority, match, actions, buffer_id=None,
+                 idle_timeout=0, hard_timeout=0, cookie=0, flags=0, meter_id=None):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
         inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
                                         actions)]
-        
+        if meter_id is not None:
+            inst.insert(0, parser.OFPInstructionMeter(meter_id, ofproto.OFPIT_METER))
+
         if buffer_id:
             mod = parser.OFPFlowMod(datapath=datapath, buffer_id=buffer_id,
                                 priority=priority, match=match,
-                                instructions=inst)
+                                instructions=inst, cookie=cookie,
+                                idle_timeout=idle_timeout,
+                                hard_timeout=hard_timeout, flags=flags)
         else:
             mod = parser.OFPFlowMod(datapath=datapath, priority=priority,
-                                match=match, instructions=inst)
+                                match=match, instructions=inst, cookie=cookie,
+                                idle_timeout=idle_timeout,
+                                hard_timeout=hard_timeout, flags=flags)
         datapath.send_msg(mod)
 
+    def _install_controller_meter(self, datapath, rate):
+        """(Re)create the meter limiting packet-ins to ``rate`` packets per second"""
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        # 重连时先删除旧的 meter，计数器从零开始
+        datapath.send_msg(parser.OFPMeterMod(datapath, command=ofproto.OFPMC_DELETE,
+                                             meter_id=CONTROLLER_METER_ID))
+        bands = [parser.OFPMeterBandDrop(rate=rate, burst_size=max(1, rate // 10))]
+        datapath.send_msg(parser.OFPMeterMod(
+            datapath, command=ofproto.OFPMC_ADD,
+            flags=ofproto.OFPMF_PKTPS | ofproto.OFPMF_BURST | ofproto.OFPMF_STATS,
+            meter_id=CONTROLLER_METER_ID, bands=bands))
+        self.meter_drops[datapath.id] = (0, 0)
+        return CONTROLLER_METER_ID
+
+    def _sample_group_mods(self, datapath, rate):
+        """Build the messages (re)creating a select group that sends about 1 in
+        ``rate`` flows to the controller
+
+        Open vSwitch picks a select-group bucket per flow hash, so the
+        sampling granularity is flows rather than individual packets.
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        buckets = [
+            parser.OFPBucket(weight=1, actions=[
+                parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                       ofproto.OFPCML_NO_BUFFER)]),
+            parser.OFPBucket(weight=rate - 1, actions=[]),
+        ]
+        # 重连或采样率改变时交换机上可能已有该组，直接 ADD 会被拒绝并保留旧的权重
+        return [parser.OFPGroupMod(datapath, ofproto.OFPGC_DELETE,
+                                   ofproto.OFPGT_SELECT, SAMPLE_GROUP_ID),
+                parser.OFPGroupMod(datapath, ofproto.OFPGC_ADD,
+                                   ofproto.OFPGT_SELECT, SAMPLE_GROUP_ID, buckets)]
+
+    def _send_batch(self, datapath, msgs):
+        """Send ``msgs`` as one write followed by a barrier request
+
+        Messages are serialized into a single buffer instead of queueing
+        them one by one, so large rule sets reach the switch in one go.
+        Returns the barrier request.
+        """
+        msgs = list(msgs) + [datapath.ofproto_parser.OFPBarrierRequest(datapath)]
+        buf = bytearray()
+        for msg in msgs:
+            datapath.set_xid(msg)
+            msg.serialize()
+            buf += msg.buf
+        datapath.send(bytes(buf))
+        return msgs[-1]
+
+    def _install_pipeline(self, datapath):
+        """Install the classification (table 0) and forwarding (table 1) tables
+
+        Table 0 has one counting entry per configured protocol port and
+        direction, in the lookup order of ProtocolClassifier.classify, and a
+        catch-all entry counting 'other'; all of them go to table 1, which
+        forwards with NORMAL.  protocol_stats is then filled from the flow
+        counters of table 0.
+        """
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        conf = CONF.traffic_monitor
+        dpid = datapath.id
+
+        # 先删除上次连接时安装的分类流表项，计数从零开始
+        msgs = [parser.OFPFlowMod(datapath=datapath, command=ofproto.OFPFC_DELETE,
+                                  table_id=ofproto.OFPTT_ALL,
+                                  out_port=ofproto.OFPP_ANY, out_group=ofproto.OFPG_ANY,
+                                  cookie=PIPELINE_COOKIE_TAG, cookie_mask=FLOW_COOKIE_MASK)]
+        for key in [key for key in self.pipeline_counters if key[0] == dpid]:
+            del self.pipeline_counters[key]
+
+        goto = [parser.OFPInstructionGotoTable(FORWARD_TABLE)]
+        index = dict((name, i) for i, name in enumerate(self.classifier.protocols))
+        rules = self.classifier.match_rules() + [(-1, OTHER, {})]
+        for seq, (tier, name, fields) in enumerate(rules):
+            cookie = PIPELINE_COOKIE_TAG | index[name] << 32 | seq
+            msgs.append(parser.OFPFlowMod(datapath=datapath, table_id=CLASSIFY_TABLE,
+                                          priority=(tier + 1) * 100, cookie=cookie,
+                                          match=parser.OFPMatch(**fields),
+                                          instructions=goto))
+        # 与 reactive 模式一致，IPv6 不计入统计（cookie 不带前缀）
+        msgs.append(parser.OFPFlowMod(datapath=datapath, table_id=CLASSIFY_TABLE,
+                                      priority=50,
+                                      match=parser.OFPMatch(eth_type=ether_types.ETH_TYPE_IPV6),
+                                      instructions=goto))
+
+        actions = [parser.OFPActionOutput(ofproto.OFPP_NORMAL)]
+        if conf.sample_rate == 1:
+            actions.append(parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                                  ofproto.OFPCML_NO_BUFFER))
+        elif conf.sample_rate > 1:
+            msgs.extend(self._sample_group_mods(datapath, conf.sample_rate))
+            actions.append(parser.OFPActionGroup(SAMPLE_GROUP_ID))
+        # 采样副本带 FLOW_COOKIE_TAG，由 packet-in 处理函数只记录摘要
+        msgs.append(parser.OFPFlowMod(
+            datapath=datapath, table_id=FORWARD_TABLE, priority=0,
+            cookie=FLOW_COOKIE_TAG, match=parser.OFPMatch(),
+            instructions=[parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS,
+                                                       actions)]))
+
+        barrier = self._send_batch(datapath, msgs)
+        self._pipeline_barriers[dpid] = (barrier.xid, time.time(), len(msgs))
+
+    @set_ev_cls(ofp_event.EventOFPBarrierReply, [CONFIG_DISPATCHER, MAIN_DISPATCHER])
+    def _barrier_reply_handler(self, ev):
+        msg = ev.msg
+        dpid = msg.datapath.id
+        pending = self._pipeline_barriers.get(dpid)
+        if pending is None or pending[0] != msg.xid:
+            return
+        del self._pipeline_barriers[dpid]
+        self.logger.info("交换机 %s 已安装 %d 条分类流表消息，用时 %.3f 秒",
+                         dpid, pending[2], time.time() - pending[1])
+
+    def _account_pipeline_counters(self, dpid, cookie, packets, byte_count):
+        """Fold counters of a table-0 classification entry into protocol_stats"""
+        index = (cookie >> 32) & 0xffff
+        if index >= len(self.classifier.protocols):
+            return
+        prev = self.pipeline_counters.get((dpid, cookie), (0, 0))
+        if packets < prev[0] or byte_count < prev[1]:
+            # 流表项被重建，计数器从零开始
+            prev = (0, 0)
+        self.pipeline_counters[(dpid, cookie)] = (packets, byte_count)
+        if packets > prev[0]:
+            self._update_protocol_stats(self.classifier.protocols[index],
+                                        byte_count - prev[1], packets - prev[0])
+
+    def _flow_match(self, parser, headers, in_port):
+        """Build the per-flow match used in proactive mode"""
+        fields = {
+            'in_port': in_port,
+            'eth_src': mac_str(headers.eth_src),
+            'eth_dst': mac_str(headers.eth_dst),
+            'eth_type': headers.eth_type,
+        }
+        if headers.ip_proto is not None:
+            fields['ipv4_src'] = ipv4_str(headers.ip_src)
+            fields['ipv4_dst'] = ipv4_str(headers.ip_dst)
+            fields['ip_proto'] = headers.ip_proto
+            if headers.dst_port is not None:
+                if headers.ip_proto == 6:
+                    fields['tcp_src'] = headers.src_port
+                    fields['tcp_dst'] = headers.dst_port
+                elif headers.ip_proto == 17:
+                    fields['udp_src'] = headers.src_port
+                    fields['udp_dst'] = headers.dst_port
+        key = tuple(sorted(fields.items()))
+        return parser.OFPMatch(**fields), key
+
+    def _install_forwarding_flow(self, datapath, headers, in_port, out_port, protocol):
+        """Install a per-flow entry so the rest of the flow stays in the switch"""
+        ofproto = datapath.ofproto
+        parser = datapath.ofproto_parser
+        conf = CONF.traffic_monitor
+        dpid = datapath.id
+
+        match, key = self._flow_match(parser, headers, in_port)
+        now = time.time()
+        installed = self.installed_flows.get((dpid, key))
+        if installed is not None and installed[1] > now:
+            # 流表项已存在（首包之后的几个包可能先于流表生效到达控制器）
+            return
+
+        cookie = FLOW_COOKIE_TAG | self._next_cookie
+        self._next_cookie = (self._next_cookie + 1) & ~FLOW_COOKIE_MASK
+        actions = [parser.OFPActionOutput(out_port)]
+        if conf.sample_rate == 1:
+            actions.append(parser.OFPActionOutput(ofproto.OFPP_CONTROLLER,
+                                                  ofproto.OFPCML_NO_BUFFER))
+        elif conf.sample_rate > 1:
+            actions.append(parser.OFPActionGroup(SAMPLE_GROUP_ID))
+        self.add_flow(datapath, FLOW_PRIORITY, match, actions,
+                      idle_timeout=conf.flow_idle_timeout,
+                      hard_timeout=conf.flow_hard_timeout,
+                      cookie=cookie, flags=ofproto.OFPFF_SEND_FLOW_REM)
+
+        self.flow_accounts[(dpid, cookie)] = [protocol, 0, 0, key]
+        self.flow_conversations[(dpid, cookie)] = conversation_key(dpid, headers)
+        if installed is not None:
+            self.flow_accounts.pop((dpid, installed[0]), None)
+            self.flow_conversations.pop((dpid, installed[0]), None)
+        expires = now + (conf.flow_hard_timeout or 3600)
+        self.installed_flows[(dpid, key)] = (cookie, expires)
+
+    def _account_flow_counters(self, dpid, cookie, packets, byte_count, removed=False):
+        """Fold flow-entry counters into protocol_stats"""
+        account = self.flow_accounts.get((dpid, cookie))
+        if account is None:
+            return
+        delta_packets = packets - account[1]
+        delta_bytes = byte_count - account[2]
+        if delta_packets > 0:
+            self._update_protocol_stats(account[0], delta_bytes, delta_packets)
+            conv_key = self.flow_conversations.get((dpid, cookie))
+            if conv_key is not None:
+                self.conversations.add(conv_key, delta_packets, delta_bytes,
+                                       time.time(), account[0])
+            account[1] = packets
+            account[2] = byte_count
+        if removed:
+            del self.flow_accounts[(dpid, cookie)]
+            self.flow_conversations.pop((dpid, cookie), None)
+            installed = self.installed_flows.get((dpid, account[3]))
+            if installed is not None and installed[0] == cookie:
+                del self.installed_flows[(dpid, account[3])]
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev):
+        msg = ev.msg
+        if msg.cookie & FLOW_COOKIE_MASK != FLOW_COOKIE_TAG:
+            return
+        self._account_flow_counters(msg.datapath.id, msg.cookie,
+                                    msg.packet_count, msg.byte_count,
+                                    removed=True)
+
     @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
     def _packet_in_handler(self, ev):
         msg = ev.msg
+        clock = time.perf_counter
+        started = clock()
+        self._packet_in_total.inc()
+
+        # 只解析一次，结果同时用于协议识别、统计和摘要
+        headers = self._decode_packet(msg.data)
+        parsed = clock()
+        self._stage_parse.observe(parsed - started)
+
+        if self.intake is None:
+            self._process_packet_in(msg, headers, parsed)
+            return
+        # 放入有界优先级队列由工作线程处理，队列满时先丢弃低优先级的流量
+        shed = self.intake.put((msg, headers, parsed), priority_class(headers))
+        if shed is not None:
+            self._shed_packet_in(*shed[0][:2])
+        self._intake_event.set()
+
+    def _shed_packet_in(self, msg, headers):
+        """Account a packet-in dropped by the intake queue as unclassified"""
+        ofproto = msg.datapath.ofproto
+        # IPv6 和采样副本本来就不计入统计
+        if headers.eth_type == ether_types.ETH_TYPE_IPV6:
+            return
+        if msg.reason == ofproto.OFPR_ACTION and msg.cookie & FLOW_COOKIE_MASK == FLOW_COOKIE_TAG:
+            return
+        self._update_protocol_stats(UNCLASSIFIED, headers.length)
+
+    def _drain_intake(self, budget=None):
+        """Process queued packet-ins, control class first; returns how many"""
+        clock = time.perf_counter
+        done = 0
+        while budget is None or done < budget:
+            item = self.intake.get()
+            if item is None:
+                break
+            msg, headers, queued = item
+            now = clock()
+            self._stage_queue.observe(now - queued)
+            try:
+                self._process_packet_in(msg, headers, now)
+            except Exception:
+                self.logger.exception("处理 packet-in 失败")
+            done += 1
+        return done
+
+    def _intake_loop(self):
+        while True:
+            self._intake_event.wait()
+            self._intake_event.clear()
+            while self._drain_intake(INTAKE_BATCH):
+                # 每处理一批让出一次，REST 请求和统计回复不会被饿死
+                hub.sleep(0)
+
+    def _process_packet_in(self, msg, headers, parsed):
         datapath = msg.datapath
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
         in_port = msg.match['in_port']
-        
-        pkt = packet.Packet(msg.data)
-        eth_pkt = pkt.get_protocol(ethernet.ethernet)
+        clock = time.perf_counter
 
         # ====== 新增：过滤 IPv6 数据包 ======
-        if eth_pkt and eth_pkt.ethertype == ether_types.ETH_TYPE_IPV6:
+        if headers.eth_type == ether_types.ETH_TYPE_IPV6:
             # 如果是以太网帧且类型是 IPv6，则直接转发并跳过摘要和统计更新
             actions = [parser.OFPActionOutput(ofproto.OFPP_NORMAL)]
             out = parser.OFPPacketOut(
@@ -111,35 +846,63 @@ class TrafficMonitor(app_manager.RyuApp):
             datapath.send_msg(out)
             return # 退出处理函数，不进行后续处理
         # ==================================
-        
-       
-        if eth_pkt: # 确保是以太网帧
-            dpid = datapath.id
-            src_mac = eth_pkt.src
-            dst_mac = eth_pkt.dst
-            
-            self.mac_to_port.setdefault(dpid, {})
 
-        # 学习源 MAC 地址
-            self.mac_to_port[dpid][src_mac] = in_port
-            self.logger.info("学习到交换机 %s 的 MAC: %s -> 端口: %s", dpid, src_mac, in_port)
+        if msg.reason == ofproto.OFPR_ACTION and msg.cookie & FLOW_COOKIE_MASK == FLOW_COOKIE_TAG:
+            # 采样副本：交换机已经转发并计数，这里只记录摘要
+            protocol = self.classifier.classify(headers)
+            self._generate_and_store_packet_summary(datapath, headers, in_port, protocol)
+            return
+
+        out_port = ofproto.OFPP_FLOOD # 默认泛洪
+        if headers.eth_src is not None: # 确保是以太网帧
+            now = time.time()
+            table = self.mac_tables.get(datapath.id)
+            if table is None:
+                table = self.mac_tables[datapath.id] = MacTable(
+                    CONF.traffic_monitor.mac_table_size, CONF.traffic_monitor.mac_aging_time)
+            # 学习源 MAC 地址；组播/广播地址不会是合法的源地址
+            if not headers.eth_src[0] & 1:
+                result, old_port = table.learn(headers.eth_src, in_port, now)
+                if result != REFRESHED:
+                    self._mac_changed(datapath, headers.eth_src, in_port, result, old_port, now)
+            # 目的 MAC 已学习到则单播，否则泛洪
+            port = table.lookup(headers.eth_dst, now)
+            if port is not None:
+                out_port = port
+        learned = clock()
+        self._stage_learn.observe(learned - parsed)
+
+        protocol = self.classifier.classify(headers) # 协议识别
+        classified = clock()
+        self._stage_classify.observe(classified - learned)
 
-        protocol = self._identify_protocol(pkt) # 协议识别
+        if self.detector is not None:
+            alert = self.detector.observe(headers, time.time())
+            if alert is not None:
+                self._raise_alert(datapath, in_port, *alert)
+            detected = clock()
+            self._stage_detect.observe(detected - classified)
+            classified = detected
 
-        self._update_protocol_stats(protocol, len(msg.data))  # 更新统计
+        self._update_protocol_stats(protocol, headers.length)  # 更新统计
+        conv_key = conversation_key(datapath.id, headers)
+        if conv_key is not None:
+            self.conversations.add(conv_key, 1, headers.length, time.time(),
+                                   protocol, headers.tcp_flags)
         # 新增：生成数据包摘要并存储
-        self._generate_and_store_packet_summary(datapath, pkt, in_port, msg.data)
-        
-        # 优先尝试基于学习到的MAC地址进行转发
-        out_port = ofproto.OFPP_FLOOD # 默认泛洪
-        if eth_pkt and eth_pkt.dst in self.mac_to_port.get(datapath.id, {}):
-            out_port = self.mac_to_port[datapath.id][eth_pkt.dst]
-            self.logger.info("数据包转发到已知MAC %s -> 端口 %s", eth_pkt.dst, out_port)
-        else:
-            self.logger.info("数据包泛洪 (目的MAC未知): %s", eth_pkt.dst if eth_pkt else "N/A")
+        self._generate_and_store_packet_summary(datapath, headers, in_port, protocol)
+        summarized = clock()
+        self._stage_summarize.observe(summarized - classified)
 
-        # 直接转发，不安装流表（确保所有流量都上报控制器）
-        actions = [parser.OFPActionOutput(ofproto.OFPP_NORMAL)]  # 或 OFPP_FLOOD
+        if out_port == in_port:
+            # 目的主机就在入端口一侧，不需要转发
+            actions = []
+        else:
+            if self.forwarding_mode == 'proactive' and out_port != ofproto.OFPP_FLOOD:
+                # 下发流表项，后续流量留在交换机内，由流表计数器统计
+                self._install_forwarding_flow(datapath, headers, in_port, out_port, protocol)
+            # reactive 模式不安装流表，所有流量仍然上报控制器
+            actions = [parser.OFPActionOutput(out_port)]
         out = parser.OFPPacketOut(
             datapath=datapath,
             buffer_id=msg.buffer_id,
@@ -148,200 +911,309 @@ class TrafficMonitor(app_manager.RyuApp):
             data=msg.data if msg.buffer_id == ofproto.OFP_NO_BUFFER else None
         )
         datapath.send_msg(out)
-    # 新增：生成并存储数据包摘要的方法
-    def _generate_and_store_packet_summary(self, datapath, pkt, in_port, raw_data):
-        summary = {
-            'timestamp': time.time(),
+        self._stage_packet_out.observe(clock() - summarized)
+
+    def _mac_changed(self, datapath, mac, port, result, old_port, now):
+        """Log a newly learned or moved MAC and drop flows towards its old port"""
+        dpid = datapath.id
+        if result == MOVED:
+            suppressed = self._log_limiter.allow(('move', dpid), now)
+            if suppressed is not None:
+                self.logger.warning("交换机 %s 的 MAC %s 从端口 %s 移动到端口 %s（省略 %d 条同类消息）",
+                                    dpid, mac_str(mac), old_port, port, suppressed)
+            if self.forwarding_mode == 'proactive':
+                # 删除仍然发往旧端口的流表项，流表项删除消息会清理对应的统计状态
+                ofproto = datapath.ofproto
+                parser = datapath.ofproto_parser
+                datapath.send_msg(parser.OFPFlowMod(
+                    datapath=datapath, command=ofproto.OFPFC_DELETE,
+                    table_id=ofproto.OFPTT_ALL, out_port=old_port,
+                    out_group=ofproto.OFPG_ANY, match=parser.OFPMatch(eth_dst=mac_str(mac)),
+                    cookie=FLOW_COOKIE_TAG, cookie_mask=FLOW_COOKIE_MASK))
+            return
+        suppressed = self._log_limiter.allow(('learn', dpid), now)
+        if suppressed is not None:
+            self.logger.info("学习到交换机 %s 的 MAC: %s -> 端口: %s（省略 %d 条同类消息）",
+                             dpid, mac_str(mac), port, suppressed)
+
+    def _raise_alert(self, datapath, in_port, kind, ip, value, threshold):
+        """Record an anomaly alert and block the offending traffic on every switch"""
+        block = CONF.traffic_monitor.anomaly_block_seconds
+        now = time.time()
+        fields = drop_match(kind, ip)
+        alert = {
+            'time': now,
+            'type': kind,
+            'ip': ipv4_str(ip),
+            'value': value,
+            'threshold': threshold,
             'dpid': datapath.id,
             'in_port': in_port,
-            'eth_src': None,
-            'eth_dst': None,
-            'eth_type': None,
-            'ip_src': None,
-            'ip_dst': None,
-            'ip_proto': None,
-            'src_port': None,
-            'dst_port': None,
-            'packet_len': len(raw_data),
-            'protocol_identified': self._identify_protocol(pkt)
+            'blocked_until': None,
+            'match': None
         }
+        if block > 0:
+            # 没有动作的流表项即丢弃，hard_timeout 到期后由交换机自动删除
+            for dp in list(self.datapaths.values()):
+                self.add_flow(dp, ANOMALY_PRIORITY, dp.ofproto_parser.OFPMatch(**fields), [],
+                              hard_timeout=block, cookie=ANOMALY_COOKIE_TAG)
+            alert['blocked_until'] = now + block
+            alert['match'] = fields
+        self.alerts.append(alert)
+        self._alerts_total.labels(kind).inc()
+        self.logger.warning("检测到 %s：%s（%s，阈值 %s），交换机 %s 端口 %s",
+                            kind, alert['ip'], value, threshold, datapath.id, in_port)
+
+    def _decode_packet(self, data):
+        """Extract headers from raw packet bytes in a single pass"""
+        headers = decode_frame(data)
+        if headers is None:
+            # 截断或畸形的帧交给 ryu 的完整解析器处理
+            headers = self._decode_packet_slow(data)
+        return headers
+
+    def _decode_packet_slow(self, data):
+        """Fallback decoder built on ryu's packet library"""
+        headers = FrameHeaders(length=len(data))
+        try:
+            pkt = packet.Packet(data)
+        except Exception:
+            return headers
 
-        # 提取以太网信息
         eth_pkt = pkt.get_protocol(ethernet.ethernet)
         if eth_pkt:
-            summary['eth_src'] = eth_pkt.src
-            summary['eth_dst'] = eth_pkt.dst
-            summary['eth_type'] = hex(eth_pkt.ethertype) # 转换为十六进制字符串
+            headers.eth_src = addrconv.mac.text_to_bin(eth_pkt.src)
+            headers.eth_dst = addrconv.mac.text_to_bin(eth_pkt.dst)
+            headers.eth_type = eth_pkt.ethertype
 
-        # 提取 IP 和传输层信息
         ip_pkt = pkt.get_protocol(ipv4.ipv4)
         if ip_pkt:
-            summary['ip_src'] = ip_pkt.src
-            summary['ip_dst'] = ip_pkt.dst
-            summary['ip_proto'] = ip_pkt.proto # 协议号
+            headers.eth_type = ether_types.ETH_TYPE_IP
+            headers.ip_src = struct.unpack('!I', addrconv.ipv4.text_to_bin(ip_pkt.src))[0]
+            headers.ip_dst = struct.unpack('!I', addrconv.ipv4.text_to_bin(ip_pkt.dst))[0]
+            headers.ip_proto = ip_pkt.proto
 
             tcp_pkt = pkt.get_protocol(tcp.tcp)
             udp_pkt = pkt.get_protocol(udp.udp)
-
             if tcp_pkt:
-                summary['src_port'] = tcp_pkt.src_port
-                summary['dst_port'] = tcp_pkt.dst_port
+                headers.src_port = tcp_pkt.src_port
+                headers.dst_port = tcp_pkt.dst_port
+                headers.tcp_flags = tcp_pkt.bits
             elif udp_pkt:
-                summary['src_port'] = udp_pkt.src_port
-                summary['dst_port'] = udp_pkt.dst_port
+                headers.src_port = udp_pkt.src_port
+                headers.dst_port = udp_pkt.dst_port
+        return headers
 
-        # 限制摘要数量，移除最旧的
-        if len(self.packet_summaries) >= self.MAX_PACKET_SUMMARIES:
-            self.packet_summaries.pop(0) # 移除列表最开头的（最旧的）
-        self.packet_summaries.append(summary) # 添加新的摘要
-        
-    def _identify_protocol(self, pkt):
-        """Identify protocol type from packet"""
-        ip_pkt = pkt.get_protocol(ipv4.ipv4)
-        tcp_pkt = pkt.get_protocol(tcp.tcp)
-        udp_pkt = pkt.get_protocol(udp.udp)
-        icmp_pkt = pkt.get_protocol(icmp.icmp)
-	
-        if not ip_pkt:
-            return 'other'
-        
-        # TCP protocols
-        if tcp_pkt:
-            dst_port = tcp_pkt.dst_port
-            src_port = tcp_pkt.src_port
-            print('dst_port: ', dst_port)
-            print('src_port: ', src_port)
-            
-            # HTTP (80) or HTTPS (443)
-            if dst_port == 80 or src_port == 80:
-                return 'http'
-            elif dst_port == 443 or src_port == 443:
-                return 'https'
-            # FTP (21 - control, 20 - data)
-            elif dst_port == 21 or src_port == 21:
-                return 'ftp'
-            # SMTP (25)
-            elif dst_port == 25 or src_port == 25:
-                return 'smtp'
-            # POP3 (110)
-            elif dst_port == 110 or src_port == 110:
-                return 'pop3'
-            # IMAP (143)
-            elif dst_port == 143 or src_port == 143:
-                return 'imap'
-            # SSH (22)
-            elif dst_port == 22 or src_port == 22:
-                return 'ssh'
-        
-        # UDP protocols
-        if udp_pkt:
-            dst_port = udp_pkt.dst_port
-            src_port = udp_pkt.src_port
-            
-            # DNS (53)
-            if dst_port == 53 or src_port == 53:
-                return 'dns'
-            # DHCP (67, 68)
-            elif dst_port == 67 or src_port == 67 or dst_port == 68 or src_port == 68:
-                return 'dhcp'
-        
-        if icmp_pkt:
-            return 'icmp'
-        
-        return 'other'
+    # 新增：生成并存储数据包摘要的方法
+    def _generate_and_store_packet_summary(self, datapath, headers, in_port, protocol):
+        # 写入环形缓冲区，满了以后自动覆盖最旧的摘要
+        now = time.time()
+        self.packet_summaries.append(now, datapath.id, in_port, headers, protocol)
+        self.state_epoch += 1
+        self.top_talkers.add(headers, now)
 
-    def _update_protocol_stats(self, protocol, packet_size):
+    def _update_protocol_stats(self, protocol, packet_size, packets=1):
         """Update protocol statistics"""
         if protocol in self.protocol_stats:
-            self.protocol_stats[protocol]['packets'] += 1
+            self.protocol_stats[protocol]['packets'] += packets
             self.protocol_stats[protocol]['bytes'] += packet_size
         else:
-            self.protocol_stats['other']['packets'] += 1
+            self.protocol_stats['other']['packets'] += packets
             self.protocol_stats['other']['bytes'] += packet_size
-        
-        # Record history every 10 seconds
-        current_time = int(time.time())
-        if not self.stats_history['timestamps'] or current_time - self.stats_history['timestamps'][-1] >= 10:
-            self.stats_history['timestamps'].append(current_time)
-            self.stats_history['protocols'].append(self.protocol_stats.copy())
+        self.state_epoch += 1
 
-    def send_stats_request(self, datapath):
+        self.stats_history.add(protocol, packets, packet_size, time.time())
+
+    def send_stats_request(self, datapath, kinds=STATS_KINDS):
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
+        now = time.time()
+
+        for kind in kinds:
+            if kind == 'flow':
+                req = parser.OFPFlowStatsRequest(datapath)
+            else:
+                # 修复2：将OFPP_NONE改为OFPP_ANY
+                req = parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY)
+                if datapath.id in self.meter_drops:
+                    # 顺便查询限速 meter 丢弃的数量
+                    datapath.send_msg(parser.OFPMeterStatsRequest(
+                        datapath, 0, CONTROLLER_METER_ID))
+            self._stats_pending[(datapath.id, kind)] = now
+            datapath.send_msg(req)
+
+    def _stats_outstanding(self, dpid, kind, now):
+        """Whether a request of ``kind`` to ``dpid`` is still waiting for its reply"""
+        sent = self._stats_pending.get((dpid, kind))
+        return sent is not None and now - sent < CONF.traffic_monitor.stats_reply_timeout
+
+    def _stats_reply_done(self, dpid, kind):
+        now = time.time()
+        sent = self._stats_pending.pop((dpid, kind), None)
+        if sent is not None:
+            self._stats_rtt.labels(dpid, kind).observe(now - sent)
+        self._stats_updated[(dpid, kind)] = now
+        waiter = self._stats_waiters.pop((dpid, kind), None)
+        if waiter is not None:
+            waiter.set()
 
-        req = parser.OFPFlowStatsRequest(datapath)
-        datapath.send_msg(req)
+    def stats_age(self, dpid, kind):
+        """Seconds since the cached ``kind`` stats of ``dpid`` were refreshed, or None"""
+        updated = self._stats_updated.get((dpid, kind))
+        return None if updated is None else time.time() - updated
 
-        # 修复2：将OFPP_NONE改为OFPP_ANY
-        req = parser.OFPPortStatsRequest(datapath, 0, ofproto.OFPP_ANY)
-        datapath.send_msg(req)
+    def refresh_stats(self, dpid, kind, max_age, timeout):
+        """Wait until the cached stats are at most ``max_age`` seconds old
 
+        Concurrent callers share one outstanding request per switch; if a
+        scheduled request is already in flight its reply is awaited instead
+        of sending another.  Returns False if ``timeout`` expired first.
+        """
+        age = self.stats_age(dpid, kind)
+        if age is not None and age <= max_age:
+            return True
+        key = (dpid, kind)
+        waiter = self._stats_waiters.get(key)
+        if waiter is None:
+            waiter = self._stats_waiters[key] = hub.Event()
+        # 已有等待者时也检查：它等待的请求可能已经丢失或超时
+        if not self._stats_outstanding(dpid, kind, time.time()):
+            self.send_stats_request(self.datapaths[dpid], (kind,))
+        if waiter.wait(timeout):
+            return True
+        # 请求已丢失或超时：移除等待者，之后的调用重新发送请求。
+        # 请求仍在途中时保留，其他调用者还在等它的回复
+        if (self._stats_waiters.get(key) is waiter and
+                not self._stats_outstanding(dpid, kind, time.time())):
+            del self._stats_waiters[key]
+        return False
+
+    def _stats_loop(self):
+        """Send flow/port stats requests to every switch once per interval
+
+        Each (switch, kind) pair gets its own randomly offset schedule so
+        requests are spread over the interval instead of sent in one burst,
+        and a switch whose previous reply is still outstanding is skipped.
+        """
+        conf = CONF.traffic_monitor
+        interval = conf.stats_interval
+        jitter = interval * conf.stats_jitter
+        tick = min(1.0, interval / 10.0)
+        while True:
+            now = time.time()
+            for dpid, datapath in list(self.datapaths.items()):
+                for kind in STATS_KINDS:
+                    key = (dpid, kind)
+                    due = self._stats_due.get(key)
+                    if due is None:
+                        # 新连接的交换机：在一个周期内随机选择首次发送时间
+                        self._stats_due[key] = now + random.uniform(0, interval)
+                        continue
+                    if now < due:
+                        continue
+                    due += interval + random.uniform(-jitter, jitter)
+                    self._stats_due[key] = due if due > now else now + interval
+                    if self._stats_outstanding(dpid, kind, now):
+                        self.stats_requests_skipped += 1
+                        continue
+                    self.send_stats_request(datapath, (kind,))
+            hub.sleep(tick)
 
     def start_periodic_stats_request(self):
-        import threading
+        self.threads.append(hub.spawn(self._stats_loop))
 
-        def periodic_stats_request():
-            while True:
-                for dp in self.datapaths.values():
-                    self.send_stats_request(dp)
-                threading.Event().wait(10)
+    def _forget_datapath(self, dpid):
+        """Drop all per-switch state of a disconnected datapath"""
+        self.datapaths.pop(dpid, None)
+        self.flow_stats.pop(dpid, None)
+        self.port_stats.pop(dpid, None)
+        for kind in STATS_KINDS:
+            self._stats_due.pop((dpid, kind), None)
+            self._stats_pending.pop((dpid, kind), None)
+            self._stats_parts.pop((dpid, kind), None)
+            self._stats_updated.pop((dpid, kind), None)
+            waiter = self._stats_waiters.pop((dpid, kind), None)
+            if waiter is not None:
+                waiter.set()
+        self.port_rates.forget(dpid)
+        self.flow_rates.forget(dpid)
+        self._stats_rtt.remove_matching('dpid', dpid)
+        for key in [key for key in self.flow_accounts if key[0] == dpid]:
+            del self.flow_accounts[key]
+        for key in [key for key in self.flow_conversations if key[0] == dpid]:
+            del self.flow_conversations[key]
+        for key in [key for key in self.installed_flows if key[0] == dpid]:
+            del self.installed_flows[key]
+        for key in [key for key in self.pipeline_counters if key[0] == dpid]:
+            del self.pipeline_counters[key]
+        self._pipeline_barriers.pop(dpid, None)
+        self.meter_drops.pop(dpid, None)
+        self.mac_tables.pop(dpid, None)
+        self._log_limiter.forget(lambda key: key[1] == dpid)
 
-        threading.Thread(target=periodic_stats_request).start()
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev):
+        datapath = ev.datapath
+        if datapath.id is None:
+            return
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths.setdefault(datapath.id, datapath)
+        elif ev.state == DEAD_DISPATCHER:
+            # 只有当前登记的连接断开时才清理，避免误删重连后的新连接
+            if self.datapaths.get(datapath.id) is datapath:
+                self.logger.info("交换机 %s 断开连接", datapath.id)
+                self._forget_datapath(datapath.id)
 
     @set_ev_cls(ofp_event.EventOFPFlowStatsReply, MAIN_DISPATCHER)
     def _flow_stats_reply_handler(self, ev):
-        body = ev.msg.body
-        datapath = ev.msg.datapath
+        msg = ev.msg
+        body = msg.body
+        datapath = msg.datapath
         dpid = datapath.id
-        
-        self.flow_stats[dpid] = []
+
+        flows, keys = self._stats_parts.setdefault((dpid, 'flow'), ([], set()))
+        now = time.time()
         for stat in body:
+            if stat.cookie & FLOW_COOKIE_MASK == FLOW_COOKIE_TAG:
+                # 主动模式下的流表项：把计数器增量计入协议统计
+                self._account_flow_counters(dpid, stat.cookie,
+                                            stat.packet_count, stat.byte_count)
+            elif stat.cookie & FLOW_COOKIE_MASK == PIPELINE_COOKIE_TAG:
+                # pipeline 模式的分类流表项
+                self._account_pipeline_counters(dpid, stat.cookie,
+                                                stat.packet_count, stat.byte_count)
+            key = (stat.table_id, stat.priority, stat.cookie, tuple(stat.match.items()))
+            keys.add(key)
             flow_info = {
                 'table_id': stat.table_id,
                 'match': str(stat.match),
                 'duration': stat.duration_sec,
                 'packets': stat.packet_count,
                 'bytes': stat.byte_count,
-                'protocol': self._identify_flow_protocol(stat)
+                'protocol': self.classifier.classify_match(stat.match),
+                'rates': self.flow_rates.update(
+                    dpid, key, (stat.byte_count, stat.packet_count),
+                    duration_of(stat), now)
             }
-            self.flow_stats[dpid].append(flow_info)
-
-    def _identify_flow_protocol(self, flow_stat):
-        """Identify protocol from flow stats"""
-        match_str = str(flow_stat.match)
-        
-        # TCP protocols
-        if 'tp_dst=80' in match_str or 'tp_src=80' in match_str:
-            return 'http'
-        elif 'tp_dst=443' in match_str or 'tp_src=443' in match_str:
-            return 'https'
-        elif 'tp_dst=21' in match_str or 'tp_src=21' in match_str:
-            return 'ftp'
-        elif 'tp_dst=25' in match_str or 'tp_src=25' in match_str:
-            return 'smtp'
-        elif 'tp_dst=110' in match_str or 'tp_src=110' in match_str:
-            return 'pop3'
-        elif 'tp_dst=143' in match_str or 'tp_src=143' in match_str:
-            return 'imap'
-        elif 'tp_dst=22' in match_str or 'tp_src=22' in match_str:
-            return 'ssh'
-        
-        # UDP protocols
-        elif 'tp_dst=53' in match_str or 'tp_src=53' in match_str:
-            return 'dns'
-        elif 'tp_dst=67' in match_str or 'tp_src=67' in match_str or 'tp_dst=68' in match_str or 'tp_src=68' in match_str:
-            return 'dhcp'
-        
-        return 'other'
+            flows.append(flow_info)
+        if msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+        del self._stats_parts[(dpid, 'flow')]
+        self.flow_rates.retain(dpid, keys)
+        self.flow_stats[dpid] = flows
+        self._stats_reply_done(dpid, 'flow')
 
     @set_ev_cls(ofp_event.EventOFPPortStatsReply, MAIN_DISPATCHER)
     def _port_stats_reply_handler(self, ev):
-        body = ev.msg.body
-        datapath = ev.msg.datapath
+        msg = ev.msg
+        body = msg.body
+        datapath = msg.datapath
         dpid = datapath.id
-        
-        self.port_stats[dpid] = []
+
+        ports, keys = self._stats_parts.setdefault((dpid, 'port'), ([], set()))
+        now = time.time()
         for stat in body:
+            keys.add(stat.port_no)
             port_info = {
                 'port_no': stat.port_no,
                 'rx_packets': stat.rx_packets,
@@ -349,9 +1221,38 @@ class TrafficMonitor(app_manager.RyuApp):
                 'rx_bytes': stat.rx_bytes,
                 'tx_bytes': stat.tx_bytes,
                 'rx_errors': stat.rx_errors,
-                'tx_errors': stat.tx_errors
+                'tx_errors': stat.tx_errors,
+                'rates': self.port_rates.update(
+                    dpid, stat.port_no,
+                    (stat.rx_bytes, stat.tx_bytes, stat.rx_packets, stat.tx_packets,
+                     stat.rx_errors, stat.tx_errors, stat.rx_dropped, stat.tx_dropped),
+                    duration_of(stat), now)
             }
-            self.port_stats[dpid].append(port_info)
+            ports.append(port_info)
+        if msg.flags & datapath.ofproto.OFPMPF_REPLY_MORE:
+            return
+        del self._stats_parts[(dpid, 'port')]
+        self.port_rates.retain(dpid, keys)
+        self.port_stats[dpid] = ports
+        self._stats_reply_done(dpid, 'port')
+
+    @set_ev_cls(ofp_event.EventOFPMeterStatsReply, MAIN_DISPATCHER)
+    def _meter_stats_reply_handler(self, ev):
+        dpid = ev.msg.datapath.id
+        for stat in ev.msg.body:
+            if stat.meter_id != CONTROLLER_METER_ID or not stat.band_stats:
+                continue
+            band = stat.band_stats[0]
+            packets, byte_count = band.packet_band_count, band.byte_band_count
+            prev = self.meter_drops.get(dpid, (0, 0))
+            if packets < prev[0]:
+                # meter 被重建，计数器从零开始
+                prev = (0, 0)
+            self.meter_drops[dpid] = (packets, byte_count)
+            if packets > prev[0]:
+                # 交换机丢弃的 packet-in 也计入 unclassified，保证统计总量正确
+                self._update_protocol_stats(UNCLASSIFIED, byte_count - prev[1],
+                                            packets - prev[0])
 
     @set_ev_cls(ofp_event.EventOFPErrorMsg, [MAIN_DISPATCHER, CONFIG_DISPATCHER])
     def error_msg_handler(self, ev):
@@ -364,9 +1265,161 @@ class TrafficMonitor(app_manager.RyuApp):
             # 其他版本处理
             self.logger.error("OFPErrorMsg received: %s", msg)
 
+    def _flush_audit_log(self):
+        """Write summaries appended since the last flush to the audit log"""
+        ring = self.packet_summaries
+        start = max(self._audit_cursor, ring.retained_seq())
+        if start > self._audit_cursor:
+            self.logger.warning("审计日志丢失 %d 条摘要，请调大 summary_capacity",
+                                start - self._audit_cursor)
+        end = ring.total
+        # 先复制出整批记录：写入时封存段会让出，期间新的摘要可能覆盖尚未读取的槽位
+        batch = [ring.values(seq) for seq in range(start, end)]
+        failures = self.audit_log.seal_failures
+        self.audit_log.write(batch)
+        self._audit_cursor = end
+        if self.audit_log.seal_failures > failures:
+            self.logger.error("审计日志段索引写入失败，将在下次写入时重试：%s",
+                              self.audit_log.seal_error)
+
+    def _audit_log_loop(self):
+        interval = CONF.traffic_monitor.audit_flush_interval
+        while True:
+            hub.sleep(interval)
+            try:
+                self._flush_audit_log()
+            except Exception:
+                self.logger.exception("写入审计日志失败")
+
+    def _expire_conversations(self):
+        """End idle conversations and export everything that ended since last time"""
+        self.conversations.expire(time.time())
+        ended = self.conversations.drain()
+        path = CONF.traffic_monitor.conversation_export_path
+        if path:
+            write_ndjson(path, ended)
+
+    def _conversation_loop(self):
+        interval = CONF.traffic_monitor.conversation_export_interval
+        while True:
+            hub.sleep(interval)
+            try:
+                self._expire_conversations()
+            except Exception:
+                self.logger.exception("导出会话记录失败")
+
     def start(self):
         super(TrafficMonitor, self).start()
         self.start_periodic_stats_request()
+        self.threads.append(hub.spawn(self._conversation_loop))
+        if self.intake is not None:
+            self.threads.append(hub.spawn(self._intake_loop))
+        if self.audit_log is not None:
+            self.threads.append(hub.spawn(self._audit_log_loop))
+        if self.publisher is not None:
+            self.threads.append(hub.spawn(self._publish_loop))
+        if self.aggregator is not None:
+            self.threads.append(hub.spawn(self._aggregate_loop))
+        if self.checkpoint is not None:
+            self.threads.append(hub.spawn(self._checkpoint_loop))
+
+    def _publish_state(self):
+        conf = CONF.traffic_monitor
+        switches = [{'dpid': dpid, 'ports': len(self.port_stats.get(dpid, []))}
+                    for dpid in self.datapaths]
+        try:
+            self.publisher.publish(worker_state(
+                conf.worker_id, self.protocol_stats, switches, self.stats_history,
+                self.packet_summaries, conf.publish_summaries))
+        except ValueError as e:
+            self.logger.error("发布状态失败，请增大 scale_segment_mb：%s", e)
+
+    def _publish_loop(self):
+        """Publish this worker's state for the front end"""
+        while True:
+            hub.sleep(CONF.traffic_monitor.publish_interval)
+            self._publish_state()
+
+    def _aggregate_loop(self):
+        """Merge the workers' published state into this front end"""
+        while True:
+            hub.sleep(CONF.traffic_monitor.publish_interval)
+            try:
+                if self.aggregator.refresh():
+                    self.state_epoch += 1
+            except (ValueError, KeyError) as e:
+                # 配置不一致（例如协议映射不同）的 worker 无法合并
+                self.logger.error("合并 worker 状态失败：%s", e)
+
+    def _restore_checkpoint(self, directory):
+        """Load the newest checkpoint in ``directory`` into this app's state"""
+        started = time.perf_counter()
+        try:
+            full, deltas = load_checkpoint(directory)
+        except (OSError, ValueError) as e:
+            self.logger.error("读取检查点失败：%s", e)
+            return
+        if full is None:
+            return
+        errors = self.checkpoint_state.restore(full, deltas)
+        for error in errors:
+            self.logger.warning("检查点中的部分数据与当前配置不一致，已忽略：%s", error)
+        # 恢复的摘要在重启前已经写入审计日志
+        self._audit_cursor = self.packet_summaries.total
+        self.logger.info("从检查点恢复状态（%d 个增量，%d 条摘要，%d 个 MAC 地址），用时 %.2f 秒",
+                         len(deltas), len(self.packet_summaries),
+                         sum(len(table) for table in self.mac_tables.values()),
+                         time.perf_counter() - started)
+
+    def _write_checkpoint(self, full):
+        """Write a full snapshot, or the increment since the previous checkpoint"""
+        with self._checkpoint_lock:
+            full = full or self.checkpoint_full_due or not self.checkpoint.has_full
+            self.checkpoint_full_due = False
+            # 交换机很多时逐个 MAC 表让出，避免长时间阻塞 packet-in 处理
+            state = self.checkpoint_state.capture(full, time.time(), pause=lambda: hub.sleep(0))
+            write = self.checkpoint.write_full if full else self.checkpoint.append_delta
+            started = time.perf_counter()
+            try:
+                # 编码、写盘和 fsync 在操作系统线程中进行，不占用绿色线程
+                size = tpool.execute(write, state)
+            except (OSError, ValueError) as e:
+                self.logger.error("写入检查点失败：%s", e)
+                # 丢失的增量无法补回，下一次改写全量快照
+                self.checkpoint_full_due = True
+                return
+            self.checkpoint_written = time.time()
+            self.logger.debug("写入%s检查点 %d 字节，用时 %.3f 秒", '全量' if full else '增量',
+                              size, time.perf_counter() - started)
+
+    def _checkpoint_loop(self):
+        """Write increments, and periodically a full snapshot, to the checkpoint directory"""
+        conf = CONF.traffic_monitor
+        next_full = 0.0
+        while True:
+            hub.sleep(conf.checkpoint_interval)
+            now = time.time()
+            full = now >= next_full
+            if full:
+                next_full = now + conf.checkpoint_full_interval
+            try:
+                self._write_checkpoint(full)
+            except Exception:
+                self.logger.exception("写入检查点失败")
+
+    def stop(self):
+        if self.checkpoint is not None:
+            self._write_checkpoint(False)
+            self.checkpoint.close()
+        if self.audit_log is not None:
+            self._flush_audit_log()
+            self.audit_log.close()
+        self._expire_conversations()
+        if self.publisher is not None:
+            self.publisher.close()
+        if self.aggregator is not None:
+            self.aggregator.close()
+        super(TrafficMonitor, self).stop()
 
 
 class TrafficMonitorRestApi(ControllerBase):
@@ -374,61 +1427,163 @@ class TrafficMonitorRestApi(ControllerBase):
         super(TrafficMonitorRestApi, self).__init__(req, link, data, **config)
         self.traffic_monitor_app = data['traffic_monitor']
 
-    @route('traffic_monitor', '/stats/flow/{dpid}', methods=['GET'])
-    def list_flow_stats(self, req, dpid, **_kwargs):
+    def _encode(self, endpoint, data):
+        """Encode ``data`` as UTF-8 JSON, recording the encoding time"""
+        started = time.perf_counter()
+        body = json.dumps(data).encode('utf-8')
+        self.traffic_monitor_app.rest_serialize.labels(endpoint).observe(
+            time.perf_counter() - started)
+        return body
+
+    def _json_response(self, endpoint, data):
+        return Response(
+            content_type='application/json; charset=utf-8',
+            body=self._encode(endpoint, data)
+        )
+
+    def _snapshot_response(self, req, endpoint, key, build):
+        """返回共享的已编码响应：同一状态下只编码一次，支持 ETag/304 和 gzip
+
+        ``build()`` 只在缓存的响应过期时才调用，返回要编码的数据。
+        """
+        app = self.traffic_monitor_app
+        snapshot = app.rest_cache.get((endpoint,) + key, app.state_epoch,
+                                      lambda: self._encode(endpoint, build()),
+                                      time.time())
+        gzipped = (len(snapshot.body) >= GZIP_MIN_SIZE and
+                   accepts_gzip(req.headers.get('Accept-Encoding')))
+        etag = snapshot.gzip_etag if gzipped else snapshot.etag
+        if etag_matches(req.headers.get('If-None-Match'),
+                        (snapshot.etag, snapshot.gzip_etag)):
+            resp = Response(status=304)
+        elif gzipped:
+            resp = Response(content_type='application/json; charset=utf-8',
+                            body=snapshot.gzipped)
+            resp.content_encoding = 'gzip'
+        else:
+            resp = Response(content_type='application/json; charset=utf-8',
+                            body=snapshot.body)
+        resp.headers['ETag'] = etag
+        resp.headers['Vary'] = 'Accept-Encoding'
+        # 客户端每次都要带 If-None-Match 重新验证
+        resp.cache_control = 'no-cache'
+        return resp
+
+    def _cached_stats_response(self, req, dpid, kind, cache, key):
+        """返回缓存的交换机统计，不会因为 GET 请求而向交换机发送统计请求
+
+        ?fresh=1&max_age=<秒> 时，如果缓存比 max_age 旧，则等待（最多 timeout 秒）
+        下一次回复；同一交换机的并发请求只会触发一个统计请求。
+        """
+        app = self.traffic_monitor_app
         try:
             dpid = int(dpid)
-            if dpid not in self.traffic_monitor_app.datapaths:
-                return Response(status=404)
-
-            datapath = self.traffic_monitor_app.datapaths[dpid]
-            self.traffic_monitor_app.send_stats_request(datapath)
-            
-            return Response(
-                content_type='application/json',
-                body=json.dumps({
-                    'success': True,
-                    'flows': self.traffic_monitor_app.flow_stats.get(dpid, [])
-                })
-            )
+            fresh = req.GET.get('fresh') in ('1', 'true')
+            max_age = _float_param(req.GET, 'max_age', 0)
+            timeout = min(_float_param(req.GET, 'timeout', 5), 30.0)
         except ValueError:
             return Response(status=400)
+        if dpid not in app.datapaths:
+            return Response(status=404)
+
+        timed_out = False
+        if fresh:
+            timed_out = not app.refresh_stats(dpid, kind, max_age, timeout)
+            if dpid not in app.datapaths:
+                return Response(status=404)
+
+        return self._json_response(kind + '_stats', {
+            'success': True,
+            key: cache.get(dpid, []),
+            'age': app.stats_age(dpid, kind),
+            'timed_out': timed_out
+        })
+
+    @route('traffic_monitor', '/stats/flow/{dpid}', methods=['GET'])
+    def list_flow_stats(self, req, dpid, **_kwargs):
+        return self._cached_stats_response(
+            req, dpid, 'flow', self.traffic_monitor_app.flow_stats, 'flows')
 
     @route('traffic_monitor', '/stats/port/{dpid}', methods=['GET'])
     def list_port_stats(self, req, dpid, **_kwargs):
+        return self._cached_stats_response(
+            req, dpid, 'port', self.traffic_monitor_app.port_stats, 'ports')
+
+    @route('traffic_monitor', '/stats/port/{dpid}/rates', methods=['GET'])
+    def list_port_rates(self, req, dpid, **_kwargs):
+        """获取端口速率（bps / pps / 每秒错误数），不含累计计数器"""
+        app = self.traffic_monitor_app
         try:
             dpid = int(dpid)
-            if dpid not in self.traffic_monitor_app.datapaths:
-                return Response(status=404)
+        except ValueError:
+            return Response(status=400)
+        if dpid not in app.datapaths:
+            return Response(status=404)
+        rates = [
+            dict(port_no=port['port_no'], **(port['rates'] or {}))
+            for port in app.port_stats.get(dpid, [])
+        ]
+        return self._json_response('port_rates', {
+            'success': True,
+            'rates': rates,
+            'age': app.stats_age(dpid, 'port')
+        })
 
-            datapath = self.traffic_monitor_app.datapaths[dpid]
-            self.traffic_monitor_app.send_stats_request(datapath)
-            
-            return Response(
-                content_type='application/json',
-                body=json.dumps({
-                    'success': True,
-                    'ports': self.traffic_monitor_app.port_stats.get(dpid, [])
-                })
-            )
+    @route('traffic_monitor', '/stats/mac/{dpid}', methods=['GET'])
+    def list_mac_table(self, req, dpid, **_kwargs):
+        """获取交换机的 MAC 学习表，最近出现的在前
+
+        例如 /stats/mac/1?port=3&limit=100，age 是距最后一次出现的秒数。
+        """
+        app = self.traffic_monitor_app
+        try:
+            dpid = int(dpid)
+            port = req.GET.get('port')
+            port = int(port) if port is not None else None
+            limit = int(req.GET.get('limit', 1000))
         except ValueError:
             return Response(status=400)
+        if dpid not in app.datapaths:
+            return Response(status=404)
+        table = app.mac_tables.get(dpid)
+        if table is None:
+            table = MacTable(CONF.traffic_monitor.mac_table_size,
+                             CONF.traffic_monitor.mac_aging_time)
+        entries = table.entries(time.time(), port)
+        return self._json_response('mac', {
+            'success': True,
+            'table': table.stats(),
+            'total': len(entries),
+            'entries': entries[:limit]
+        })
 
     @route('traffic_monitor', '/stats/protocol', methods=['GET'])
     def list_protocol_stats(self, req, **_kwargs):
-        """获取协议分类统计"""
+        """获取协议分类统计
+
+        历史数据通过 ?from=<时间戳>&to=<时间戳>&step=<秒> 选择范围，
+        默认返回最近一小时、10 秒一个点的增量。
+        """
+        app = self.traffic_monitor_app
         try:
-            body = json.dumps({
+            now = time.time()
+            end = _float_param(req.GET, 'to', now)
+            start = _float_param(req.GET, 'from', end - 3600)
+            step = int(req.GET.get('step', 10))
+            if step <= 0:
+                raise ValueError('"step" must be positive')
+            # 默认范围随时间滑动，所以缓存键里带上当前所在的时间桶
+            key = (req.GET.get('from'), req.GET.get('to'), step, int(now // step))
+            return self._snapshot_response(req, 'protocol', key, lambda: {
                 'success': True,
-                'protocols': self.traffic_monitor_app.protocol_stats,
-                'history': {
-                    'timestamps': self.traffic_monitor_app.stats_history['timestamps'],
-                    'protocols': self.traffic_monitor_app.stats_history['protocols']
-                }
+                'protocols': app.protocol_stats,
+                'history': app.stats_history.query(start, end, step, now)
             })
+        except ValueError as e:
             return Response(
-                content_type='application/json; charset=utf-8',
-                body=body
+                content_type='text/plain; charset=utf-8',
+                status=400,
+                body=str(e)
             )
         except Exception as e:
             return Response(
@@ -439,21 +1594,86 @@ class TrafficMonitorRestApi(ControllerBase):
     # 新增：获取数据包摘要的 REST API 端点
     @route('traffic_monitor', '/stats/packet_summaries', methods=['GET'])
     def list_packet_summaries(self, req, **_kwargs):
-        """获取数据包摘要列表"""
+        """获取数据包摘要列表
+
+        响应中的 cursor 可以作为下一次请求的 ?since=<cursor>，只返回之后新增的摘要。
+        """
+        app = self.traffic_monitor_app
         try:
             # 可以通过请求参数控制返回的摘要数量，例如 /stats/packet_summaries?limit=50
-            limit = int(req.GET.get('limit', self.traffic_monitor_app.MAX_PACKET_SUMMARIES))
-            # 返回最新的N个数据包摘要
-            summaries_to_send = self.traffic_monitor_app.packet_summaries[-limit:] if limit > 0 else []
+            limit = int(req.GET.get('limit', app.DEFAULT_SUMMARY_LIMIT))
+            since = req.GET.get('since')
+            since = int(since) if since is not None else None
+        except ValueError as e:
+            return Response(
+                content_type='text/plain; charset=utf-8',
+                status=400,
+                body=str(e)
+            )
+        try:
+            def build():
+                ring = app.packet_summaries
+                if since is None:
+                    # 返回最新的N个数据包摘要
+                    return {
+                        'success': True,
+                        'packet_summaries': ring.latest(limit),
+                        'cursor': ring.total
+                    }
+                summaries, skipped = ring.since(since, limit)
+                return {
+                    'success': True,
+                    'packet_summaries': summaries,
+                    'skipped': skipped,
+                    'cursor': ring.total
+                }
 
-            body = json.dumps({
-                'success': True,
-                'packet_summaries': summaries_to_send
-            })
+            return self._snapshot_response(req, 'packet_summaries', (limit, since), build)
+        except Exception as e:
+            return Response(
+                content_type='text/plain; charset=utf-8',
+                status=500,
+                body=str(e)
+            )
+
+    @route('traffic_monitor', '/stats/packet_summaries/search', methods=['GET'])
+    def search_packet_summaries(self, req, **_kwargs):
+        """在持久化审计日志中按时间范围和五元组查询数据包摘要
+
+        例如 /stats/packet_summaries/search?ip_src=10.0.0.1&dst_port=80&from=...&to=...
+        """
+        audit_log = self.traffic_monitor_app.audit_log
+        if audit_log is None:
+            return Response(
+                content_type='text/plain; charset=utf-8',
+                status=404,
+                body='audit log is disabled (set audit_log_dir)'
+            )
+        try:
+            params = req.GET
+            fields = {}
+            for name in ('ip_src', 'ip_dst'):
+                if name in params:
+                    fields[name] = ipv4_int(params[name])
+            for name in ('ip_proto', 'src_port', 'dst_port'):
+                if name in params:
+                    fields[name] = int(params[name])
+            start = _float_param(params, 'from')
+            end = _float_param(params, 'to')
+            limit = min(int(params.get('limit', 1000)), 100000)
+        except (ValueError, OSError) as e:
             return Response(
-                content_type='application/json; charset=utf-8',
-                body=body
+                content_type='text/plain; charset=utf-8',
+                status=400,
+                body=str(e)
             )
+        try:
+            summaries, truncated = audit_log.search(start, end, limit, **fields)
+            return self._json_response('packet_summaries_search', {
+                'success': True,
+                'packet_summaries': summaries,
+                'truncated': truncated
+            })
         except Exception as e:
             return Response(
                 content_type='text/plain; charset=utf-8',
@@ -461,9 +1681,240 @@ class TrafficMonitorRestApi(ControllerBase):
                 body=str(e)
             )
 
+    def _export_chunks(self, chunks):
+        """Pass export chunks through, yielding to other green threads after each"""
+        for chunk in chunks:
+            if chunk:
+                yield chunk
+            # 每块之间让出，导出期间 packet-in 和统计回复照常处理
+            hub.sleep(0)
+
+    @route('traffic_monitor', '/stats/export/{dataset}', methods=['GET'])
+    def export_dataset(self, req, dataset, **_kwargs):
+        """批量导出 summaries（数据包摘要）、flows（当前流表统计）或 history（协议历史数据）
+
+        例如 /stats/export/summaries?format=csv&from=<时间戳>&to=<时间戳>，
+        format 可选 csv / ndjson，安装 pyarrow 后还可以是 arrow / parquet。
+        启用审计日志时摘要从审计日志读取，否则来自内存中的缓冲区；history 还支持 step。
+        响应分块流式发送，内存占用与导出的数据量无关。
+        """
+        app = self.traffic_monitor_app
+        try:
+            params = req.GET
+            fmt = params.get('format', 'csv')
+            start = _float_param(params, 'from')
+            end = _float_param(params, 'to')
+            if dataset == 'summaries':
+                source = app.audit_log if app.audit_log is not None else app.packet_summaries
+                rows = summary_rows(source.iter_range(start, end), source.labels)
+                columns = SUMMARY_COLUMNS
+            elif dataset == 'flows':
+                rows = flow_rows(app.flow_stats)
+                columns = FLOW_COLUMNS
+            elif dataset == 'history':
+                now = time.time()
+                end = now if end is None else end
+                start = end - 3600 if start is None else start
+                step = int(params.get('step', 10))
+                if step <= 0:
+                    raise ValueError('"step" must be positive')
+                rows = history_rows(app.stats_history.query(start, end, step, now))
+                columns = HISTORY_COLUMNS
+            else:
+                return Response(status=404)
+            chunks = encode(rows, columns, fmt)
+        except ValueError as e:
+            return Response(
+                content_type='text/plain; charset=utf-8',
+                status=400,
+                body=str(e)
+            )
+        resp = Response(
+            content_type=EXPORT_CONTENT_TYPES[fmt],
+            app_iter=self._export_chunks(chunks)
+        )
+        resp.headers['Content-Disposition'] = 'attachment; filename="%s.%s"' % (
+            dataset, EXTENSIONS[fmt])
+        return resp
+
+    @route('traffic_monitor', '/stats/shedding', methods=['GET'])
+    def shedding_stats(self, req, **_kwargs):
+        """获取过载保护的丢弃统计：控制器队列和交换机 meter"""
+        app = self.traffic_monitor_app
+        return self._json_response('shedding', {
+            'success': True,
+            'queue': app.intake.stats() if app.intake is not None else None,
+            'meter': {
+                'rate_limit': CONF.traffic_monitor.packet_in_rate_limit,
+                'dropped': dict(
+                    (dpid, {'packets': drops[0], 'bytes': drops[1]})
+                    for dpid, drops in app.meter_drops.items()
+                )
+            },
+            'unclassified': app.protocol_stats[UNCLASSIFIED]
+        })
+
+    @route('traffic_monitor', '/stats/alerts', methods=['GET'])
+    def list_alerts(self, req, **_kwargs):
+        """获取异常检测告警
+
+        例如 /stats/alerts?since=1700000000&type=syn_flood&limit=100，按时间顺序返回最近的告警。
+        type 可选 port_scan / syn_flood / dns_amplification。
+        """
+        app = self.traffic_monitor_app
+        try:
+            since = _float_param(req.GET, 'since', 0)
+            limit = int(req.GET.get('limit', 100))
+            if limit <= 0:
+                raise ValueError('"limit" must be positive')
+        except ValueError as e:
+            return Response(
+                content_type='text/plain; charset=utf-8',
+                status=400,
+                body=str(e)
+            )
+        kind = req.GET.get('type')
+        alerts = [a for a in app.alerts
+                  if a['time'] > since and (kind is None or a['type'] == kind)]
+        now = time.time()
+        return self._json_response('alerts', {
+            'success': True,
+            'enabled': app.detector is not None,
+            'active': sum(1 for a in alerts
+                          if a['blocked_until'] is not None and a['blocked_until'] > now),
+            'alerts': alerts[-limit:]
+        })
+
+    @route('traffic_monitor', '/stats/top', methods=['GET'])
+    def list_top_talkers(self, req, **_kwargs):
+        """获取最近一段时间内字节数最多的地址或端口
+
+        例如 /stats/top?key=ip_src&window=60&n=20，key 可选 ip_src / ip_dst / src_port / dst_port。
+        结果是估计值（可能略微偏大），窗口按 top_slot_seconds 取整。
+        """
+        app = self.traffic_monitor_app
+        conf = CONF.traffic_monitor
+        try:
+            key = req.GET.get('key', 'ip_src')
+            if key not in TOP_KEYS:
+                raise ValueError('"key" must be one of %s' % ', '.join(sorted(TOP_KEYS)))
+            window = _float_param(req.GET, 'window', 60)
+            if not 0 < window <= conf.top_window:
+                raise ValueError('"window" must be between 0 and %d' % conf.top_window)
+            n = min(int(req.GET.get('n', 20)), conf.top_capacity)
+        except ValueError as e:
+            return Response(
+                content_type='text/plain; charset=utf-8',
+                status=400,
+                body=str(e)
+            )
+        return self._json_response('top', {
+            'success': True,
+            'key': key,
+            'window': window,
+            'top': app.top_talkers.top(key, n, window, time.time())
+        })
+
+    @route('traffic_monitor', '/stats/conversations', methods=['GET'])
+    def list_conversations(self, req, **_kwargs):
+        """获取按五元组聚合的会话（活动的和最近结束的）
+
+        例如 /stats/conversations?state=active&sort=bytes&limit=20&dpid=1，
+        state 可选 active / expired / all，sort 可选 bytes / packets / last_seen / duration。
+        """
+        app = self.traffic_monitor_app
+        try:
+            params = req.GET
+            state = params.get('state', 'all')
+            if state not in ('active', 'expired', 'all'):
+                raise ValueError('"state" must be active, expired or all')
+            sort = params.get('sort', 'bytes')
+            if sort not in SORT_FIELDS:
+                raise ValueError('"sort" must be one of %s' % ', '.join(SORT_FIELDS))
+            limit = min(int(params.get('limit', 100)), 10000)
+            dpid = int(params['dpid']) if 'dpid' in params else None
+        except ValueError as e:
+            return Response(
+                content_type='text/plain; charset=utf-8',
+                status=400,
+                body=str(e)
+            )
+        table = app.conversations
+        # 查询前先结束已经空闲超时的会话，避免把它们当作活动会话返回
+        table.expire(time.time())
+        result = {'success': True, 'active_count': len(table), 'evicted': table.evicted}
+        if state in ('active', 'all'):
+            result['active'] = table.active(sort, limit, dpid)
+        if state in ('expired', 'all'):
+            result['expired'] = table.expired(sort, limit, dpid)
+        return self._json_response('conversations', result)
+
+    def _stream_events(self, session, interval):
+        """Yield Server-Sent Events frames for one client until it disconnects"""
+        yield b'retry: 3000\n\n'
+        idle = 0.0
+        while True:
+            frame = session.next_frame()
+            if frame is not None:
+                idle = 0.0
+                yield ('id: %d\nevent: update\ndata: %s\n\n' % (
+                    frame['cursor'], json.dumps(frame))).encode('utf-8')
+            else:
+                idle += interval
+                if idle >= 15:
+                    # 心跳，防止代理关闭空闲连接
+                    idle = 0.0
+                    yield b': keepalive\n\n'
+            # 写入阻塞（客户端读得慢）时不会进入下一轮，下一帧会合并这段时间的变化
+            hub.sleep(interval)
+
+    def _stream_closed(self):
+        self.traffic_monitor_app.stream_clients -= 1
+
+    @route('traffic_monitor', '/stats/stream', methods=['GET'])
+    def stream_stats(self, req, **_kwargs):
+        """以 Server-Sent Events 推送协议计数变化和新的数据包摘要
+
+        ?cursor=<序号> 从指定摘要序号之后开始推送（用于断线重连），默认只推送新摘要。
+        """
+        app = self.traffic_monitor_app
+        conf = CONF.traffic_monitor
+        if app.stream_clients >= conf.stream_max_clients:
+            return Response(status=503, body='too many stream clients')
+        try:
+            cursor = req.GET.get('cursor', req.headers.get('Last-Event-ID'))
+            cursor = int(cursor) if cursor is not None else None
+            fps = min(_float_param(req.GET, 'fps', conf.stream_fps), conf.stream_fps)
+            if fps <= 0:
+                raise ValueError('"fps" must be positive')
+        except ValueError:
+            return Response(status=400)
+
+        session = StreamSession(app.packet_summaries, app.protocol_stats,
+                                cursor, conf.stream_max_batch)
+        # eventlet 默认会攒够 4KB 才写出，流式响应需要立即发送
+        req.environ['eventlet.minimum_write_chunk_size'] = 0
+        resp = Response(
+            content_type='text/event-stream',
+            cache_control='no-cache',
+            app_iter=StreamBody(self._stream_events(session, 1.0 / fps), self._stream_closed)
+        )
+        resp.headers['X-Accel-Buffering'] = 'no'
+        # 在返回响应前占用名额，同时到达的请求不会都通过上限检查；
+        # 流结束或服务器关闭响应（包括从未开始迭代）时释放
+        app.stream_clients += 1
+        return resp
+
     @route('traffic_monitor', '/stats/clear', methods=['POST'])
     def clear_stats(self, req, **_kwargs):
         """Clear all statistics"""
+        if self.traffic_monitor_app.aggregator is not None:
+            # frontend 的统计每次都从 worker 重新合并，需要分别清空各个 worker
+            return Response(
+                content_type='text/plain; charset=utf-8',
+                status=409,
+                body='statistics are merged from the workers; clear each worker instead'
+            )
         try:
             # Reset protocol stats
             for proto in self.traffic_monitor_app.protocol_stats:
@@ -471,12 +1922,19 @@ class TrafficMonitorRestApi(ControllerBase):
                 self.traffic_monitor_app.protocol_stats[proto]['bytes'] = 0
             
             # Reset history
-            self.traffic_monitor_app.stats_history = {
-                'protocols': [],
-                'timestamps': []
-            }
+            self.traffic_monitor_app.stats_history.clear()
             # 新增：清空数据包摘要
-            self.traffic_monitor_app.packet_summaries = []
+            self.traffic_monitor_app.packet_summaries.clear()
+            self.traffic_monitor_app.conversations.clear()
+            self.traffic_monitor_app.top_talkers.clear()
+            self.traffic_monitor_app.alerts.clear()
+            if self.traffic_monitor_app.detector is not None:
+                # 同时清空检测窗口和已告警记录，清空后同一攻击会重新告警
+                self.traffic_monitor_app.detector.clear()
+            # 增量只记录变化，清空后的状态需要写一次全量快照
+            self.traffic_monitor_app.checkpoint_full_due = True
+            self.traffic_monitor_app.state_epoch += 1
+            self.traffic_monitor_app.rest_cache.clear()
             
             return Response(
                 content_type='application/json',
@@ -493,12 +1951,20 @@ class TrafficMonitorRestApi(ControllerBase):
                 {'dpid': dpid, 'ports': len(self.traffic_monitor_app.port_stats.get(dpid, []))}
                 for dpid in self.traffic_monitor_app.datapaths
             ]
-            return Response(
-                content_type='application/json; charset=utf-8',
-                body=json.dumps({
-                    'success': True,
-                    'switches': switches
-                })
-            )
+            if self.traffic_monitor_app.aggregator is not None:
+                # frontend：各个 worker 连接的交换机
+                switches.extend(self.traffic_monitor_app.aggregator.switches)
+            return self._json_response('switch', {
+                'success': True,
+                'switches': switches
+            })
         except Exception as e:
             return Response(status=500, body=str(e))
+
+    @route('traffic_monitor', '/metrics', methods=['GET'])
+    def metrics(self, req, **_kwargs):
+        """Prometheus 文本格式的运行指标"""
+        return Response(
+            content_type=METRICS_CONTENT_TYPE,
+            body=self.traffic_monitor_app.metrics.render()
+        )